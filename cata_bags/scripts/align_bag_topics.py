@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+align_bag_topics.py - Aligns bag topics in time into one table
+
+Usage: align_bag_topics.py [options] bag topic[:field,field...] ...
+
+The topics are extracted with cata_bags.bag_columns (cached in <bag>.columns) and
+aligned with cata_bags.align: each message of the pivot topic, the one with the
+fewest messages unless --pivot or --rate is given, is matched with the closest
+message of every other topic within the tolerance, and kept only if all of them
+match. Continuous signals given with --interpolate are interpolated at the pivot
+times instead; --angle marks the fields that wrap around.
+
+  align_bag_topics.py data/run.bag /base_odom:pose.pose.position.x,pose.pose.position.y \
+      /fix:latitude,longitude --tolerance /fix=0.5 --csv odom_fix.csv
+  align_bag_topics.py data/run.bag /base_odom:pose.pose.orientation.z,pose.pose.orientation.w \
+      /compassData:yaw --interpolate /compassData --angle /compassData:yaw=360 --npz heading.npz
+"""
+
+import roslib; roslib.load_manifest('cata_bags')
+
+from optparse import OptionParser
+import sys
+
+import numpy
+
+from cata_bags.align import alignColumns, topicStamps
+from cata_bags.bag_columns import BagIndex, bagColumns, defaultCacheDirectory, fieldNames
+
+def parseSelection(arguments):
+    """{topic: [fields] or None} from topic[:field,field] arguments"""
+    selection = {}
+    for argument in arguments:
+        topic, _, fields = argument.partition(':')
+        selection[topic] = [field for field in fields.split(',') if field] or None
+    return selection
+
+def parseTolerances(default, arguments):
+    """{topic: tolerance, None: default} from topic=seconds arguments"""
+    tolerances = {None: default}
+    for argument in arguments:
+        topic, _, value = argument.rpartition('=')
+        tolerances[topic] = float(value)
+    return tolerances
+
+def parsePeriods(arguments):
+    """{(topic, field): period} from topic:field=period arguments"""
+    periods = {}
+    for argument in arguments:
+        name, _, value = argument.rpartition('=')
+        topic, _, field = name.partition(':')
+        periods[(topic, field)] = float(value)
+    return periods
+
+def table(aligned):
+    """(names, columns, formats) of the numeric aligned columns, 'topic/field' and one column per element of the 2-D ones"""
+    names = []
+    values = []
+    formats = []
+    for topic in sorted(aligned):
+        for field in sorted(aligned[topic]):
+            column = aligned[topic][field]
+            if column.dtype.kind not in 'iufb':
+                continue # strings
+            column = column.reshape(len(column), -1)
+            for i in xrange(column.shape[1]):
+                names.append(topic.strip('/') + '/' + field + ('[%d]' % i if column.shape[1] > 1 else ''))
+                values.append(column[:, i])
+                formats.append('%.6f' if field in ('t', 'stamp') or field.endswith('.stamp') else '%.9g')
+    return names, values, formats
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] bag topic[:field,field...] ...")
+    parser.add_option('--tolerance', action='append', default=[], metavar='[TOPIC=]SECONDS',
+                      help="seconds a message may be from the pivot, for all topics or for one, may repeat [0.05]")
+    parser.add_option('--pivot', help="topic whose messages define the tuples [the one with the fewest messages]")
+    parser.add_option('--rate', type='float', help="use a fixed rate grid in Hz as the pivot instead of a topic")
+    parser.add_option('--interpolate', action='append', default=[], metavar='TOPIC',
+                      help="interpolate the fields of a continuous topic instead of matching messages, may repeat")
+    parser.add_option('--angle', action='append', default=[], metavar='TOPIC:FIELD=PERIOD',
+                      help="an interpolated field wrapping at a period, 360 for degrees, may repeat")
+    parser.add_option('--receive-time', action='store_true', help="align on the receive times rather than the header stamps")
+    parser.add_option('--reuse', action='store_true', help="allow a message in several tuples")
+    parser.add_option('--npz', help="write the aligned columns to an .npz file, keys are topic/field")
+    parser.add_option('--csv', help="write the numeric aligned columns to a CSV file")
+    parser.add_option('--cache-dir', help="where the columns are cached [<bag>.columns]")
+    options, args = parser.parse_args()
+    if len(args) < 3:
+        parser.error("expected a bag and at least two topics")
+    path = args[0]
+    default_tolerance = 0.05
+    topic_tolerances = []
+    for argument in options.tolerance:
+        if '=' in argument:
+            topic_tolerances.append(argument)
+        else:
+            default_tolerance = float(argument)
+    tolerances = parseTolerances(default_tolerance, topic_tolerances)
+    stamp_field = 't' if options.receive_time else 'header.stamp'
+
+    selection = parseSelection(args[1:])
+    index = BagIndex.open(path, options.cache_dir or defaultCacheDirectory(path))
+    for topic, fields in selection.items():
+        if fields is None or options.receive_time or 'header.stamp' in fields or topic not in index.topics:
+            continue
+        # Topics without a header, such as /compassData, are aligned on their receive times
+        topic_index = index.topics[topic]
+        if 'header.stamp' in fieldNames(topic_index.datatype, topic_index.definition):
+            selection[topic] = fields + ['header.stamp']
+    try:
+        columns = bagColumns(path, selection, options.cache_dir)
+    except ValueError, e:
+        sys.exit(str(e))
+
+    pivot = options.pivot
+    if options.rate:
+        stamps = [topicStamps(columns[topic], stamp_field) for topic in columns if len(columns[topic]['t'])]
+        start = max(topic_stamps.min() for topic_stamps in stamps)
+        stop = min(topic_stamps.max() for topic_stamps in stamps)
+        pivot = numpy.arange(start, stop, 1.0 / options.rate)
+    try:
+        times, aligned = alignColumns(columns, tolerances, pivot, options.interpolate, parsePeriods(options.angle),
+                                      stamp_field, unique=not options.reuse)
+    except ValueError, e:
+        sys.exit(str(e))
+
+    print "%d tuples" % len(times)
+    for topic in sorted(columns):
+        count = len(columns[topic]['t'])
+        if topic in options.interpolate:
+            print "  %-30s %8d messages, interpolated" % (topic, count)
+            continue
+        offsets = numpy.abs(aligned[topic]['stamp'] - times)
+        print "  %-30s %8d messages, %5.1f%% in tuples, offset median %.4f s, max %.4f s" % (topic, count,
+              100.0 * len(times) / max(count, 1), numpy.median(offsets) if len(offsets) else 0.0,
+              offsets.max() if len(offsets) else 0.0)
+    if options.npz:
+        arrays = {'time': times}
+        for topic in aligned:
+            for field in aligned[topic]:
+                arrays[topic.strip('/') + '/' + field] = aligned[topic][field]
+        numpy.savez(options.npz, **arrays)
+    if options.csv:
+        names, values, formats = table(aligned)
+        out = open(options.csv, 'w')
+        out.write(','.join(['time'] + names) + '\n')
+        numpy.savetxt(out, numpy.column_stack([times] + values), delimiter=',', fmt=['%.6f'] + formats)
+        out.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+extract_bag_columns.py - Extracts bag topics into columnar NumPy arrays
+
+Usage: extract_bag_columns.py [options] bag [topic[:field,field...]] ...
+
+Without topics every topic is extracted, without fields every field that can be.
+The columns are cached in <bag>.columns as .npy files, one directory per topic, so
+later runs and cata_bags.bag_columns.bagColumns() load them without parsing the bag
+again. Topics are extracted in parallel, one process per topic.
+
+  extract_bag_columns.py --list data/cata_compass_laser_odom.bag
+  extract_bag_columns.py data/run.bag /compassData:yaw /base_odom:pose.pose.position.x,pose.pose.position.y
+  extract_bag_columns.py --npz run.npz data/run.bag /scan:header.stamp,ranges
+"""
+
+import roslib; roslib.load_manifest('cata_bags')
+
+from optparse import OptionParser
+import sys
+
+import numpy
+
+from cata_bags.bag_columns import BagIndex, bagColumns, defaultCacheDirectory, fieldNames
+
+def parseSelection(arguments):
+    """{topic: [fields] or None} from topic[:field,field] arguments"""
+    selection = {}
+    for argument in arguments:
+        topic, _, fields = argument.partition(':')
+        selection[topic] = [field for field in fields.split(',') if field] or None
+    return selection
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] bag [topic[:field,field...]] ...")
+    parser.add_option('--list', action='store_true', help="list the topics and their fields")
+    parser.add_option('--npz', help="also write the columns to one .npz file, keys are topic/field")
+    parser.add_option('--cache-dir', help="where the index and the columns are cached [<bag>.columns]")
+    parser.add_option('--processes', type='int', help="worker processes [one per CPU]")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("expected a bag")
+    path = args[0]
+    cache_directory = options.cache_dir or defaultCacheDirectory(path)
+
+    index = BagIndex.open(path, cache_directory)
+    if options.list:
+        for topic in sorted(index.topics):
+            topic_index = index.topics[topic]
+            print "%s  %s  %d messages" % (topic, topic_index.datatype, len(topic_index))
+            try:
+                for field in fieldNames(topic_index.datatype, topic_index.definition):
+                    print "    %s" % field
+            except ValueError, e:
+                print "    (%s)" % e
+        sys.exit(0)
+
+    selection = parseSelection(args[1:]) or dict((topic, None) for topic in index.topics)
+    try:
+        columns = bagColumns(path, selection, cache_directory, options.processes)
+    except ValueError, e:
+        sys.exit(str(e))
+    arrays = {}
+    for topic in sorted(columns):
+        print "%s: %d messages" % (topic, len(columns[topic]['t']))
+        for name in sorted(columns[topic]):
+            values = columns[topic][name]
+            print "    %-40s %-10s %s" % (name, values.dtype, values.shape)
+            arrays[topic.strip('/') + '/' + name] = values
+    if options.npz:
+        numpy.savez(options.npz, **arrays)
+    print "Columns cached in %s" % cache_directory
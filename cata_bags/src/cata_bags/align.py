@@ -0,0 +1,213 @@
+"""
+align.py - Approximate time alignment of recorded topics
+
+Matches the messages of several topics in time, for analyses such as the odometry
+against the GPS or the heading against the compass. Every function works on sorted
+arrays of stamps in seconds, one per topic, as cata_bags.bag_columns extracts them,
+and never loops over the messages in Python:
+
+  nearest()      index of the closest message of a topic for each reference time, by
+                 one searchsorted over the sorted stamps
+  keepClosest()  when several reference times matched the same message, keeps only
+                 the closest match; the matches of sorted references are sorted, so
+                 the duplicates are runs and this is linear
+  interpolate()  linear interpolation of a continuous signal (pose, heading, speed)
+                 at the reference times, optionally of an angle wrapping at a period
+  synchronize()  tuples of one message per topic, every message within its topic's
+                 tolerance of a pivot message
+  alignColumns() synchronize() and interpolate() over the columns of bagColumns()
+
+Matching N reference times against M stamps costs one O(N log M) searchsorted plus
+linear passes, so runs with millions of messages align in about a second.
+"""
+
+import numpy
+
+def isSorted(stamps):
+    """True if stamps never decrease"""
+    stamps = numpy.asarray(stamps)
+    return len(stamps) < 2 or bool((stamps[1:] >= stamps[:-1]).all())
+
+def nearest(reference, stamps, tolerance=numpy.inf):
+    """Index into stamps of the closest stamp to each reference time, -1 where none is within tolerance
+
+    stamps must be sorted, reference need not be. A time halfway between two stamps
+    matches the earlier one.
+    """
+    reference = numpy.asarray(reference, numpy.float64)
+    stamps = numpy.asarray(stamps, numpy.float64)
+    if len(stamps) == 0:
+        return numpy.zeros(len(reference), numpy.int64) - 1
+    right = numpy.minimum(numpy.searchsorted(stamps, reference), len(stamps) - 1)
+    left = numpy.maximum(right - 1, 0)
+    closest = numpy.where(numpy.abs(stamps[right] - reference) < numpy.abs(reference - stamps[left]), right, left)
+    closest = closest.astype(numpy.int64)
+    closest[numpy.abs(stamps[closest] - reference) > tolerance] = -1
+    return closest
+
+def keepClosest(indices, errors):
+    """Keeps only the closest of the matches of a message matched several times, the others become -1
+
+    indices are the matches of sorted reference times (from nearest()) and errors
+    their distances in time; the valid indices are then sorted, so the matches of one
+    message are contiguous.
+    """
+    indices = numpy.asarray(indices, numpy.int64)
+    result = numpy.zeros(len(indices), numpy.int64) - 1
+    valid = numpy.flatnonzero(indices >= 0)
+    if len(valid) == 0:
+        return result
+    matched = indices[valid]
+    errors = numpy.abs(numpy.asarray(errors, numpy.float64)[valid])
+    starts = numpy.flatnonzero(numpy.concatenate(([True], matched[1:] != matched[:-1])))
+    run = numpy.cumsum(numpy.concatenate(([0], (matched[1:] != matched[:-1]).astype(numpy.int64))))
+    best = numpy.minimum.reduceat(errors, starts)
+    # The first match of each run with the smallest error
+    candidates = numpy.flatnonzero(errors == best[run])
+    first = numpy.concatenate(([True], run[candidates[1:]] != run[candidates[:-1]]))
+    chosen = valid[candidates[first]]
+    result[chosen] = indices[chosen]
+    return result
+
+def wrap(values, period):
+    """Wraps angles to [-period / 2, period / 2)"""
+    return numpy.mod(values + period / 2.0, period) - period / 2.0
+
+def interpolate(reference, stamps, values, tolerance=numpy.inf, period=None):
+    """Values linearly interpolated at the reference times, NaN where no stamp is within tolerance
+
+    stamps must be sorted. values is (M,) or (M, K). Reference times before the first
+    or after the last stamp are NaN too, the signal is not extrapolated. With a period
+    (360.0 for degrees, 2 pi for radians) the values are angles and interpolate the
+    short way around, the result is wrapped to [-period / 2, period / 2).
+    """
+    reference = numpy.asarray(reference, numpy.float64)
+    stamps = numpy.asarray(stamps, numpy.float64)
+    values = numpy.asarray(values, numpy.float64)
+    result = numpy.empty((len(reference),) + values.shape[1:])
+    result.fill(numpy.nan)
+    if len(stamps) < 2:
+        if len(stamps) == 1:
+            result[reference == stamps[0]] = values[0]
+        return result
+    after = numpy.clip(numpy.searchsorted(stamps, reference, 'right'), 1, len(stamps) - 1)
+    before = after - 1
+    t0 = stamps[before]
+    t1 = stamps[after]
+    span = t1 - t0
+    weight = numpy.where(span > 0, (reference - t0) / numpy.where(span > 0, span, 1.0), 0.0)
+    weight = weight.reshape((-1,) + (1,) * (values.ndim - 1))
+    v0 = values[before]
+    delta = values[after] - v0
+    if period is not None:
+        delta = wrap(delta, period)
+    interpolated = v0 + weight * delta
+    if period is not None:
+        interpolated = wrap(interpolated, period)
+    inside = (reference >= stamps[0]) & (reference <= stamps[-1]) & \
+             (numpy.minimum(reference - t0, t1 - reference) <= tolerance)
+    result[inside] = interpolated[inside]
+    return result
+
+def topicTolerance(tolerances, topic):
+    """Tolerance of a topic from one tolerance for all or a {topic: tolerance} with an optional None default"""
+    if isinstance(tolerances, dict):
+        return tolerances.get(topic, tolerances.get(None, numpy.inf))
+    return tolerances
+
+def synchronize(stamps, tolerances, pivot=None, unique=True):
+    """Returns (times, {topic: indices}) of the tuples of one message per topic
+
+    stamps is {topic: sorted stamps}. Every message of the pivot topic, by default
+    the one with the fewest messages, is matched with the closest message of each
+    other topic within that topic's tolerance (see topicTolerance()); pivot messages
+    missing a match in any topic are dropped. The pivot may also be an array of
+    sorted times, e.g. a fixed rate grid, then every topic is matched to it. With
+    unique, a message is used in at most one tuple, the one it is closest to.
+    """
+    for topic, topic_stamps in stamps.items():
+        if not isSorted(topic_stamps):
+            raise ValueError("the stamps of %s are not sorted" % topic)
+    if pivot is None:
+        pivot = min(stamps, key=lambda topic: (len(stamps[topic]), topic))
+    if isinstance(pivot, basestring):
+        times = numpy.asarray(stamps[pivot], numpy.float64)
+        indices = {pivot: numpy.arange(len(times), dtype=numpy.int64)}
+    else:
+        times = numpy.asarray(pivot, numpy.float64)
+        if not isSorted(times):
+            raise ValueError("the pivot times are not sorted")
+        indices = {}
+    keep = numpy.ones(len(times), bool)
+    for topic, topic_stamps in stamps.items():
+        if topic in indices:
+            continue
+        topic_stamps = numpy.asarray(topic_stamps, numpy.float64)
+        matches = nearest(times, topic_stamps, topicTolerance(tolerances, topic))
+        if unique and len(topic_stamps):
+            matches = keepClosest(matches, topic_stamps[numpy.maximum(matches, 0)] - times)
+        indices[topic] = matches
+        keep &= matches >= 0
+    return times[keep], dict((topic, matches[keep]) for topic, matches in indices.items())
+
+def topicStamps(columns, stamp_field='header.stamp'):
+    """Stamps of a topic's columns: stamp_field when extracted and never empty, the receive time 't' otherwise"""
+    if stamp_field in columns:
+        stamps = numpy.asarray(columns[stamp_field], numpy.float64)
+        if stamps.ndim == 1 and (stamps != 0).all():
+            return stamps
+    return numpy.asarray(columns['t'], numpy.float64)
+
+def alignColumns(columns, tolerances, pivot=None, interpolated=(), periods=None, stamp_field='header.stamp', unique=True):
+    """Aligns the columns of bagColumns(), returns (times, {topic: {field: aligned column}})
+
+    The topics in interpolated are continuous signals: their fields are interpolated
+    at the tuple times (see interpolate()), periods gives the period of the angular
+    ones as {(topic, field): period}, and tuples where one of them is NaN are dropped.
+    The other topics are matched by synchronize(). Every topic gets a 'stamp' column,
+    the stamp of its matched message or the tuple time for the interpolated ones.
+    Stamps that are out of order, like header stamps of a bag recorded from several
+    machines, are sorted first.
+    """
+    periods = periods or {}
+    stamps = {}
+    orders = {}
+    for topic in columns:
+        topic_stamps = topicStamps(columns[topic], stamp_field)
+        if not isSorted(topic_stamps):
+            orders[topic] = numpy.argsort(topic_stamps, kind='mergesort')
+            topic_stamps = topic_stamps[orders[topic]]
+        stamps[topic] = topic_stamps
+    matched = dict((topic, topic_stamps) for topic, topic_stamps in stamps.items() if topic not in interpolated)
+    if not matched and pivot is None:
+        raise ValueError("at least one topic must be matched rather than interpolated")
+    times, indices = synchronize(matched, tolerances, pivot, unique)
+
+    aligned = {}
+    keep = numpy.ones(len(times), bool)
+    for topic in interpolated:
+        aligned[topic] = {'stamp': times}
+        order = orders.get(topic)
+        for field, values in columns[topic].items():
+            if field.endswith('.lengths') or (field + '.lengths') in columns[topic]:
+                continue # ragged arrays do not have one row per message
+            if field in ('t', stamp_field) or numpy.asarray(values).dtype.kind not in 'iufb':
+                continue
+            values = numpy.asarray(values)
+            if order is not None:
+                values = values[order]
+            result = interpolate(times, stamps[topic], values, topicTolerance(tolerances, topic), periods.get((topic, field)))
+            aligned[topic][field] = result
+            keep &= ~numpy.isnan(result.reshape(len(times), -1)).any(axis=1)
+    for topic, matches in indices.items():
+        order = orders.get(topic)
+        rows = matches if order is None else order[matches]
+        aligned[topic] = {'stamp': stamps[topic][matches]}
+        for field, values in columns[topic].items():
+            if field.endswith('.lengths') or (field + '.lengths') in columns[topic]:
+                continue # ragged arrays do not have one row per message
+            aligned[topic][field] = numpy.asarray(values)[rows]
+    for topic in aligned:
+        for field in aligned[topic]:
+            aligned[topic][field] = aligned[topic][field][keep]
+    return times[keep], aligned
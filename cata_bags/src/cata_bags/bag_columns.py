@@ -0,0 +1,656 @@
+"""
+bag_columns.py - Streaming extraction of bag topics into columnar NumPy arrays
+
+Reads the rosbag 2.0 format directly through a memory map instead of deserializing
+every message into Python objects:
+
+  1. The index section at the end of the bag (connection and chunk info records) and
+     the index data records after every chunk give the chunk, offset and time of every
+     message of every connection. This is one pass over the record headers, the
+     message data is not touched. The index is cached next to the bag.
+  2. The message definition of a topic is compiled into a list of steps (fixed size
+     runs, strings, primitive arrays). The steps are applied to the offsets of many
+     messages at once, so every selected field is one NumPy gather over the mapped
+     file for all the messages in uncompressed chunks, whatever their number, and one
+     per chunk for compressed chunks, which are decompressed one at a time so only one
+     is held in memory.
+  3. Each topic is extracted in its own process and its columns are saved as .npy
+     files in the cache, where later queries load them memory mapped.
+
+Fields are named by their dotted path in the message, 'pose.pose.position.x',
+'header.stamp' or 'ranges'. time and duration fields become float64 seconds, fixed
+arrays become 2-D columns, variable arrays are 2-D when every message has the same
+length and flat with a '<field>.lengths' column otherwise, and strings become
+fixed width byte strings. The receive time of every message in the bag is the 't'
+column.
+
+Uncompressed and bz2 chunks are supported; bags that were not closed cleanly have
+no index and need 'rosbag reindex' first.
+"""
+
+import bz2
+import json
+import mmap
+import os
+import struct
+from multiprocessing import Pool, cpu_count
+
+import numpy
+
+VERSION_LINE = '#ROSBAG V2.0\n'
+CACHE_VERSION = 1
+
+OP_MSG_DATA = 0x02
+OP_BAG_HEADER = 0x03
+OP_INDEX_DATA = 0x04
+OP_CHUNK = 0x05
+OP_CHUNK_INFO = 0x06
+OP_CONNECTION = 0x07
+
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+
+# Primitive types and their NumPy dtypes, time and duration are handled apart
+PRIMITIVES = {
+    'bool': '<u1', 'uint8': '<u1', 'char': '<u1', 'byte': '<i1', 'int8': '<i1',
+    'int16': '<i2', 'uint16': '<u2', 'int32': '<i4', 'uint32': '<u4',
+    'int64': '<i8', 'uint64': '<u8', 'float32': '<f4', 'float64': '<f8',
+    'time': '<u4', 'duration': '<i4',
+}
+TIME_TYPES = ('time', 'duration')
+DEFINITION_SEPARATOR = '=' * 80
+GATHER_BLOCK = 1 << 20 # bytes gathered per block
+
+###  Bag format  ###
+
+def readFields(buff, start, length):
+    """Returns the name=value fields of a record or connection header as a dictionary"""
+    fields = {}
+    position = start
+    end = start + length
+    while position + 4 <= end:
+        size = UINT32.unpack_from(buff, position)[0]
+        position += 4
+        field = buff[position:position + size]
+        position += size
+        name, _, value = field.partition('=')
+        fields[name] = value
+    return fields
+
+def readRecord(buff, position):
+    """Returns (header fields, data start, data length, next record position) of the record at position"""
+    header_length = UINT32.unpack_from(buff, position)[0]
+    header = readFields(buff, position + 4, header_length)
+    data_length = UINT32.unpack_from(buff, position + 4 + header_length)[0]
+    data_start = position + 8 + header_length
+    return header, data_start, data_length, data_start + data_length
+
+def openBag(path):
+    """Maps a bag read only and checks its version line"""
+    f = open(path, 'rb')
+    try:
+        buff = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    if buff[:len(VERSION_LINE)] != VERSION_LINE:
+        buff.close()
+        raise ValueError("%s is not a version 2.0 bag" % path)
+    return buff
+
+###  Index  ###
+
+class TopicIndex(object):
+    """Where the messages of one topic are: chunk number, offset in the chunk and receive time"""
+    def __init__(self, topic, datatype, md5sum, definition, chunk, offset, time):
+        self.topic = topic
+        self.datatype = datatype
+        self.md5sum = md5sum
+        self.definition = definition
+        self.chunk = chunk # int32 index into BagIndex.chunks
+        self.offset = offset # uint32 offset of the message record in the uncompressed chunk
+        self.time = time # float64 seconds
+
+    def __len__(self):
+        return len(self.time)
+
+# end class TopicIndex
+
+class BagIndex(object):
+    """Per topic index of a bag, built in one pass over the record headers and cached"""
+    def __init__(self, path, chunks, topics):
+        self.path = path
+        self.chunks = chunks # [(data position, compression, data length)]
+        self.topics = topics # {topic: TopicIndex}
+
+    @classmethod
+    def build(cls, path):
+        """Reads the index of a bag"""
+        buff = openBag(path)
+        try:
+            header = readRecord(buff, len(VERSION_LINE))[0]
+            if header.get('op') != chr(OP_BAG_HEADER):
+                raise ValueError("%s does not start with a bag header record" % path)
+            index_position = UINT64.unpack(header['index_pos'])[0]
+            if index_position == 0:
+                raise ValueError("%s has no index, run 'rosbag reindex' on it" % path)
+            connections = {}
+            chunk_positions = []
+            position = index_position
+            while position < len(buff):
+                header, data_start, data_length, position = readRecord(buff, position)
+                op = header.get('op')
+                if op == chr(OP_CONNECTION):
+                    connection = readFields(buff, data_start, data_length)
+                    connections[UINT32.unpack(header['conn'])[0]] = (header['topic'], connection)
+                elif op == chr(OP_CHUNK_INFO):
+                    chunk_positions.append(UINT64.unpack(header['chunk_pos'])[0])
+            chunks = []
+            parts = {} # connection: [(chunk, time and offset records)]
+            for chunk_number, chunk_position in enumerate(sorted(chunk_positions)):
+                header, data_start, data_length, position = readRecord(buff, chunk_position)
+                chunks.append((data_start, header['compression'], data_length))
+                # The index data records of the chunk follow it
+                while position < len(buff):
+                    header, data_start, data_length, next_position = readRecord(buff, position)
+                    if header.get('op') != chr(OP_INDEX_DATA):
+                        break
+                    count = UINT32.unpack(header['count'])[0]
+                    entries = numpy.frombuffer(buff, numpy.dtype([('sec', '<u4'), ('nsec', '<u4'), ('offset', '<u4')]),
+                                               count, data_start).copy()
+                    parts.setdefault(UINT32.unpack(header['conn'])[0], []).append((chunk_number, entries))
+                    position = next_position
+        finally:
+            buff.close()
+        # Connections publishing the same topic are merged
+        grouped = {}
+        for conn, (topic, connection) in connections.items():
+            grouped.setdefault(topic, []).append((conn, connection))
+        topics = {}
+        for topic, members in grouped.items():
+            chunk = []
+            offset = []
+            time = []
+            for conn, connection in members:
+                for chunk_number, entries in parts.get(conn, []):
+                    chunk.append(numpy.repeat(numpy.int32(chunk_number), len(entries)))
+                    offset.append(entries['offset'])
+                    time.append(entries['sec'] + entries['nsec'] * 1e-9)
+            if chunk:
+                chunk = numpy.concatenate(chunk)
+                offset = numpy.concatenate(offset)
+                time = numpy.concatenate(time)
+            else:
+                chunk = numpy.zeros(0, numpy.int32)
+                offset = numpy.zeros(0, numpy.uint32)
+                time = numpy.zeros(0, numpy.float64)
+            order = numpy.lexsort((offset, chunk, time))
+            connection = members[0][1]
+            topics[topic] = TopicIndex(topic, connection.get('type', ''), connection.get('md5sum', ''),
+                                       connection.get('message_definition', ''),
+                                       chunk[order], offset[order], time[order])
+        return cls(path, chunks, topics)
+
+    def save(self, directory):
+        """Writes the index into a cache directory"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        stat = os.stat(self.path)
+        meta = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                'chunks': self.chunks, 'topics': []}
+        arrays = {}
+        for i, topic in enumerate(sorted(self.topics)):
+            index = self.topics[topic]
+            meta['topics'].append({'topic': topic, 'type': index.datatype, 'md5sum': index.md5sum,
+                                   'definition': index.definition, 'key': i})
+            arrays['chunk_%d' % i] = index.chunk
+            arrays['offset_%d' % i] = index.offset
+            arrays['time_%d' % i] = index.time
+        numpy.savez(os.path.join(directory, 'index.npz'), **arrays)
+        # The metadata goes last, a partly written cache is never taken as valid
+        out = open(os.path.join(directory, 'index.json'), 'w')
+        try:
+            json.dump(meta, out)
+        finally:
+            out.close()
+
+    @classmethod
+    def load(cls, path, directory):
+        """Reads a cached index, None if there is none or the bag changed since"""
+        meta = readMeta(directory)
+        if meta is None:
+            return None
+        stat = os.stat(path)
+        if meta.get('version') != CACHE_VERSION or meta['size'] != stat.st_size or meta['mtime'] != stat.st_mtime:
+            return None
+        arrays = numpy.load(os.path.join(directory, 'index.npz'))
+        topics = {}
+        for entry in meta['topics']:
+            key = entry['key']
+            topic = str(entry['topic'])
+            topics[topic] = TopicIndex(topic, str(entry['type']), str(entry['md5sum']), entry['definition'].encode('utf-8'),
+                                       arrays['chunk_%d' % key], arrays['offset_%d' % key], arrays['time_%d' % key])
+        return cls(path, [(position, str(compression), size) for position, compression, size in meta['chunks']], topics)
+
+    @classmethod
+    def open(cls, path, cache_directory=None):
+        """Returns the cached index of a bag, building and caching it if needed"""
+        directory = cache_directory or defaultCacheDirectory(path)
+        index = cls.load(path, directory)
+        if index is None:
+            index = cls.build(path)
+            try:
+                # Columns cached from an older version of the bag are stale too
+                clearCache(directory, index.topics)
+                index.save(directory)
+            except (IOError, OSError):
+                pass # read only location, the index is just not cached
+        return index
+
+# end class BagIndex
+
+def defaultCacheDirectory(path):
+    """Cache of a bag: <bag>.columns next to it"""
+    return os.path.splitext(os.path.abspath(path))[0] + '.columns'
+
+def topicDirectory(cache_directory, topic):
+    """Cache subdirectory with the columns of a topic"""
+    return os.path.join(cache_directory, topic.strip('/').replace('/', '__') or '_')
+
+def readMeta(directory):
+    """Metadata of a cached index, None if there is none"""
+    try:
+        f = open(os.path.join(directory, 'index.json'))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+
+def clearCache(directory, topics=()):
+    """Removes what this module cached in a directory and nothing else
+
+    The directory may be one the user gave with other files in it, so only the index
+    files and the column directories of the topics of the new and of the cached index
+    go, and a column directory only if it holds nothing but .npy files.
+    """
+    meta = readMeta(directory)
+    topics = set(topics)
+    if meta is not None:
+        topics.update(str(entry.get('topic', '')) for entry in meta.get('topics', []))
+    for name in ('index.json', 'index.npz'):
+        if os.path.isfile(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    for topic in topics:
+        topic_directory = topicDirectory(directory, topic)
+        if not os.path.isdir(topic_directory):
+            continue
+        names = os.listdir(topic_directory)
+        if all(name.endswith('.npy') and os.path.isfile(os.path.join(topic_directory, name)) for name in names):
+            for name in names:
+                os.remove(os.path.join(topic_directory, name))
+            os.rmdir(topic_directory)
+
+###  Message layouts  ###
+
+def parseDefinitions(definition, datatype):
+    """Splits a full message definition into {type: [(field type, field name)]}, constants left out"""
+    definitions = {}
+    current = datatype
+    lines = []
+    for line in definition.split('\n') + [DEFINITION_SEPARATOR]:
+        if line.startswith(DEFINITION_SEPARATOR):
+            definitions[current] = lines
+            current = None
+            lines = []
+            continue
+        if line.startswith('MSG: '):
+            current = line[5:].strip()
+            continue
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        field_type, name = line.split(None, 1)
+        if '=' in name:
+            continue # constant
+        lines.append((field_type, name.strip()))
+    return definitions
+
+def resolveType(name, package, definitions):
+    """Full name of a nested message type"""
+    if name == 'Header':
+        return 'std_msgs/Header'
+    if '/' in name:
+        return name
+    if package + '/' + name in definitions:
+        return package + '/' + name
+    for full in definitions:
+        if full.split('/')[-1] == name:
+            return full
+    raise ValueError("unknown message type %s" % name)
+
+def compileLayout(datatype, definition):
+    """Compiles a message definition into steps over the serialized message
+
+    Returns a list of (kind, path, size, dtype) in message order:
+      'fixed'   path of a primitive or fixed primitive array, size bytes
+      'string'  uint32 length and the bytes
+      'array'   uint32 count and count elements of size bytes (dtype None for messages)
+      'opaque'  a variable array of messages of variable size, nothing after it can be found
+    """
+    definitions = parseDefinitions(definition, datatype)
+    steps = []
+
+    def fixedSize(message_type):
+        """Size of a message type without strings or variable arrays, None if it has some"""
+        total = 0
+        package = message_type.split('/')[0]
+        for field_type, name in definitions[message_type]:
+            base, count = splitArray(field_type)
+            if count is None or base == 'string':
+                return None
+            if base in PRIMITIVES:
+                size = numpy.dtype(PRIMITIVES[base]).itemsize * (2 if base in TIME_TYPES else 1)
+            else:
+                size = fixedSize(resolveType(base, package, definitions))
+                if size is None:
+                    return None
+            total += size * count
+        return total
+
+    def walk(message_type, prefix):
+        package = message_type.split('/')[0]
+        for field_type, name in definitions[message_type]:
+            path = prefix + name
+            base, count = splitArray(field_type)
+            if base == 'string':
+                if count == 1:
+                    steps.append(('string', path, 0, None))
+                else:
+                    steps.append(('opaque', path, 0, None))
+                    return False
+            elif base in PRIMITIVES:
+                size = numpy.dtype(PRIMITIVES[base]).itemsize * (2 if base in TIME_TYPES else 1)
+                if count is None:
+                    steps.append(('array', path, size, base))
+                else:
+                    steps.append(('fixed', path, size * count, (base, count)))
+            else:
+                nested = resolveType(base, package, definitions)
+                if count == 1:
+                    if not walk(nested, path + '.'):
+                        return False
+                elif count is not None:
+                    for i in xrange(count):
+                        if not walk(nested, '%s[%d].' % (path, i)):
+                            return False
+                else:
+                    size = fixedSize(nested)
+                    if size is None:
+                        steps.append(('opaque', path, 0, None))
+                        return False
+                    steps.append(('array', path, size, None))
+        return True
+
+    walk(datatype, '')
+    return steps
+
+def splitArray(field_type):
+    """('float64', 36) for float64[36], ('float32', None) for float32[], ('uint8', 1) for uint8"""
+    if not field_type.endswith(']'):
+        return field_type, 1
+    base, size = field_type[:-1].split('[')
+    return base, int(size) if size else None
+
+def fieldNames(datatype, definition):
+    """Names of the fields that can be extracted from a message type"""
+    return [path for kind, path, size, base in compileLayout(datatype, definition)
+            if kind == 'fixed' or kind == 'string' or (kind == 'array' and base is not None)]
+
+###  Extraction  ###
+
+def gather(buff, offsets, size):
+    """(N, size) uint8 array of the bytes of buff at each offset, in blocks to bound the index arrays"""
+    result = numpy.empty((len(offsets), size), numpy.uint8)
+    span = numpy.arange(size)
+    step = max(1, GATHER_BLOCK // max(1, size))
+    for i in xrange(0, len(offsets), step):
+        result[i:i + step] = buff[offsets[i:i + step, numpy.newaxis] + span]
+    return result
+
+def convert(raw, base, count):
+    """Turns (N, bytes) raw values into the column of a primitive field"""
+    values = numpy.ascontiguousarray(raw).view(PRIMITIVES[base])
+    if base in TIME_TYPES:
+        pairs = values.reshape(len(raw), -1, 2)
+        values = pairs[..., 0] + pairs[..., 1].astype(numpy.float64) * 1e-9
+    values = values.reshape(len(raw), -1)
+    return values[:, 0] if count == 1 else values
+
+def chunkData(bag, index, chunk_number):
+    """Returns (uint8 buffer, offset of the chunk's data in it) of one chunk, uncompressed"""
+    data_start, compression, data_length = index.chunks[chunk_number]
+    if compression == 'none':
+        return numpy.frombuffer(bag, numpy.uint8), data_start
+    elif compression == 'bz2':
+        return numpy.frombuffer(bz2.decompress(bag[data_start:data_start + data_length]), numpy.uint8), 0
+    raise ValueError("%s chunks are not supported" % compression)
+
+def chunkGroups(index, topic_index):
+    """(order, [(chunk, start, end)]) of the messages of a topic in the order they are read
+
+    The messages in uncompressed chunks are all read at once straight from the map,
+    their group has chunk None; those in compressed chunks are read chunk by chunk.
+    order[start:end] are the messages of a group.
+    """
+    compressed = numpy.array([compression != 'none' for position, compression, size in index.chunks], bool)
+    in_compressed = compressed[topic_index.chunk]
+    plain = numpy.flatnonzero(~in_compressed)
+    groups = [(None, 0, len(plain))] if len(plain) else []
+    packed = numpy.flatnonzero(in_compressed)
+    packed = packed[numpy.argsort(topic_index.chunk[packed], kind='mergesort')]
+    chunks = topic_index.chunk[packed]
+    if len(packed):
+        starts = numpy.concatenate(([0], numpy.flatnonzero(chunks[1:] != chunks[:-1]) + 1))
+        ends = numpy.concatenate((starts[1:], [len(chunks)]))
+        groups += [(int(chunks[start]), len(plain) + int(start), len(plain) + int(end)) for start, end in zip(starts, ends)]
+    return numpy.concatenate((plain, packed)), groups
+
+def extractMessages(buff, offsets, steps, wanted):
+    """{field: values} of the messages at offsets (of their records) in buff
+
+    Variable arrays give their flat values and a '<field>.lengths' column, they are
+    shaped once the columns of all the chunks are put together.
+    """
+    columns = {}
+    wanted = set(wanted)
+    # Message record: header length, header, data length, data
+    header_lengths = convert(gather(buff, offsets, 4), 'uint32', 1).astype(numpy.int64)
+    offsets = offsets + 8 + header_lengths
+    for kind, path, size, base in steps:
+        if not wanted:
+            break
+        if kind == 'fixed':
+            if path in wanted:
+                columns[path] = convert(gather(buff, offsets, size), base[0], base[1])
+                wanted.discard(path)
+            offsets = offsets + size
+        elif kind == 'string':
+            lengths = convert(gather(buff, offsets, 4), 'uint32', 1).astype(numpy.int64)
+            if path in wanted:
+                width = max(1, int(lengths.max()))
+                positions = numpy.minimum(offsets[:, numpy.newaxis] + 4 + numpy.arange(width), len(buff) - 1)
+                raw = numpy.where(numpy.arange(width) < lengths[:, numpy.newaxis], buff[positions], 0).astype(numpy.uint8)
+                columns[path] = numpy.ascontiguousarray(raw).view('S%d' % width)[:, 0]
+                wanted.discard(path)
+            offsets = offsets + 4 + lengths
+        elif kind == 'array':
+            counts = convert(gather(buff, offsets, 4), 'uint32', 1).astype(numpy.int64)
+            if path in wanted and base is not None:
+                columns[path] = arrayValues(buff, offsets + 4, counts, size, base)
+                columns[path + '.lengths'] = counts.astype(numpy.int32)
+                wanted.discard(path)
+            offsets = offsets + 4 + counts * size
+        else:
+            raise ValueError("fields after %s cannot be extracted" % path)
+    return columns
+
+def arrayValues(buff, starts, counts, size, base):
+    """Flat values of a variable primitive array"""
+    if len(counts) and (counts == counts[0]).all():
+        # One contiguous run per message
+        count = int(counts[0])
+        if count == 0:
+            return numpy.zeros(0, PRIMITIVES[base] if base not in TIME_TYPES else numpy.float64)
+        return convert(gather(buff, starts, size * count), base, count).reshape(-1)
+    total = int(counts.sum())
+    first = numpy.cumsum(counts) - counts
+    element = numpy.arange(total) - numpy.repeat(first, counts)
+    positions = numpy.repeat(starts, counts) + element * size
+    return convert(gather(buff, positions, size), base, 1)
+
+def reorderArray(values, counts, order):
+    """Flat values and counts of messages in chunk order put back in the order given by order"""
+    inverse = numpy.empty(len(order), numpy.int64)
+    inverse[order] = numpy.arange(len(order))
+    counts = counts.astype(numpy.int64)
+    starts = numpy.cumsum(counts) - counts
+    sorted_counts = counts[inverse]
+    first = numpy.cumsum(sorted_counts) - sorted_counts
+    element = numpy.arange(int(sorted_counts.sum())) - numpy.repeat(first, sorted_counts)
+    return values[numpy.repeat(starts[inverse], sorted_counts) + element], sorted_counts
+
+def arrayColumn(values, counts, path):
+    """Columns of a variable primitive array, 2-D when every message has the same count"""
+    if len(counts) and (counts == counts[0]).all():
+        return {path: values.reshape(len(counts), int(counts[0]))}
+    return {path: values, path + '.lengths': counts.astype(numpy.int32)}
+
+def checkFields(topic, topic_index, fields):
+    """Raises a ValueError for fields that cannot be extracted, such as variable arrays of messages"""
+    known = set(fieldNames(topic_index.datatype, topic_index.definition))
+    for field in fields:
+        if field not in known:
+            raise ValueError("%s has no field %s that can be extracted" % (topic, field))
+
+def extractTopic(path, index, topic, fields=None):
+    """Returns {field: column} for the messages of a topic, all the extractable fields if fields is None
+
+    The messages are read chunk by chunk, so at most one decompressed chunk is held
+    in memory besides the columns.
+    """
+    topic_index = index.topics[topic]
+    steps = compileLayout(topic_index.datatype, topic_index.definition)
+    wanted = set(fields if fields is not None else fieldNames(topic_index.datatype, topic_index.definition))
+    checkFields(topic, topic_index, wanted)
+    columns = {'t': topic_index.time}
+    if len(topic_index) == 0:
+        return columns
+    order, groups = chunkGroups(index, topic_index)
+    parts = {}
+    bag = openBag(path)
+    try:
+        for chunk, start, end in groups:
+            messages = order[start:end]
+            if chunk is None:
+                buff = numpy.frombuffer(bag, numpy.uint8)
+                bases = numpy.array([position for position, compression, size in index.chunks], numpy.int64)
+                offsets = bases[topic_index.chunk[messages]] + topic_index.offset[messages].astype(numpy.int64)
+            else:
+                buff, base = chunkData(bag, index, chunk)
+                offsets = base + topic_index.offset[messages].astype(numpy.int64)
+            try:
+                part = extractMessages(buff, offsets, steps, wanted)
+            except ValueError, e:
+                raise ValueError("%s: %s" % (topic, e))
+            for name, values in part.items():
+                parts.setdefault(name, []).append(values)
+            del buff
+    finally:
+        bag.close()
+    in_order = (order == numpy.arange(len(order))).all()
+    arrays = set(path_ for kind, path_, size, base in steps if kind == 'array')
+    for name, values in parts.items():
+        if name.endswith('.lengths') and name[:-len('.lengths')] in arrays:
+            continue
+        values = numpy.concatenate(values)
+        if name in arrays:
+            counts = numpy.concatenate(parts[name + '.lengths'])
+            if not in_order:
+                values, counts = reorderArray(values, counts, order)
+            columns.update(arrayColumn(values, counts, name))
+        elif in_order:
+            columns[name] = values
+        else:
+            column = numpy.empty_like(values)
+            column[order] = values
+            columns[name] = column
+    return columns
+
+###  Cached columns  ###
+
+def saveColumns(directory, columns):
+    """Writes columns as .npy files, the 't' column last so its presence marks a complete topic"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, values in columns.items():
+        if name != 't':
+            numpy.save(os.path.join(directory, name + '.npy'), values)
+    numpy.save(os.path.join(directory, 't.npy'), columns['t'])
+
+def loadColumns(directory, fields):
+    """Loads cached columns memory mapped, None if one of them is missing"""
+    columns = {}
+    for name in ['t'] + list(fields):
+        for column in (name, name + '.lengths'):
+            path = os.path.join(directory, column + '.npy')
+            if os.path.exists(path):
+                columns[column] = numpy.load(path, mmap_mode='r')
+        if name not in columns:
+            return None
+    return columns
+
+def extractWorker(arguments):
+    """Pool worker: extracts one topic into the cache and returns the names of its columns"""
+    path, cache_directory, topic, fields = arguments
+    index = BagIndex.open(path, cache_directory)
+    columns = extractTopic(path, index, topic, fields)
+    saveColumns(topicDirectory(cache_directory, topic), columns)
+    return topic, sorted(columns)
+
+def bagColumns(path, selection, cache_directory=None, processes=None):
+    """Returns {topic: {field: column}} for a selection {topic: [fields] or None for all}
+
+    Topics whose columns are not cached yet are extracted in parallel, one process
+    per topic, and cached. The columns are loaded memory mapped from the cache.
+    """
+    cache_directory = cache_directory or defaultCacheDirectory(path)
+    index = BagIndex.open(path, cache_directory)
+    selection = dict(selection)
+    for topic, fields in selection.items():
+        if topic not in index.topics:
+            raise ValueError("%s is not in %s" % (topic, path))
+        topic_index = index.topics[topic]
+        if fields is None:
+            selection[topic] = fieldNames(topic_index.datatype, topic_index.definition)
+        else:
+            checkFields(topic, topic_index, fields)
+    missing = [(path, cache_directory, topic, fields) for topic, fields in sorted(selection.items())
+               if loadColumns(topicDirectory(cache_directory, topic), fields) is None]
+    if len(missing) > 1 and processes != 1:
+        pool = Pool(min(len(missing), processes or cpu_count()))
+        try:
+            pool.map(extractWorker, missing)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for arguments in missing:
+            extractWorker(arguments)
+    result = {}
+    for topic, fields in selection.items():
+        columns = loadColumns(topicDirectory(cache_directory, topic), fields)
+        if columns is None:
+            raise IOError("the columns of %s could not be cached in %s" % (topic, cache_directory))
+        result[topic] = columns
+    return result
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+test_bag_columns.py - Round trip of bags written by rosbag through cata_bags.bag_columns
+
+Small bags are written with rosbag in uncompressed, bz2 and mixed chunks, and the
+columns extracted from them are compared with the messages rosbag reads back.
+"""
+
+import roslib; roslib.load_manifest('cata_bags')
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import rosbag
+import rospy
+from geometry_msgs.msg import Point32, PolygonStamped
+from sensor_msgs.msg import LaserScan
+
+from cata_bags.bag_columns import bagColumns, fieldNames, BagIndex
+
+MESSAGES = 40
+CHUNK_THRESHOLD = 2048
+
+def makeScan(i):
+    scan = LaserScan()
+    scan.header.seq = i
+    scan.header.stamp = rospy.Time(100 + i, 1000 * i)
+    scan.header.frame_id = 'laser%d' % (i % 3)
+    scan.angle_min = -1.5 + 0.01 * i
+    scan.range_max = 30.0
+    # ragged ranges, constant length intensities
+    scan.ranges = [0.5 * j + i for j in xrange(10 + i % 7)]
+    scan.intensities = [float(i + j) for j in xrange(4)]
+    return scan
+
+def makePolygon(i):
+    polygon = PolygonStamped()
+    polygon.header.stamp = rospy.Time(100 + i, 500)
+    polygon.header.frame_id = 'map'
+    polygon.polygon.points = [Point32(i, j, 0) for j in xrange(i % 4)]
+    return polygon
+
+class TestBagColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeBag(self, name, compressions):
+        """Writes a bag switching between the compressions every few messages"""
+        path = os.path.join(self.directory, name)
+        bag = rosbag.Bag(path, 'w', compression=compressions[0], chunk_threshold=CHUNK_THRESHOLD)
+        try:
+            for i in xrange(MESSAGES):
+                bag.compression = compressions[(i // 10) % len(compressions)]
+                t = rospy.Time(100 + i, 2000)
+                bag.write('/scan', makeScan(i), t)
+                bag.write('/polygon', makePolygon(i), t)
+        finally:
+            bag.close()
+        return path
+
+    def checkRoundTrip(self, path):
+        cache_directory = os.path.join(self.directory, 'columns')
+        selection = {'/scan': None, '/polygon': ['header.stamp', 'header.frame_id']}
+        columns = bagColumns(path, selection, cache_directory, processes=2)
+        bag = rosbag.Bag(path)
+        try:
+            scans = [(message, t) for topic, message, t in bag.read_messages(topics=['/scan'])]
+            polygons = [(message, t) for topic, message, t in bag.read_messages(topics=['/polygon'])]
+        finally:
+            bag.close()
+        self.assertEqual(len(scans), MESSAGES)
+
+        scan = columns['/scan']
+        self.assertTrue(numpy.allclose(scan['t'], [t.to_sec() for message, t in scans]))
+        self.assertEqual(list(scan['header.seq']), [message.header.seq for message, t in scans])
+        self.assertTrue(numpy.allclose(scan['header.stamp'], [message.header.stamp.to_sec() for message, t in scans]))
+        self.assertEqual(list(scan['header.frame_id']), [message.header.frame_id for message, t in scans])
+        self.assertTrue(numpy.allclose(scan['angle_min'], [message.angle_min for message, t in scans]))
+        self.assertTrue(numpy.allclose(scan['range_max'], [message.range_max for message, t in scans]))
+        ranges = numpy.concatenate([numpy.array(message.ranges, numpy.float32) for message, t in scans])
+        self.assertTrue((scan['ranges'] == ranges).all())
+        self.assertEqual(list(scan['ranges.lengths']), [len(message.ranges) for message, t in scans])
+        intensities = numpy.array([message.intensities for message, t in scans], numpy.float32)
+        self.assertEqual(scan['intensities'].shape, intensities.shape)
+        self.assertTrue((scan['intensities'] == intensities).all())
+
+        polygon = columns['/polygon']
+        self.assertTrue(numpy.allclose(polygon['t'], [t.to_sec() for message, t in polygons]))
+        self.assertTrue(numpy.allclose(polygon['header.stamp'], [message.header.stamp.to_sec() for message, t in polygons]))
+        self.assertEqual(list(polygon['header.frame_id']), [message.header.frame_id for message, t in polygons])
+
+        # the second query is answered from the cache
+        cached = bagColumns(path, {'/scan': ['ranges']}, cache_directory)
+        self.assertTrue((cached['/scan']['ranges'] == ranges).all())
+
+    def test_uncompressed(self):
+        self.checkRoundTrip(self.writeBag('none.bag', [rosbag.Compression.NONE]))
+
+    def test_bz2(self):
+        self.checkRoundTrip(self.writeBag('bz2.bag', [rosbag.Compression.BZ2]))
+
+    def test_mixed(self):
+        self.checkRoundTrip(self.writeBag('mixed.bag', [rosbag.Compression.NONE, rosbag.Compression.BZ2]))
+
+    def test_message_arrays_rejected(self):
+        path = self.writeBag('none.bag', [rosbag.Compression.NONE])
+        index = BagIndex.open(path, os.path.join(self.directory, 'columns'))
+        topic_index = index.topics['/polygon']
+        self.assertFalse('polygon.points' in fieldNames(topic_index.datatype, topic_index.definition))
+        self.assertRaises(ValueError, bagColumns, path, {'/polygon': ['polygon.points']},
+                          os.path.join(self.directory, 'columns'))
+        self.assertRaises(ValueError, bagColumns, path, {'/scan': ['no_such_field']},
+                          os.path.join(self.directory, 'columns'))
+
+if __name__ == '__main__':
+    import rosunit
+    rosunit.unitrun('cata_bags', 'test_bag_columns', TestBagColumns)
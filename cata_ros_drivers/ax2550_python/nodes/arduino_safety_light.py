@@ -18,6 +18,21 @@ Autonomous send: char 'a'
 Radio-Controlled send: char 'r'
 Stand-by send: char 's'
 Off send: char 'o' 
+
+Handshake: the board answers the '~handshake_query' char with one of the
+'~handshake_replies' chars (the letter of its current mode), once its bootloader is
+done. This needs the sketch to answer the query, in its loop():
+
+  if (Serial.available() > 0) {
+    char c = Serial.read();
+    if (c == '?') Serial.write(mode); // handshake, report the current mode letter
+    else mode = c;                    // 'a', 'r', 's' or 'o' as before
+  }
+
+With ~serial_port set to a device, only that port is opened. The mode is written as
+soon as the board answers, or after ~connect_delay seconds like before the handshake
+existed if the sketch does not answer. With 'auto' the board is found with
+serial_discovery, which needs the answer.
 """
 __author__ = "Carlos Chinchilla"
 __copyright__ = "Copyright (c) CATA Team (CCNY Robotics Lab)"
@@ -35,11 +50,18 @@ from ax2550_python.msg import LightMode
 # Python libraries
 import serial
 import time
+import os
+import sys
+from threading import Thread, Condition
+
+# Peer Libraries
+from logerror import logError
+import serial_discovery
 
 
 ###  Classes  ###
 class SafetyLight(object):
-    """This class allows you to control an ax2550 motor controller"""
+    """This class allows you to control the CATA safety light through an Arduino board"""
     def __init__(self, serial_port=None):
         """Function called after object instantiation"""
         
@@ -49,20 +71,29 @@ class SafetyLight(object):
         rospy.init_node('arduino_safety_light', anonymous=True)
         
         #Parameteres:
-        # Get the serial port name
-        self.device = serial_port or rospy.get_param('~serial_port', '/dev/ttyACM1')
+        # Get the serial port name, 'auto' finds it with serial_discovery
+        self.serial_port = serial_port or rospy.get_param('~serial_port', 'auto')
+        self.device = self.serial_port
+        self.handshake_query = rospy.get_param('~handshake_query', serial_discovery.ARDUINO_QUERY)
+        self.handshake_replies = rospy.get_param('~handshake_replies', serial_discovery.ARDUINO_REPLIES)
+        self.handshake_timeout = rospy.get_param('~handshake_timeout', 4.0) # seconds per port with 'auto', the bootloader takes about 2
+        self.reconnect_delay = rospy.get_param('~reconnect_delay', 1.0) # seconds between connection attempts
+        self.connect_delay = rospy.get_param('~connect_delay', 3.0) # seconds at most for the board on ~serial_port to boot
         
-        #    for device in locations:  
-        try:
-            # Connect to board
-            self.arduino = serial.Serial(self.device, 9600)  
-        except:  
-            print "SAFETY LIGHT: Failed to connect to", self.device  
-    
-        print "SAFETY LIGHT: Connected to arduino on", self.device
-        # wait for Arduino board to respond
-        time.sleep(3)
-        self.arduino.write('r')  # standby mode light
+        self.arduino = None
+        self.running = True
+        # The mode the light should be in and the last one that was actually written
+        self.mode_condition = Condition()
+        self.desired_mode = 'r'  # standby mode light
+        self.written_mode = None
+        
+        # Writes happen in their own thread so the callbacks never wait on the serial port
+        self.writer = Thread(target=self.writeLoop)
+        self.writer.daemon = True
+        self.writer.start()
+        
+        # Register shutdown function
+        rospy.on_shutdown(self.shutdown)
         
         #Listens for Autonomous Mode indicator signal
         rospy.Subscriber("/cata/navigation_mode", LightMode, self.lightCallback, queue_size=1)
@@ -70,17 +101,109 @@ class SafetyLight(object):
         # Handle ros requests
         rospy.spin()
         
+    def connect(self):
+        """Opens the configured port, or finds the board when it is 'auto'"""
+        if self.serial_port == 'auto':
+            probe_args = {'query': self.handshake_query, 'replies': self.handshake_replies, 'timeout': self.handshake_timeout}
+            device, port = serial_discovery.openDevice('arduino', None, self.locations, probe_args=probe_args)
+        else:
+            device, port = self.serial_port, self.openConfigured(self.serial_port)
+        if port is None:
+            return False
+        self.device = device
+        self.arduino = port
+        rospy.loginfo("SAFETY LIGHT: Connected to arduino on %s" % self.device)
+        return True
+
+    def openConfigured(self, device):
+        """Opens device and waits until the board answers the handshake, at most connect_delay seconds"""
+        if not os.path.exists(device):
+            return None
+        try:
+            port = serial.Serial(device, 9600, timeout=0.1)
+        except (serial.SerialException, OSError):
+            logError(sys.exc_info(), rospy.logwarn, "SAFETY LIGHT: Failed to connect to %s: " % device)
+            return None
+        try:
+            serial_discovery.claimDevice('arduino', device) # the other nodes' discovery leaves it alone
+        except (IOError, OSError):
+            pass
+        # The board resets when the port is opened, a sketch that answers is ready when it does
+        deadline = time.time() + self.connect_delay
+        try:
+            while self.running and time.time() < deadline:
+                port.write(self.handshake_query)
+                reply = port.read(1)
+                if reply and reply in self.handshake_replies:
+                    return port
+        except (serial.SerialException, OSError):
+            logError(sys.exc_info(), rospy.logwarn, "SAFETY LIGHT: Failed to connect to %s: " % device)
+            port.close()
+            return None
+        rospy.logwarn("SAFETY LIGHT: No answer to the handshake on %s within %.1f s, assuming the arduino is there"
+                      % (device, self.connect_delay))
+        return port
+        
+    def disconnect(self):
+        """Closes the serial port after an error so the writer reconnects"""
+        try:
+            self.arduino.close()
+        except Exception:
+            pass
+        self.arduino = None
+        self.written_mode = None
+        
+    def writeLoop(self):
+        """Keeps the board connected and writes the mode whenever it changes"""
+        while self.running:
+            if self.arduino is None:
+                if not self.connect():
+                    rospy.logwarn("SAFETY LIGHT: No arduino found, retrying in %0.1f seconds" % self.reconnect_delay)
+                    time.sleep(self.reconnect_delay)
+                    continue
+            with self.mode_condition:
+                while self.running and self.desired_mode == self.written_mode:
+                    self.mode_condition.wait(self.reconnect_delay)
+                    if not os.path.exists(self.device): # USB cable dropped
+                        break
+                mode = self.desired_mode
+            if not self.running:
+                break
+            try:
+                if not os.path.exists(self.device):
+                    raise serial.SerialException("%s disappeared" % self.device)
+                self.arduino.write(mode)
+                self.written_mode = mode
+            except (serial.SerialException, OSError, ValueError):
+                logError(sys.exc_info(), rospy.logwarn, "SAFETY LIGHT: Lost the arduino on %s, reconnecting: " % self.device)
+                self.disconnect()
+        if self.arduino is not None:
+            self.arduino.close()
+        
     def lightCallback(self, data):
         """Called everytime the autonomous mode updates"""
         navigation_mode = data.autonomous # True for autonomous mode, False for manual mode 
         
         if navigation_mode == 1: # autonomous
-            self.arduino.write('a')  # flashing light
+            mode = 'a'  # flashing light
         elif navigation_mode == 0: # manual
-            self.arduino.write('r')  # solid light
+            mode = 'r'  # solid light
+        else:
+            return 0
+        # Only wake up the writer if the mode actually changed
+        with self.mode_condition:
+            if mode != self.desired_mode:
+                self.desired_mode = mode
+                self.mode_condition.notify()
         # Handles the NavMode message from the subscribe topic"""
         return 0
+        
+    def shutdown(self):
+        """Called when the node shutsdown"""
+        with self.mode_condition:
+            self.running = False
+            self.mode_condition.notify()
 # end class SafetyLight   
 
 if __name__ == '__main__':
-    SafetyLight()
\ No newline at end of file
+    SafetyLight()
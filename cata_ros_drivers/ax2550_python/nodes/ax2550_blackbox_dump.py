@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_blackbox_dump.py - Decodes the black box rings written by ax2550_driver.py and
+ax2550_odom.py (see blackbox.py) for post-mortems
+
+Usage: ax2550_blackbox_dump.py [options] ring [ring ...]
+
+A ring is a path or a name in ~/.ros/blackbox (ax2550_driver, ax2550_odom). Without
+--csv or --npz it prints a summary of each ring. The rings can be copied off the robot
+while the nodes are running.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+
+# Python Libraries
+from optparse import OptionParser
+import os
+import sys
+import time
+
+# Peer Libraries
+import blackbox
+
+###  Functions  ###
+
+def ringPath(name):
+    """Resolves a ring name to its path like blackbox.openBlackBox does"""
+    path = os.path.expanduser(name)
+    if os.sep not in path and not os.path.exists(path):
+        path = os.path.join(blackbox.DEFAULT_DIRECTORY, path + '.bbx')
+    return path
+
+def selectRecords(records, events, last):
+    """Keeps the records of the given event names from the last seconds"""
+    if events:
+        codes = set(code for code, name in blackbox.EVENT_NAMES.items() if name in events)
+        records = [r for r in records if r[2] in codes]
+    if last and records:
+        newest = records[-1][0]
+        records = [r for r in records if r[0] >= newest - last]
+    return records
+
+def printSummary(path, records):
+    """Prints the time span and the number of records of each event type"""
+    header = blackbox.readHeader(path)
+    print "%s: %d of %d slots used, created %s" % (path, len(records), header[3], time.ctime(header[4]))
+    if not records:
+        return
+    print "  from %s to %s (%.1f s)" % (time.ctime(records[0][0]), time.ctime(records[-1][0]), records[-1][0] - records[0][0])
+    counts = {}
+    for r in records:
+        counts[r[2]] = counts.get(r[2], 0) + 1
+    for code in sorted(counts):
+        print "  %-10s %d" % (blackbox.EVENT_NAMES.get(code, str(code)), counts[code])
+
+def writeCsv(out, path, records):
+    """Writes one line per record"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    for stamp, seq, event, flags, a, b, c in records:
+        out.write("%s,%.6f,%d,%s,%d,%.6g,%.6g,%.6g\n" % (name, stamp, seq, blackbox.EVENT_NAMES.get(event, event), flags, a, b, c))
+
+###  If Main  ###
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] ring [ring ...]")
+    parser.add_option('--csv', help="write the records of all the rings to a CSV file, - for stdout")
+    parser.add_option('--npz', help="write one NumPy array per ring to a .npz file")
+    parser.add_option('--events', help="comma separated event names to keep (%s)" % ', '.join(sorted(blackbox.EVENT_NAMES.values())))
+    parser.add_option('--last', type='float', default=0.0, help="only keep the last seconds of each ring")
+    options, rings = parser.parse_args()
+    if not rings:
+        rings = ['ax2550_driver', 'ax2550_odom']
+    events = options.events.split(',') if options.events else None
+
+    paths = [ringPath(ring) for ring in rings]
+    if options.npz:
+        import numpy
+        arrays = {}
+        for path in paths:
+            records = blackbox.readRecords(path)
+            if events:
+                codes = [code for code, name in blackbox.EVENT_NAMES.items() if name in events]
+                records = records[numpy.in1d(records['event'], codes)]
+            if options.last and len(records):
+                records = records[records['stamp'] >= records['stamp'][-1] - options.last]
+            arrays[os.path.splitext(os.path.basename(path))[0]] = records
+        numpy.savez(options.npz, **arrays)
+    if options.csv:
+        out = sys.stdout if options.csv == '-' else open(options.csv, 'w')
+        out.write("ring,stamp,seq,event,flags,a,b,c\n")
+        for path in paths:
+            writeCsv(out, path, selectRecords(list(blackbox.iterRecords(path)), events, options.last))
+        if out is not sys.stdout:
+            out.close()
+    if not options.csv and not options.npz:
+        for path in paths:
+            printSummary(path, selectRecords(list(blackbox.iterRecords(path)), events, options.last))
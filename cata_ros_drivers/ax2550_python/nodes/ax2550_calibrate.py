@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_calibrate.py - Sweeps the motor speed codes and measures the wheel speeds with the
+encoders, then stores the fitted code-to-speed curves for ax2550_driver.py
+
+The driver has to be running in manual mode. By default the robot spins in place
+(left wheel forward, right wheel backward) so it does not need room to drive.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import rospy
+from std_msgs.msg import String
+
+# ROS msg and srv imports
+from ax2550_python.msg import Encoder
+from ax2550_python.msg import MotorCodes
+
+# Python Libraries
+from threading import Lock
+import os
+
+# Peer Libraries
+import kinematics
+import motor_calibration
+
+###  Classes  ###
+class MotorCalibrator(object):
+    """Measures the speed of each wheel for a list of motor speed codes"""
+    def __init__(self):
+        """Function called after object instantiation"""
+
+        # Initialize ROS Node
+        rospy.init_node('ax2550_calibrate', anonymous=True)
+
+        # Get parameters
+        self.levels = rospy.get_param('~levels', range(0, motor_calibration.MAX_MOTOR_CODE, 8) + [motor_calibration.MAX_MOTOR_CODE])
+        self.sweep_mode = rospy.get_param('~sweep_mode', 'spin') # spin: turn in place, straight: drive forward
+        self.settle_time = rospy.get_param('~settle_time', 1.0) # seconds to wait after changing the speed
+        self.measure_time = rospy.get_param('~measure_time', 2.0) # seconds of encoder data per level
+        self.calibration_file = os.path.expanduser(rospy.get_param('~motor_calibration_file', '~/.ros/ax2550_motor_calibration.yaml'))
+        self.kinematics = kinematics.loadKinematics() # wheel sizes shared with the driver and the odometry
+
+        self.lock = Lock()
+        self.recording = False
+        self.samples = []
+
+        self.codes_pub = rospy.Publisher('/cata/motor_calibration', MotorCodes)
+        self.voice_pub = rospy.Publisher('/cata/cata_voice', String)
+        rospy.Subscriber('/cata/motor_control_encoders', Encoder, self.encoderDataReceived)
+
+        rospy.on_shutdown(self.stopMotors)
+
+    def encoderDataReceived(self, data):
+        """Keeps the encoder samples while a level is being measured"""
+        with self.lock:
+            if self.recording:
+                self.samples.append((data.header.stamp.to_sec(), data.left, data.right))
+
+    def sendCodes(self, left, right):
+        """Sends raw speed codes to the driver"""
+        message = MotorCodes(left=left, right=right)
+        message.header.stamp = rospy.Time.now()
+        self.codes_pub.publish(message)
+
+    def stopMotors(self):
+        """Sends a stop command"""
+        self.sendCodes(0, 0)
+
+    def measureLevel(self, code):
+        """Drives both wheels with the given code and returns their (left, right) speeds in m/s"""
+        if self.sweep_mode == 'straight':
+            self.sendCodes(code, code)
+        else:
+            self.sendCodes(code, -code)
+        rospy.sleep(self.settle_time)
+        with self.lock:
+            self.samples = []
+            self.recording = True
+        rospy.sleep(self.measure_time)
+        with self.lock:
+            self.recording = False
+            samples = self.samples
+        if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+            rospy.logwarn("Not enough encoder data for code %d, is ax2550_driver running?" % code)
+            return 0.0, 0.0
+        # Counts are relative to the previous poll, so the first sample covers time before the window
+        duration = samples[-1][0] - samples[0][0]
+        left, right = self.kinematics.countsToDistance(sum(abs(left) for stamp, left, right in samples[1:]),
+                                                      sum(abs(right) for stamp, left, right in samples[1:]))
+        return left / duration, right / duration
+
+    def run(self):
+        """Runs the sweep and saves the calibration"""
+        # Give the driver some time to connect to our publishers
+        rospy.sleep(1.0)
+        self.voice_pub.publish(String("Beggining motor calibration"))
+        codes = []
+        left_speeds = []
+        right_speeds = []
+        for code in sorted(self.levels):
+            if rospy.is_shutdown():
+                return
+            left, right = self.measureLevel(int(code))
+            rospy.loginfo("Code %3d: left %0.3f m/s, right %0.3f m/s" % (code, left, right))
+            codes.append(int(code))
+            left_speeds.append(left)
+            right_speeds.append(right)
+        self.stopMotors()
+
+        left_codes, left_fitted = motor_calibration.fitSpeedCurve(codes, left_speeds)
+        right_codes, right_fitted = motor_calibration.fitSpeedCurve(codes, right_speeds)
+        calibration = {'left': {'codes': left_codes, 'speeds': [round(v, 4) for v in left_fitted]},
+                       'right': {'codes': right_codes, 'speeds': [round(v, 4) for v in right_fitted]}}
+        motor_calibration.saveCalibration(self.calibration_file, calibration)
+        rospy.loginfo("Motor calibration saved to %s (top speeds: left %0.3f, right %0.3f m/s)"
+                      % (self.calibration_file, left_fitted[-1], right_fitted[-1]))
+        self.voice_pub.publish(String("Motor calibration finished"))
+# end class MotorCalibrator
+
+###  If Main  ###
+if __name__ == '__main__':
+    MotorCalibrator().run()
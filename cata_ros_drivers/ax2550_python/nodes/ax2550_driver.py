@@ -16,21 +16,27 @@ __copyright__ = "Copyright (c) William Woodall"
 import roslib; roslib.load_manifest('ax2550_python')
 import rospy
 from rospy.rostime import Time
+from rospy.numpy_msg import numpy_msg
 
 # ROS msg and srv imports
 from std_msgs.msg import String
+from std_msgs.msg import Float64
 from ax2550_python.msg import Encoder
+from ax2550_python.msg import EncoderBatch
 from ax2550_python.msg import LightMode
+from ax2550_python.msg import MotorCodes
+from ax2550_python.msg import WheelControl
 from ax2550_python.srv import NavMode
 from ax2550_python.srv import Move
 from geometry_msgs.msg import Twist
 
 # Python Libraries
-from threading import Timer, Lock
+from threading import Lock
 import time
 from time import sleep
 import sys
-import math
+
+import numpy
 
 # pySerial
 from serial import Serial
@@ -38,6 +44,15 @@ from serial import Serial
 # Peer Libraries
 from seriallistener import SerialListener
 from logerror import logError
+import motor_calibration
+import serial_discovery
+import blackbox
+import command_arbiter
+import command_watchdog
+import kinematics
+import scheduler
+import velocity_profile
+import wheel_controller
 
 ###  Classes  ###
 class AX2550(object):
@@ -48,15 +63,75 @@ class AX2550(object):
     	# Initialize ROS Node
         rospy.init_node('ax2550_driver', anonymous=True)
 
-	   # Get the serial port name
-        self.serial_port = serial_port or rospy.get_param('~serial_port', '/dev/ttyUSB0')
-        self.wheel_base_length = rospy.get_param('~wheel_base_legth', 0.50)
-        self.half_B = self.wheel_base_length / 2.0
-        self.max_wheel_velocity = rospy.get_param('~max_wheel_velocity', 1.0) # m/s
-        self.max_angular_velocity = 2*self.max_wheel_velocity/self.wheel_base_length # rad/s
+	   # Get the serial port name, 'auto' finds it with serial_discovery
+        self.serial_port = serial_port or rospy.get_param('~serial_port', 'auto')
+        if self.serial_port == 'auto':
+            self.serial_port = serial_discovery.findDevice('ax2550')
+            if self.serial_port is None:
+                raise IOError("Could not find the ax2550 motor controller on any serial port")
+            rospy.loginfo("Found the ax2550 motor controller on %s" % self.serial_port)
+        elif rospy.get_param('~claim_serial_port', True): # record the port in the device cache of serial_discovery
+            try:
+                # Keeps the other nodes' discovery away from the motor controller
+                serial_discovery.claimDevice('ax2550', self.serial_port)
+            except (IOError, OSError):
+                logError(sys.exc_info(), rospy.logwarn, "Could not record %s in the serial device cache: " % self.serial_port)
+        # Wheel base, wheel sizes and max_wheel_velocity, shared with ax2550_odom (config/kinematics.yaml)
+        self.kinematics = kinematics.loadKinematics()
+        self.max_wheel_velocity = self.kinematics.max_wheel_velocity # m/s
         # I'm using this to compensate for wheel's different sizes
         self.motor_range_left = rospy.get_param('~motor_range_left', 127.0) # Relative max motor speed code 
         self.motor_range_right = rospy.get_param('~motor_range_right', 127.0) # Relative max motor speed code
+        # Lookup tables from a fraction of max_wheel_velocity to a speed code, fitted by ax2550_calibrate.py
+        self.motor_calibration_file = rospy.get_param('~motor_calibration_file', '')
+        self.command_table_size = rospy.get_param('~command_table_size', 256)
+        self.loadCommandTables()
+        # Ring file recording commands, encoder counts, mode changes and syncs for post-mortems
+        self.blackbox_name = rospy.get_param('~blackbox', 'ax2550_driver') # name in ~/.ros/blackbox or a path, '' disables it
+        self.blackbox_records = rospy.get_param('~blackbox_records', blackbox.DEFAULT_CAPACITY)
+        try:
+            self.blackbox = blackbox.openBlackBox(self.blackbox_name, self.blackbox_records)
+        except Exception as err:
+            logError(sys.exc_info(), rospy.logerr, "Exception while opening the black box, not recording: ")
+            self.blackbox = blackbox.NullBlackBox()
+        # Command sources, the fresh one with the highest priority drives the motors
+        self.joystick_priority = rospy.get_param('~joystick_priority', 2)
+        self.joystick_timeout = rospy.get_param('~joystick_timeout', 0.5) # seconds without a Move before the joystick is dropped
+        self.cmd_vel_priority = rospy.get_param('~cmd_vel_priority', 1)
+        self.cmd_vel_timeout = rospy.get_param('~cmd_vel_timeout', 0.5) # seconds without a cmd_vel before it is dropped
+        self.command_check_period = rospy.get_param('~command_check_period', 0.05) # seconds between staleness checks
+        self.command_refresh_period = rospy.get_param('~command_refresh_period', 0.4) # seconds between resends of a fresh command
+        self.stop_ramp_time = rospy.get_param('~stop_ramp_time', 0.3) # seconds to ramp a stale command down to a stop
+        self.watchdog = command_watchdog.CommandWatchdog(self.command_refresh_period, self.stop_ramp_time)
+        # Speed tests and ax2550_calibrate.py send raw speed codes, the arbitrated commands wait meanwhile
+        self.raw_codes_timeout = rospy.get_param('~raw_codes_timeout', 15.0) # seconds of raw codes without an end before the motors are stopped
+        self.raw_codes_deadline = None
+        self.raw_codes_held = False
+        self.command_source = None
+        self.command_task = None
+        # Acceleration and jerk limits applied to every command at the command_check_period control rate
+        self.max_wheel_acceleration = rospy.get_param('~max_wheel_acceleration', 1.0) # m/s^2, 0 disables the profile
+        self.max_wheel_jerk = rospy.get_param('~max_wheel_jerk', 0.0) # m/s^3, 0 only limits the acceleration
+        self.profile = None
+        if self.max_wheel_acceleration > 0 or self.max_wheel_jerk > 0:
+            # The setpoints are fractions of max_wheel_velocity
+            self.profile = velocity_profile.VelocityProfile(self.max_wheel_acceleration / self.max_wheel_velocity,
+                                                            self.max_wheel_jerk / self.max_wheel_velocity)
+        self.profile_time = None
+        # Optional closed-loop wheel speed control, run on every fresh encoder sample
+        self.closed_loop = rospy.get_param('~closed_loop', False)
+        gains = dict(kp=rospy.get_param('~wheel_kp', 0.5),
+                     ki=rospy.get_param('~wheel_ki', 1.0), # 1/s
+                     kd=rospy.get_param('~wheel_kd', 0.0), # s
+                     integral_limit=rospy.get_param('~wheel_integral_limit', 0.5)) # fraction of max_wheel_velocity
+        self.left_controller = wheel_controller.WheelController(**gains)
+        self.right_controller = wheel_controller.WheelController(**gains)
+        self.wheel_setpoint = (0.0, 0.0)
+        self.last_encoder_query = None
+        self.last_encoder_sample = None
+        self.arbiter = command_arbiter.CommandArbiter()
+        self.arbiter.addSource('joystick', self.joystick_priority, self.joystick_timeout, enabled=True)
+        self.arbiter.addSource('cmd_vel', self.cmd_vel_priority, self.cmd_vel_timeout, enabled=False)
         
         # Try to open and configure the serial port
         self.serial = Serial(self.serial_port)
@@ -67,10 +142,13 @@ class AX2550(object):
         self.serial.stopbits = 1
         self.serial.close()
         self.serial.open()
-        self.keep_alive_timer = None
-        self.encoder_timer = None
+        self.encoder_task = None
         self.encoder_rate = 1.0 / 20.0 # TODO: find out what this means
         self.encoder_count = 0
+        # Encoder samples sent together on /cata/motor_control_encoder_batch, 0 disables the batches
+        self.encoder_batch_size = rospy.get_param('~encoder_batch_size', 0)
+        self.publish_encoder_samples = rospy.get_param('~publish_encoder_samples', True) # one Encoder message per poll
+        self.encoder_batch = ([], [], [])
         
         # Setup the lock to synchronize the setting of motor speeds
         self.speed_lock = Lock()
@@ -95,13 +173,17 @@ class AX2550(object):
         #self.handleNavMode(self.toggleMode); # To set the safety light initially
 	
     	# Subscribe to the /cmd_vel topic to listen for motor commands
-        rospy.Subscriber('cmd_vel', Twist, self.cmd_velReceived)
+        rospy.Subscriber('cmd_vel', Twist, self.cmd_velReceived, queue_size=1)
 
     	# Subscribe to the speed_test topic to listen for speed test commands
         rospy.Subscriber('/cata/speed_test', String, self.cmd_speedTestReceived)
+
+    	# Subscribe to the motor_calibration topic to listen for raw speed codes from the calibration sweep
+        rospy.Subscriber('/cata/motor_calibration', MotorCodes, self.motorCodesReceived, queue_size=1)
         
         # Setup Publisher for publishing encoder data to the /motor_control_encoders topic
         self.encoders_pub = rospy.Publisher('/cata/motor_control_encoders', Encoder)
+        self.encoder_batch_pub = rospy.Publisher('/cata/motor_control_encoder_batch', numpy_msg(EncoderBatch))
         
         # Setup Publisher for publishing status related data to the /motor_control_status topic
         self.status_pub = rospy.Publisher('/cata/motor_control_status', String)
@@ -109,6 +191,12 @@ class AX2550(object):
         # Setup Publisher for publishing navigation mode status (either autonomous or manual) 
         self.nav_mode_pub = rospy.Publisher('/cata/navigation_mode', LightMode)
 
+        # Setup Publisher for publishing the closed-loop tracking error and latency
+        self.wheel_control_pub = rospy.Publisher('/cata/wheel_control', WheelControl)
+
+        # Setup Publisher for publishing how long the motors ran on a stale command before being stopped
+        self.stale_run_pub = rospy.Publisher('/cata/motor_stale_run', Float64)
+
         # Setup Publisher for publishing navigation mode status as voice 
         self.voice_pub = rospy.Publisher('/cata/cata_voice', String)
         
@@ -121,21 +209,28 @@ class AX2550(object):
         # Register shutdown function
         rospy.on_shutdown(self.shutdown)
         
-        # Start polling the encoders
-        self.pollEncoders()
+        # Polling and the command watchdog share one scheduler thread
+        self.scheduler = scheduler.Scheduler('ax2550_scheduler', self.taskFailed)
+        self.encoder_task = self.scheduler.every(self.encoder_rate, self.pollEncoders)
+        self.start()
           
         # Handle ros srv requests
         rospy.spin()
         
     def handleMove(self, data):
         """Handles the Move srv requests"""
-        if self.toggleMode == 0:
-            self.move(data.speed, data.direction)
+        self.blackbox.record(blackbox.MOVE, data.speed, data.direction, self.toggleMode)
+        speeds = self.mixSpeedDirection(data.speed, data.direction)
+        if speeds is not None:
+            self.arbiter.submit('joystick', speeds[0], speeds[1])
         return 0
 
     def handleNavMode(self, data):
         """Handles the NavMode srv requests that toggle between joystick and autonomous modes"""
         self.toggleMode = data.button_toggle # 0 for manual (joystick) mode, 1 for autonomous
+        self.blackbox.record(blackbox.NAV_MODE, self.toggleMode)
+        self.arbiter.setEnabled('joystick', self.toggleMode == 0)
+        self.arbiter.setEnabled('cmd_vel', self.toggleMode == 1)
     	try:
     	    # Publish the navigation mode as message
     	    if self.toggleMode == 0:
@@ -161,89 +256,151 @@ class AX2550(object):
  
     def cmd_speedTestReceived(self, msg):
         """Handles incoming messages from the speed_test topic"""
+        self.blackbox.record(blackbox.SPEED_TEST, {"cw": 1, "ccw": -1}.get(msg.data, 0))
         if msg.data == "cw": # Turn clockwise
            #rospy.loginfo("Received %s", msg.data) 
+           self.holdRawCodes(True)
            self.setMaxSpeedTest(1)
         if msg.data == "ccw": # Turn counter-clockwise
+            self.holdRawCodes(True)
             self.setMaxSpeedTest(-1)
         if msg.data == "end":
            self.setMaxSpeedTest(0)    
+           self.holdRawCodes(False)
+
+    def motorCodesReceived(self, msg):
+        """Handles raw speed codes sent by ax2550_calibrate.py, only in manual mode"""
+        if self.toggleMode != 0:
+            return
+        left = max(-motor_calibration.MAX_MOTOR_CODE, min(motor_calibration.MAX_MOTOR_CODE, msg.left))
+        right = max(-motor_calibration.MAX_MOTOR_CODE, min(motor_calibration.MAX_MOTOR_CODE, msg.right))
+        left_command = "!%s%02X" % ("a" if left < 0 else "A", abs(left))
+        right_command = "!%s%02X" % ("b" if right < 0 else "B", abs(right))
+        self.blackbox.record(blackbox.CODES, left, right)
+        self.holdRawCodes(left != 0 or right != 0)
+        self.__sendSpeedsToMotorController(left_command, right_command)
+
+    def holdRawCodes(self, hold):
+        """Keeps the arbitrated commands from overriding raw speed codes, for up to raw_codes_timeout"""
+        self.raw_codes_deadline = time.time() + self.raw_codes_timeout if hold else None
+
+    def loadCommandTables(self):
+        """Precomputes the speed code lookup tables, from the calibration file if there is one"""
+        calibration = None
+        try:
+            calibration = motor_calibration.loadCalibration(self.motor_calibration_file)
+        except Exception as err:
+            logError(sys.exc_info(), rospy.logerr, "Exception while loading the motor calibration, using motor_range_*: ")
+        if calibration is None:
+            if self.motor_calibration_file:
+                rospy.logwarn("No motor calibration found at %s, using motor_range_*" % self.motor_calibration_file)
+            self.left_code_table = motor_calibration.linearCommandTable(self.motor_range_left, self.command_table_size)
+            self.right_code_table = motor_calibration.linearCommandTable(self.motor_range_right, self.command_table_size)
+        else:
+            rospy.loginfo("Using motor calibration from %s" % self.motor_calibration_file)
+            self.left_code_table = motor_calibration.buildCommandTable(calibration['left']['codes'],
+                calibration['left']['speeds'], self.max_wheel_velocity, self.command_table_size)
+            self.right_code_table = motor_calibration.buildCommandTable(calibration['right']['codes'],
+                calibration['right']['speeds'], self.max_wheel_velocity, self.command_table_size)
+        self.command_table_scale = self.command_table_size - 1
 
     def cmd_velReceived(self, msg):
         """Handles incoming messages from the cmd_vel topic"""
+        self.blackbox.record(blackbox.CMD_VEL, msg.linear.x, msg.angular.z, self.toggleMode)
 
         if self.toggleMode == 1:  # in autonomous mode
-            # rospy.loginfo(str(msg))
-            # Extract Vx, Vy, and ang_vel
-            v_x = msg.linear.x
+            # Only x and yaw are used, a differential drive cannot move sideways
+            v_x, ang_vel = self.kinematics.clipTwist(msg.linear.x, msg.angular.z)
             v_y = msg.linear.y
-            ang_vel = msg.angular.z
-            if ang_vel >= self.max_angular_velocity:
-                ang_vel = self.max_angular_velocity
-            elif ang_vel < -self.max_angular_velocity:
-                ang_vel = -self.max_angular_velocity              
- 
-            # Calculate the magnitude of the velocity vector, V, and the Radius of Rotation R
-            v_linear = math.sqrt((v_x ** 2) + (v_y ** 2))
-#            if v_linear == 0:
-#                R = 0
-#                v_l = ang_vel * (R - self.half_B)
-#                v_r = ang_vel * (R + self.half_B)
-#            elif ang_vel == 0:
-#                v_l = v_x
-#                v_r = v_x
-#            else:
-            wB_over_2 = (self.wheel_base_length*ang_vel)/2
-            v_l = v_x - wB_over_2
-            v_r = v_x + wB_over_2
-            
-            # Calculate the difference in velocity between the wheels
-#            if R == 0:   # If no radius of rotation, means turning in place
-#                dV = 0
-            # CARLOS: ^^^^^^ It's good ^^^^^^^^^^
-#            else:
-#                dV = 2 * ((v_linear * self.wheel_base_length) / R)
-            # Calculate the velocity of each wheel
-#            if v_linear == 0:  # we are just turning
-#                v_l = ang_vel * (R - self.half_B)
-#                v_r = ang_vel * (R + self.half_B)
-#            elif v_x > 0:  # We are moving straight (forward):
-#                v_l = (v_linear - (0.5 * dV))
-#                v_r = (v_linear + (0.5 * dV))
-#            else:
-#                # We are moving straight (backward):
-#                # CARLOS: may need review
-#                v_l = (-1.0*v_linear + (0.5 * dV))
-#                v_r = (-1.0*v_linear - (0.5 * dV))                
-
-                
-#            print "V_l = %0.2f" % v_l
-#            print "V_r = %0.2f" % v_r
-                
-            # vvvvvvvvvv CARLOS: It's good! vvvvvvvvvvvvvvv
-            # Calculate the percent of max velocity for each wheel
-            if v_l == 0:
-                speed_left = 0.0
-            elif abs(v_l) > self.max_wheel_velocity:
-                if v_l > 0:
-                    speed_left = 1.0
-                else:
-                    speed_left = -1.0
-            else:
-                speed_left = v_l / self.max_wheel_velocity
-            if v_r == 0:
-                speed_right = 0
-            elif abs(v_r) > self.max_wheel_velocity:
-                if v_r > 0:
-                    speed_right = 1.0
-                else:
-                    speed_right = -1.0
-            else:
-                speed_right = v_r / self.max_wheel_velocity
+            v_l, v_r = self.kinematics.twistToWheels(v_x, ang_vel)
+            # Percent of max velocity for each wheel
+            speed_left, speed_right = self.kinematics.speedToFraction(v_l, v_r)
             
             rospy.loginfo("Speed from Twist-> PERCENTAGES:left: %f, right: %f, INPUT SPEEDS: Vx: %f, Vy: %f, ang_vel: %f" % (speed_left, speed_right, v_x, v_y, ang_vel))
-            self.setSpeeds(speed_left, speed_right)
+            self.arbiter.submit('cmd_vel', speed_left, speed_right)
     
+    def checkCommands(self):
+        """Scheduler task sending the arbitrated command, refreshed while it is fresh and ramped down to a stop once stale"""
+        now = time.time()
+        raw_codes_deadline = self.raw_codes_deadline
+        if raw_codes_deadline is not None and now < raw_codes_deadline:
+            # A speed test or a calibration drives the motors, the joystick's Move(0, 0) must not stop them
+            self.raw_codes_held = True
+            return
+        if self.raw_codes_held:
+            self.raw_codes_held = False
+            if raw_codes_deadline is not None:
+                rospy.logwarn("Raw speed codes did not end within %.1f s, stopping the motors" % self.raw_codes_timeout)
+                self.raw_codes_deadline = None
+                self.setSpeeds(0.0, 0.0)
+            # The raw codes left the motors stopped
+            self.profile_time = None
+            if self.profile is not None:
+                self.profile.reset((0.0, 0.0))
+        source, left, right = self.arbiter.select(now)
+        if source != self.command_source:
+            rospy.loginfo("Motor commands now come from %s" % (source or "no source, stopping"))
+            self.command_source = source
+        if self.profile is not None:
+            left, right = self.profileStep(now, source, left, right)
+        # The watchdog comes after the profile, so it refreshes the profiled setpoints and
+        # its ramp down and explicit stop of a stale command are not rate limited
+        speeds = self.watchdog.update(now, source, left, right, self.arbiter.expired_at)
+        if speeds is not None and self.profile is not None and source is None:
+            # Follow the watchdog's ramp, a new command accelerates from what was sent
+            self.profile.reset(speeds)
+        if speeds is not None:
+            self.wheel_setpoint = speeds
+            # In closed loop the wheel controllers send it with the next encoder sample
+            if not (self.closed_loop and speeds != (0.0, 0.0) and self.encodersFresh(now)):
+                self.left_controller.reset()
+                self.right_controller.reset()
+                self.setSpeeds(speeds[0], speeds[1])
+        if self.watchdog.stale_run is not None:
+            rospy.logwarn("Motors ran %.2f s on a stale command before stopping" % self.watchdog.stale_run)
+            self.stale_run_pub.publish(Float64(self.watchdog.stale_run))
+            self.watchdog.stale_run = None
+
+    def profileStep(self, now, source, left, right):
+        """Moves the profile towards the arbitrated command, returns the (left, right) setpoints for the watchdog"""
+        dt = 0.0 if self.profile_time is None else min(now - self.profile_time, 4 * self.command_check_period)
+        self.profile_time = now
+        if source is None:
+            return left, right # no fresh command, the watchdog takes over
+        setpoint = self.profile.step((left, right), dt)
+        return float(setpoint[0]), float(setpoint[1])
+
+    def encodersFresh(self, now):
+        """True if the encoders answered within the last couple of polls"""
+        return self.last_encoder_sample is not None and now - self.last_encoder_sample <= 2.5 * self.encoder_rate
+
+    def controlWheels(self, left_counts, right_counts, dt, sample_time):
+        """Runs the wheel controllers on a fresh encoder sample and sends their output"""
+        setpoint = self.wheel_setpoint
+        if setpoint == (0.0, 0.0) or dt <= 0 or dt > 4 * self.encoder_rate:
+            # Stopped, or the counts span too long to be a speed
+            self.left_controller.reset()
+            self.right_controller.reset()
+            return
+        left_distance, right_distance = self.kinematics.countsToDistance(left_counts, right_counts)
+        left_measured = left_distance / dt / self.max_wheel_velocity
+        right_measured = right_distance / dt / self.max_wheel_velocity
+        left = self.left_controller.update(setpoint[0], left_measured, dt)
+        right = self.right_controller.update(setpoint[1], right_measured, dt)
+        self.setSpeeds(left, right)
+        latency = time.time() - sample_time
+        v = self.max_wheel_velocity
+        message = WheelControl(left_setpoint=setpoint[0] * v, right_setpoint=setpoint[1] * v,
+                               left_measured=left_measured * v, right_measured=right_measured * v,
+                               left_error=self.left_controller.error * v, right_error=self.right_controller.error * v,
+                               left_command=left, right_command=right, loop_latency=latency)
+        message.header.stamp = rospy.Time.now()
+        self.wheel_control_pub.publish(message)
+
+    def taskFailed(self, task, exc_info):
+        """Called by the scheduler when a task raises"""
+        logError(exc_info, rospy.logerr, "Exception in the %s task: " % task.name)
+
     def controlCommandReceived(self, msg):
         """Handle's messages received on the /motor_control topic"""
         self.move(msg.speed, msg.direction)
@@ -262,6 +419,7 @@ class AX2550(object):
     def sync(self, msg=None):
         """This function ensures that the motor controller is in serial mode"""
         rospy.loginfo("Syncing MC")
+        sync_start = time.time()
         listening = None
         if hasattr(self, 'serial_listener'):
             listening = self.serial_listener.isListening()
@@ -300,27 +458,35 @@ class AX2550(object):
             self.speed_lock.release()
             if listening:
                 self.serial_listener.listen()
+        self.blackbox.record(blackbox.SYNC, time.time() - sync_start)
         rospy.loginfo('Motor Controller Synchronized')
     
     def shutdown(self):
         """Called when the server shutsdown"""
-        self.running = False
+        self.stop()
+        self.scheduler.shutdown(1.0)
         self.serial_listener.join()
         del self.serial_listener
+        self.blackbox.flush()
         
     def start(self):
         """Called when Control Code Starts"""
         self.running = True
-        self.keepAlive()
+        if self.command_task is None:
+            self.command_task = self.scheduler.every(self.command_check_period, self.checkCommands)
+            # A new command is sent right away instead of at the next check
+            self.arbiter.on_change = self.command_task.trigger
     
     def stop(self):
         """Called when Control Code Stops"""
         self.running = False
-        if self.keep_alive_timer:
-            self.keep_alive_timer.cancel()
+        if self.command_task is not None:
+            self.arbiter.on_change = None
+            self.command_task.cancel()
+            self.command_task = None
     
     def disableKeepAlive(self):
-        """Stops any running keep alive mechanism"""
+        """Stops the command watchdog"""
         self.stop()
     
     def decodeEncoderValue(self, data):
@@ -359,29 +525,28 @@ class AX2550(object):
             return None
     
     def pollEncoders(self):
-        """Polls the encoder on a period"""
-
-	# Kick off the next polling iteration timer
-        if self.running:
-            self.encoder_timer = Timer(self.encoder_rate, self.pollEncoders)
-            self.encoder_timer.start()
-        else:
+        """Polls the encoder, run by the scheduler every encoder_rate seconds"""
+        if not self.running:
             return
         encoder_1 = None
         encoder_2 = None
+        poll_start = time.time()
         try:
             # Lock the speed lock
             self.speed_lock.acquire()
             # Lock the serial lock
             self.serial_lock.acquire()
-            # Query encoder 1
-            encoder_1 = self.getHexData("?Q4\r")
-            # Query encoder 2
-            encoder_2 = self.getHexData("?Q5\r")
-            # Release the serial lock
-            self.serial_lock.release()
-            # Release the speed lock
-            self.speed_lock.release()
+            try:
+                # Query encoder 1
+                encoder_1 = self.getHexData("?Q4\r")
+                # Query encoder 2
+                encoder_2 = self.getHexData("?Q5\r")
+            finally:
+                # Release the locks even on a serial error, the next poll needs them
+                self.serial_lock.release()
+                self.speed_lock.release()
+            sample_time = time.time()
+            fresh = encoder_1 is not None and encoder_2 is not None
             # Convert the encoder data to ints
             if encoder_1 != None:
 #                encoder_1 = self.decodeEncoderValue(encoder_1) * -1
@@ -393,51 +558,70 @@ class AX2550(object):
                 encoder_2 = self.decodeEncoderValue(encoder_2) 
             else:
                 encoder_2 = 0
+            self.blackbox.record(blackbox.ENCODER, encoder_1, encoder_2, time.time() - poll_start)
             # Publish the encoder data
             #header = roslib.msg._Header.Header()
-            message = Encoder(left=encoder_1, right=encoder_2)
-            message.header.stamp = rospy.Time.now()
-            message.header.frame_id = "0"
-            
-            try:
-                self.encoders_pub.publish(message)
-            except:
-                pass
+            stamp = rospy.Time.now()
+            if self.publish_encoder_samples:
+                message = Encoder(left=encoder_1, right=encoder_2)
+                message.header.stamp = stamp
+                message.header.frame_id = "0"
+                
+                try:
+                    self.encoders_pub.publish(message)
+                except:
+                    pass
+            if self.encoder_batch_size > 0:
+                self.batchEncoders(stamp, encoder_1, encoder_2)
+            if fresh:
+                # The counts are relative to the previous query
+                dt = 0.0 if self.last_encoder_query is None else poll_start - self.last_encoder_query
+                self.last_encoder_query = poll_start
+                self.last_encoder_sample = sample_time
+                if self.closed_loop:
+                    self.controlWheels(encoder_1, encoder_2, dt, sample_time)
         except ValueError:
             rospy.logerr("Invalid encoder data received, skipping this one.")
         except Exception as err:
             logError(sys.exc_info(), rospy.logerr, "Exception while Querying the Encoders: ")
-            self.encoder_timer.cancel()
     
-    def keepAlive(self):
-        """This functions sends the latest motor speed to prevent the dead man 
-            system from stopping the motors.
-        """
+    def batchEncoders(self, stamp, left, right):
+        """Adds a sample to the encoder batch, published once it holds encoder_batch_size samples"""
+        stamps, lefts, rights = self.encoder_batch
+        stamps.append(stamp.to_sec())
+        lefts.append(left)
+        rights.append(right)
+        if len(stamps) < self.encoder_batch_size:
+            return
+        self.encoder_batch = ([], [], [])
+        message = EncoderBatch(stamps=numpy.array(stamps, numpy.float64),
+                               left=numpy.array(lefts, numpy.int32), right=numpy.array(rights, numpy.int32))
+        message.header.stamp = stamp
+        message.header.frame_id = "0"
         try:
-            # Lock the speed lock
-            self.speed_lock.acquire()
-            # Resend the current motor speeds
-            self.__setSpeed(self.left_speed, self.right_speed)
-            # Release the speed lock
-            self.speed_lock.release()
-        except Exception as err:
-            logError(sys.exc_info(), rospy.logerr, "Exception in keepAlive function: ")
-        if self.running:
-            self.keep_alive_timer = Timer(0.4, self.keepAlive)
-            self.keep_alive_timer.start()
+            self.encoder_batch_pub.publish(message)
+        except:
+            pass
     
     def move(self, speed=0.0, direction=0.0):
         """Adjusts the motors based on the speed and direction you specify.
             
         Speed and Direction should be values between -1.0 and 1.0, inclusively.
         """
+        speeds = self.mixSpeedDirection(speed, direction)
+        if speeds is not None:
+            #Send the commands
+            self.setSpeeds(left=speeds[0], right=speeds[1])
+
+    def mixSpeedDirection(self, speed, direction):
+        """Returns the (left, right) wheel speeds for a speed and direction, None if they are out of range"""
         #Validate the parameters
         if speed < -1.0 or speed > 1.0:
-            logError(sys.exc_info(), rospy.logerr, "Speed given to the move() function must be between -1.0 and 1.0 inclusively.")
-            return
+            rospy.logerr("Speed given to the move() function must be between -1.0 and 1.0 inclusively.")
+            return None
         if direction < -1.0 or direction > 1.0:
-            logError(sys.exc_info(), rospy.logerr, "Direction given to the move() function must be between -1.0 and 1.0 inclusively.")
-            return
+            rospy.logerr("Direction given to the move() function must be between -1.0 and 1.0 inclusively.")
+            return None
         #First calculate the speed of each motor then send the commands
 #        self.setSpeeds2(speed, direction)
 #        return
@@ -456,8 +640,7 @@ class AX2550(object):
             right_speed = -1.0
         if right_speed > 1.0:
             right_speed = 1.0
-        #Send the commands
-        self.setSpeeds(left=left_speed, right=right_speed)
+        return left_speed, right_speed
 
     def setSpeeds2(self, left=None, right=None):
         """Sets the speed of both motors"""
@@ -546,6 +729,7 @@ class AX2550(object):
         # !B7F  channel 2, 100% forward 
         # !a3F  channel 1, 50% reverse
 
+        self.blackbox.record(blackbox.CMD, left, right)
 
         # Form the commands
         #Left command
@@ -554,7 +738,7 @@ class AX2550(object):
             left_command += "a"
         else:
             left_command += "A"
-        left = int(abs(left) * self.motor_range_left)
+        left = self.left_code_table[int(min(abs(left), 1.0) * self.command_table_scale + 0.5)]
         left_command += "%02X" % left   # Convert left percentage value (max is 1.0) into Hex representation
         #Right command
         right_command = "!"
@@ -562,7 +746,7 @@ class AX2550(object):
             right_command += "b"
         else:
             right_command += "B"
-        right = int(abs(right) * self.motor_range_right)
+        right = self.right_code_table[int(min(abs(right), 1.0) * self.command_table_scale + 0.5)]
         right_command += "%02X" % right  # Convert left percentage value (max is 1.0) into Hex representation
         self.__sendSpeedsToMotorController(left_command, right_command)
         
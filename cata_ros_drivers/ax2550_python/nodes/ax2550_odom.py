@@ -4,43 +4,74 @@
 import roslib; roslib.load_manifest('ax2550_python')
 import rospy
 from rospy.rostime import Time
+from rospy.numpy_msg import numpy_msg
 
 from ax2550_python.msg import Encoder 
+from ax2550_python.msg import EncoderBatch
 from nav_msgs.msg import Odometry
+from nav_msgs.msg import Path
 from geometry_msgs.msg import PoseStamped,Point
+from os5000.msg import CompassData
 
 import tf
 import math
+import sys
+import time
+from threading import Lock
+
+import blackbox
+import heading_filter
+import kinematics
+import odom_checkpoint
+import path_simplifier
+import wheel_odometry
+from logerror import logError
 
 odom_pose = None
 odom_pub = None
 odom_broadcaster = None
+odom_blackbox = blackbox.NullBlackBox() # ring file with the odometry updates, see blackbox.py
+odom_checkpoint_file = odom_checkpoint.NullCheckpoint() # pose saved for a respawn, see odom_checkpoint.py
+checkpoint_period = 0.2 # seconds between checkpoint saves
+last_checkpoint = 0.0
 
-wheel_base_width = 0.70 # WHEEL_BASE_LENGTH   = 0.70 # meters (CATA)
-# Found out proper encoder resolution by
-# counting the pulses output in one revolution...it's better to do pulses_in_10_revs/10 revs) 
-encoder_resolution = 1920 #cycles per revolution * 4 (quadrature) = pulses per revolution
-wheel_diameter_left = 0.30 #meters (CATA) 
-wheel_diameter_right = 0.30 #meters (CATA)
-wheel_circum_left = math.pi * wheel_diameter_left
-wheel_circum_right = math.pi * wheel_diameter_right
-theta=0.0 # heading angle of the robot
-x=0.0 # x position
-y=0.0 # y posititon
+# Wheel base and wheel sizes, shared with ax2550_driver (config/kinematics.yaml)
+base_kinematics = kinematics.DiffDriveKinematics()
+# Pose (x, y, theta) and twist of the robot, see wheel_odometry.py
+odometry = wheel_odometry.WheelOdometry(base_kinematics)
+use_header_stamps = True # integrate with the stamps of the samples rather than their arrival
 current_time = 0 
 previous_time = 0
+previous_arrival = 0 # rospy.Time the last sample arrived, previous_time is its stamp
+last_published = None # stamp of the last pose published, a prediction never goes back in time
+sample_period = None # seconds between the stamps of the last two samples, predictions stay within it
 left_cpr = 0;
 right_cpr = 0;
+odom_lock = Lock() # the prediction timer runs in its own thread
+compass_filter = None # heading_filter.HeadingFilter when ~compass_fusion is on
+path_pub = None
+base_path = None # path_simplifier.PathSimplifier of the whole run when ~path_rate is set
+path_poses = [] # PoseStamped of the points kept by base_path
+path_generation = 0
 
+# Predictions published between encoder samples, see ~prediction_rate
+max_prediction_age = 0.25 # seconds, the pose is held after that long without a sample
+prediction_noise_linear = 0.5 # m/s, standard deviation of the linear velocity change during a prediction
+prediction_noise_angular = 1.0 # rad/s, standard deviation of the angular velocity change during a prediction
 
 MAX_DBL = 1e+100  
+POSE_VARIANCE = (1e-5, 1e-5, 1e-3) # x, y, yaw of a measured pose
+pose_variance = list(POSE_VARIANCE) # grows when the pose is resumed from an old checkpoint
+
+def sampleStamp(header):
+    """Time of a sample, its header stamp unless ~use_header_stamps is off or the stamp is empty"""
+    if use_header_stamps and not header.stamp.is_zero():
+        return header.stamp
+    return rospy.Time.now()
 
 def encoderDataReceived(data):
     """Called when encoder data is received"""
-    global odom_pub,odom_pose
-    global wheel_base_width, wheel_diameter_left, wheel_diameter_right, wheel_circum_left, wheel_circum_right,encoder_resolution
-    global x, y, theta
-    global current_time,previous_time
+    global current_time,previous_time,previous_arrival,sample_period
     
     # --------------------------
     # Just for getting the actual PPR:
@@ -52,40 +83,171 @@ def encoderDataReceived(data):
     #print "CPR Right = %d" % (right_cpr) # 19185 pulses / 10 revs = 1919 ppr = 
     # -------------------------------------------
     
-    current_time = rospy.Time.now()
-    time_delta = (current_time - previous_time).to_sec()
-    
-    # The following computes the linear distance traveled by each wheel
-    # distance = (number of pulses read from encoder) * (wheel circumference) / (pulses per revolution)
-    left = data.left * wheel_circum_left/encoder_resolution
-    right = data.right * wheel_circum_right/encoder_resolution
-
-    # Linear velocities:
-    vl = left / time_delta
-    vr = right / time_delta
-    angular_velocity = (vr-vl)/wheel_base_width;
-    linear_velocity_x = (vr+vl)/2;     
-    # vy is always 0 for a differential drive
-    
-#    delta_x = (linear_velocity_x * cos(theta) - vy * sin(theta)) * time_delta;
-    delta_x = (linear_velocity_x * math.cos(theta)) * time_delta;
-#    delta_y = (linear_velocity_x * sin(theta) + vy * cos(theta)) * time_delta;
-    delta_y = (linear_velocity_x * math.sin(theta)) * time_delta;
-    delta_theta = angular_velocity * time_delta;
-
-    # Update 2-D position components:
-    x += delta_x;
-    y += delta_y;
-    theta += delta_theta;
-
-    # Save time
-    previous_time = current_time
- 
+    odom_lock.acquire()
+    try:
+        current_time = sampleStamp(data.header)
+        if odometry.stamp is not None:
+            sample_period = current_time.to_sec() - odometry.stamp
+
+        # Update 2-D position components along the arc driven since the last update,
+        # starting from the last measured pose so the predictions in between are corrected
+        x, y, theta = odometry.update(current_time.to_sec(), data.left, data.right)
+        odom_blackbox.record(blackbox.ODOM, x, y, theta)
+
+        # Save time
+        previous_time = current_time
+        previous_arrival = rospy.Time.now()
+        publishOdometry(current_time, x, y, theta, odometry.linear_velocity, odometry.angular_velocity)
+        saveCheckpoint()
+        if base_path is not None:
+            base_path.add(current_time, x, y, theta)
+    finally:
+        odom_lock.release()
+
+def encoderBatchReceived(data):
+    """Called when a batch of encoder samples is received, integrates all of them at once"""
+    global current_time,previous_time,previous_arrival,sample_period
+
+    if len(data.stamps) == 0:
+        return
+
+    odom_lock.acquire()
+    try:
+        current_time = rospy.Time.from_sec(data.stamps[-1])
+        if odometry.stamp is not None:
+            sample_period = data.stamps[-1] - odometry.stamp
+        # Mean velocities over the batch
+        xs, ys, thetas = odometry.updateBatch(data.stamps, data.left, data.right)
+        x, y, theta = odometry.x, odometry.y, odometry.theta
+        odom_blackbox.record(blackbox.ODOM, x, y, theta)
+
+        previous_time = current_time
+        previous_arrival = rospy.Time.now()
+        publishOdometry(current_time, x, y, theta, odometry.linear_velocity, odometry.angular_velocity)
+        saveCheckpoint()
+        if base_path is not None:
+            for i in xrange(len(xs) - 1):
+                base_path.add(rospy.Time.from_sec(data.stamps[i]), float(xs[i]), float(ys[i]), float(thetas[i]))
+            base_path.add(current_time, x, y, theta)
+    finally:
+        odom_lock.release()
+
+def compassDataReceived(data):
+    """Called when compass data is received, corrects the heading"""
+    odom_lock.acquire()
+    try:
+        # CompassData has no header, the arrival time is the stamp
+        if not odometry.compass(rospy.get_time(), heading_filter.compassHeading(data.yaw)):
+            rospy.logdebug("Compass reading %.1f deg rejected as an outlier" % data.yaw)
+    finally:
+        odom_lock.release()
+
+def pathPose(point):
+    """PoseStamped of a (stamp, x, y, theta) point of the simplified path"""
+    stamp, px, py, ptheta = point
+    quat = tf.transformations.quaternion_from_euler(0,0,ptheta)
+    pose = PoseStamped()
+    pose.header.stamp = stamp
+    pose.header.frame_id = "odom_wheel_frame"
+    pose.pose.position = Point(px,py,0)
+    pose.pose.orientation.x = quat[0]
+    pose.pose.orientation.y = quat[1]
+    pose.pose.orientation.z = quat[2]
+    pose.pose.orientation.w = quat[3]
+    return pose
+
+def publishPath(event):
+    """Timer callback publishing the simplified path of the run"""
+    global path_poses, path_generation
+    odom_lock.acquire()
+    try:
+        if base_path.generation != path_generation:
+            # The path was simplified again, the cached poses are stale
+            path_poses = []
+            path_generation = base_path.generation
+        points = base_path.points
+        path_poses.extend(pathPose(point) for point in points[len(path_poses):])
+        tail = base_path.path()[len(points):]
+        path_msg = Path()
+        path_msg.header.stamp = rospy.Time.now()
+        path_msg.header.frame_id = "odom_wheel_frame"
+        path_msg.poses = path_poses + [pathPose(point) for point in tail]
+    finally:
+        odom_lock.release()
+    path_pub.publish(path_msg)
+
+def saveCheckpoint(force=False):
+    """Saves the pose into the checkpoint at most every checkpoint_period seconds, called with odom_lock held"""
+    global last_checkpoint
+    now = time.time()
+    if not force and now - last_checkpoint < checkpoint_period:
+        return
+    last_checkpoint = now
+    if compass_filter is None:
+        odom_checkpoint_file.save(odometry.x, odometry.y, odometry.theta, pose_variance, None, now)
+    else:
+        odom_checkpoint_file.save(odometry.x, odometry.y, odometry.theta,
+                                  (pose_variance[0], pose_variance[1], compass_filter.variance),
+                                  compass_filter.offset, now)
+
+def resumeCheckpoint(max_age):
+    """Resumes the pose from the checkpoint if it is younger than max_age seconds"""
+    checkpoint = odom_checkpoint_file.load()
+    if checkpoint is None:
+        return
+    age = checkpoint.age()
+    if age < 0 or age > max_age:
+        rospy.loginfo("Odometry checkpoint is %.1f s old, starting at the origin" % age)
+        return
+    odometry.reset(checkpoint.x, checkpoint.y, checkpoint.theta)
+    # The robot may have moved while the node was down
+    pose_variance[0] = checkpoint.variance[0] + (prediction_noise_linear * age) ** 2
+    pose_variance[1] = checkpoint.variance[1] + (prediction_noise_linear * age) ** 2
+    pose_variance[2] = max(POSE_VARIANCE[2], checkpoint.variance[2]) + (prediction_noise_angular * age) ** 2
+    if compass_filter is not None:
+        compass_filter.offset = checkpoint.heading_offset
+        compass_filter.variance = pose_variance[2]
+    odom_blackbox.record(blackbox.ODOM, odometry.x, odometry.y, odometry.theta)
+    rospy.loginfo("Resumed odometry at x: %.3f, y: %.3f, theta: %.3f from a %.2f s old checkpoint" %
+                  (odometry.x, odometry.y, odometry.theta, age))
+
+def predictOdometry(event):
+    """Timer callback publishing the pose extrapolated from the last twist since the last encoder sample"""
+    odom_lock.acquire()
+    try:
+        # Stamped on the clock of the samples, which are header stamps with ~use_header_stamps
+        age = (rospy.Time.now() - previous_arrival).to_sec()
+        if age <= 0:
+            return
+        if sample_period is not None and age >= sample_period:
+            # The next sample is due, a later stamp could pass the measured pose
+            return
+        stamp = previous_time + rospy.Duration.from_sec(age)
+        if last_published is not None and stamp <= last_published:
+            return
+        horizon = min(age, max_prediction_age)
+        linear_velocity, angular_velocity = odometry.linear_velocity, odometry.angular_velocity
+        left, right = base_kinematics.twistToWheels(linear_velocity * horizon, angular_velocity * horizon)
+        pose = base_kinematics.integrate(odometry.x, odometry.y, odometry.theta, left, right)
+        if age > max_prediction_age:
+            # The encoders went quiet, hold the pose instead of driving off with a stale twist
+            publishOdometry(stamp, pose[0], pose[1], pose[2], 0.0, 0.0, age)
+        else:
+            publishOdometry(stamp, pose[0], pose[1], pose[2], linear_velocity, angular_velocity, age)
+    finally:
+        odom_lock.release()
+
+def publishOdometry(stamp, x, y, theta, linear_velocity_x, angular_velocity, age=0.0):
+    """Publishes a pose and velocities, the covariance grows with the age of a prediction"""
+    global odom_pub,odom_pose,last_published
+    last_published = stamp
     quat = tf.transformations.quaternion_from_euler(0,0,theta)
+    linear_variance = (prediction_noise_linear * age) ** 2
+    angular_variance = (prediction_noise_angular * age) ** 2
    
     ### Insert math into Odom msg so it can be published
     odom_msg = Odometry()
-    odom_msg.header.stamp = rospy.Time.now()
+    odom_msg.header.stamp = stamp
     #odom_msg.header.frame_id="odom_combined"
     odom_msg.header.frame_id="odom_wheel_frame"
     odom_msg.pose.pose.position.x = x
@@ -98,12 +260,12 @@ def encoderDataReceived(data):
 
     # TODO: fill with own covariance values
     # 6x6 Covariance matrix
-    odom_msg.pose.covariance = [1e-5, 0, 0, 0, 0, 0,  # x
-			        0, 1e-5, 0, 0, 0, 0,  # y
+    odom_msg.pose.covariance = [pose_variance[0] + linear_variance, 0, 0, 0, 0, 0,  # x
+			        0, pose_variance[1] + linear_variance, 0, 0, 0, 0,  # y
 				0, 0, MAX_DBL, 0, 0, 0,   # z
 				0, 0, 0, MAX_DBL, 0, 0,   # x_ang
 				0, 0, 0, 0, MAX_DBL, 0,   # y_ang
-				0, 0, 0, 0, 0, 1e-3]      # z_ang
+				0, 0, 0, 0, 0, pose_variance[2] + angular_variance]      # z_ang
     odom_msg.twist.twist.linear.x = linear_velocity_x
 #    odom_msg.twist.twist.linear.y = 0.0
 #    odom_msg.twist.twist.angular.x = theta_dot
@@ -111,7 +273,7 @@ def encoderDataReceived(data):
     odom_msg.twist.covariance = odom_msg.pose.covariance
  
     odom_pose_msg = PoseStamped()
-    odom_pose_msg.header.stamp = rospy.Time.now()
+    odom_pose_msg.header.stamp = stamp
     #odom_pose_msg.header.frame_id="odom_combined"
     odom_pose_msg.header.frame_id="pose_wheel_frame"
     odom_pose_msg.pose.orientation.x = quat[0]
@@ -124,23 +286,81 @@ def encoderDataReceived(data):
     odom_pub.publish(odom_msg)
     odom_pose.publish(odom_pose_msg)    
 
+def shutdown():
+    """Saves the last pose on a clean shutdown"""
+    odom_lock.acquire()
+    try:
+        saveCheckpoint(force=True)
+    finally:
+        odom_lock.release()
+
 def ax2550EncodersListener():
     """Main loop"""
     global odom_pub
     global odom_pose
-    global current_time,previous_time
+    global current_time,previous_time,previous_arrival
     global odom_broadcaster
+    global odom_blackbox
+    global base_kinematics
+    global max_prediction_age, prediction_noise_linear, prediction_noise_angular
+    global compass_filter, odometry, use_header_stamps
+    global odom_checkpoint_file, checkpoint_period
+    global path_pub, base_path
     
     rospy.init_node('base_odom', anonymous=True)
-    rospy.Subscriber('/cata/motor_control_encoders', Encoder, encoderDataReceived)
-        
+    base_kinematics = kinematics.loadKinematics()
+    prediction_rate = rospy.get_param('~prediction_rate', 0.0) # Hz, poses predicted between encoder samples, 0 disables them
+    max_prediction_age = rospy.get_param('~max_prediction_age', max_prediction_age) # seconds
+    prediction_noise_linear = rospy.get_param('~prediction_noise_linear', prediction_noise_linear) # m/s
+    prediction_noise_angular = rospy.get_param('~prediction_noise_angular', prediction_noise_angular) # rad/s
+    try:
+        odom_blackbox = blackbox.openBlackBox(rospy.get_param('~blackbox', 'ax2550_odom'), # name in ~/.ros/blackbox or a path, '' disables it
+                                              rospy.get_param('~blackbox_records', blackbox.DEFAULT_CAPACITY))
+    except Exception as err:
+        logError(sys.exc_info(), rospy.logerr, "Exception while opening the black box, not recording: ")
+    checkpoint_period = rospy.get_param('~checkpoint_period', checkpoint_period) # seconds between saves
+    try:
+        odom_checkpoint_file = odom_checkpoint.openCheckpoint(rospy.get_param('~checkpoint', 'ax2550_odom')) # name in ~/.ros/checkpoint or a path, '' disables it
+    except Exception as err:
+        logError(sys.exc_info(), rospy.logerr, "Exception while opening the odometry checkpoint, not saving the pose: ")
+    if rospy.get_param('~compass_fusion', False): # correct the wheel heading with the OS5000 compass
+        compass_filter = heading_filter.HeadingFilter(
+            compass_noise=math.radians(rospy.get_param('~compass_noise', 2.0)), # degrees, standard deviation of a reading
+            drift_noise=rospy.get_param('~heading_drift_noise', 0.01), # rad per sqrt(s)
+            slip_noise=rospy.get_param('~heading_slip_noise', 0.1), # rad per sqrt(rad) turned
+            latency=rospy.get_param('~compass_latency', 0.1), # seconds
+            gate=rospy.get_param('~compass_gate', 3.0)) # standard deviations, readings further away are outliers
+    odometry = wheel_odometry.WheelOdometry(base_kinematics, compass_filter)
+    use_header_stamps = rospy.get_param('~use_header_stamps', use_header_stamps) # stamps of the driver's samples, false for the arrival time
+    resumeCheckpoint(rospy.get_param('~checkpoint_max_age', 10.0)) # seconds, older checkpoints start at the origin
+
+    # Everything the callbacks use exists before the first message can arrive
     odom_pub = rospy.Publisher('/cata/base_odom', Odometry)
     odom_pose = rospy.Publisher('/cata/base_pose', PoseStamped)
 
     current_time=rospy.Time.now()
     previous_time = current_time
+    previous_arrival = current_time
+
+    if compass_filter is not None:
+        rospy.Subscriber(rospy.get_param('~compass_topic', '/compassData'), CompassData, compassDataReceived, queue_size=1)
+    if rospy.get_param('~encoder_batch', False): # integrate /cata/motor_control_encoder_batch, see ~encoder_batch_size in the driver
+        rospy.Subscriber('/cata/motor_control_encoder_batch', numpy_msg(EncoderBatch), encoderBatchReceived)
+    else:
+        rospy.Subscriber('/cata/motor_control_encoders', Encoder, encoderDataReceived)
     
     odom_broadcaster = tf.TransformBroadcaster()
+    rospy.on_shutdown(shutdown)
+
+    if prediction_rate > 0:
+        rospy.Timer(rospy.Duration(1.0 / prediction_rate), predictOdometry)
+
+    path_rate = rospy.get_param('~path_rate', 0.0) # Hz, simplified path of the whole run on /cata/base_path, 0 disables it
+    if path_rate > 0:
+        base_path = path_simplifier.PathSimplifier(rospy.get_param('~path_tolerance', 0.05), # meters
+                                                   rospy.get_param('~path_max_points', 2000))
+        path_pub = rospy.Publisher('/cata/base_path', Path)
+        rospy.Timer(rospy.Duration(1.0 / path_rate), publishPath)
 
     rospy.spin()
     
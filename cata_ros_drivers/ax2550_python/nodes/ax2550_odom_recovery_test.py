@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_odom_recovery_test.py - Measures how fast and how well ax2550_odom.py resumes
+its pose from the checkpoint (odom_checkpoint.py) after a crash
+
+Run it with only a roscore up, it starts ax2550_odom itself:
+
+  rosrun ax2550_python ax2550_odom_recovery_test.py _crashes:=10
+
+Encoder samples of a robot driving a slow circle are published at ~encoder_rate. Every
+~drive_time the odometry node is killed with SIGKILL and started again. For each
+crash it reports the recovery time, from the restart until the first odometry message,
+and the pose jump between the last odometry before the kill and the first one after
+the restart, less the distance driven while the node was down. Without the checkpoint
+the jump is the distance from the origin.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import rospy
+
+# ROS msg and srv imports
+from ax2550_python.msg import Encoder
+from nav_msgs.msg import Odometry
+
+# Python Libraries
+from threading import Thread, Lock
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# Peer Libraries
+import kinematics
+import odom_checkpoint
+
+NODES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+###  Classes  ###
+
+class RecoveryTest(object):
+    """Crashes and restarts ax2550_odom while feeding it encoder samples"""
+    def __init__(self):
+        rospy.init_node('ax2550_odom_recovery_test', anonymous=True)
+        self.crashes = rospy.get_param('~crashes', 10)
+        self.drive_time = rospy.get_param('~drive_time', 3.0) # seconds between crashes
+        self.encoder_rate = rospy.get_param('~encoder_rate', 20.0) # Hz
+        self.left_counts = rospy.get_param('~left_counts', 30) # per sample
+        self.right_counts = rospy.get_param('~right_counts', 40) # per sample
+        self.startup_timeout = rospy.get_param('~startup_timeout', 30.0) # seconds
+        self.kinematics = kinematics.loadKinematics()
+
+        self.lock = Lock()
+        self.last_odom = None # (receive time, x, y)
+        self.odom_count = 0
+        self.done = False
+        self.work_dir = tempfile.mkdtemp(prefix='ax2550_odom_recovery_')
+        self.checkpoint_path = os.path.join(self.work_dir, 'odom.ckpt')
+        self.process = None
+
+        self.encoders_pub = rospy.Publisher('/cata/motor_control_encoders', Encoder)
+        rospy.Subscriber('/cata/base_odom', Odometry, self.odomReceived)
+        encoder_thread = Thread(target=self.encoderLoop, name='encoders')
+        encoder_thread.daemon = True
+        encoder_thread.start()
+        try:
+            self.run()
+        finally:
+            self.done = True
+            self.stopNode(signal.SIGTERM)
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def odomReceived(self, msg):
+        """Keeps the last odometry and counts the messages"""
+        with self.lock:
+            self.last_odom = (time.time(), msg.pose.pose.position.x, msg.pose.pose.position.y)
+            self.odom_count += 1
+
+    def encoderLoop(self):
+        """Publishes the encoder samples of a slow circle"""
+        rate = rospy.Rate(self.encoder_rate)
+        while not self.done and not rospy.is_shutdown():
+            message = Encoder(left=self.left_counts, right=self.right_counts)
+            message.header.stamp = rospy.Time.now()
+            self.encoders_pub.publish(message)
+            rate.sleep()
+
+    def startNode(self):
+        """Starts ax2550_odom and returns the time it was started"""
+        command = [sys.executable, os.path.join(NODES_DIR, 'ax2550_odom.py'), '__name:=recovery_odom',
+                   '_checkpoint:=%s' % self.checkpoint_path, '_blackbox:=', '_prediction_rate:=0',
+                   '_compass_fusion:=false', '_encoder_batch:=false']
+        started = time.time()
+        self.process = subprocess.Popen(command)
+        return started
+
+    def stopNode(self, signum=signal.SIGKILL):
+        """Stops ax2550_odom"""
+        if self.process is not None and self.process.poll() is None:
+            os.kill(self.process.pid, signum)
+            self.process.wait()
+        self.process = None
+
+    def waitForOdom(self, count, timeout):
+        """Returns the first odometry with a count above count, None on a timeout"""
+        deadline = time.time() + timeout
+        while time.time() < deadline and not rospy.is_shutdown():
+            with self.lock:
+                if self.odom_count > count:
+                    return self.last_odom
+            time.sleep(0.001)
+        return None
+
+    def run(self):
+        """Runs the crashes and prints the recovery of each one"""
+        self.startNode()
+        if self.waitForOdom(0, self.startup_timeout) is None:
+            rospy.logerr("ax2550_odom did not publish within %.0f s" % self.startup_timeout)
+            return
+        # Speed of the simulated robot, to discount the distance driven while the node is down
+        left, right = self.kinematics.countsToDistance(self.left_counts, self.right_counts)
+        speed = (left + right) / 2.0 * self.encoder_rate
+        recoveries = []
+        jumps = []
+        print "%5s %12s %10s %10s %12s" % ("crash", "recovery s", "jump m", "down m", "checkpoint")
+        for crash in xrange(self.crashes):
+            time.sleep(self.drive_time)
+            with self.lock:
+                before = self.last_odom
+                count = self.odom_count
+            self.stopNode(signal.SIGKILL)
+            checkpoint = odom_checkpoint.readCheckpoint(self.checkpoint_path)
+            started = self.startNode()
+            after = self.waitForOdom(count, self.startup_timeout)
+            if after is None:
+                rospy.logerr("ax2550_odom did not publish within %.0f s of the restart" % self.startup_timeout)
+                return
+            recovery = after[0] - started
+            jump = math.hypot(after[1] - before[1], after[2] - before[2])
+            # The robot kept driving on a circle while the node was down, the chord is at most the arc
+            down = speed * (after[0] - before[0])
+            recoveries.append(recovery)
+            jumps.append(max(0.0, jump - down))
+            print "%5d %12.3f %10.3f %10.3f %12s" % (crash + 1, recovery, jump, down,
+                "%.2f s old" % checkpoint.age(started) if checkpoint is not None else "none")
+        recoveries.sort()
+        jumps.sort()
+        print "recovery: median %.3f s, max %.3f s" % (recoveries[len(recoveries) // 2], recoveries[-1])
+        print "pose jump beyond the distance driven: median %.3f m, max %.3f m" % (jumps[len(jumps) // 2], jumps[-1])
+
+# end class RecoveryTest
+
+###  If Main  ###
+if __name__ == '__main__':
+    RecoveryTest()
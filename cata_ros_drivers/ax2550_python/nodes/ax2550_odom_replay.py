@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_odom_replay.py - Runs recorded encoder samples through the odometry of
+ax2550_odom.py as fast as possible
+
+Usage: ax2550_odom_replay.py [options] bag
+
+The encoder topic of the bag is read column-wise with cata_bags.bag_columns (cached
+next to the bag) and every sample goes through wheel_odometry.WheelOdometry, the
+same pose update the node runs, with the recorded header stamps instead of the clock.
+No roscore is needed and the results do not depend on the replay speed, so an hour
+of driving replays in seconds and two versions of the odometry can be compared bit
+for bit:
+
+  ax2550_odom_replay.py --npz before.npz data/run.bag
+  (change wheel_odometry.py, kinematics.py or heading_filter.py)
+  ax2550_odom_replay.py --compare before.npz data/run.bag
+
+With --compass-topic the OS5000 readings are fused into the heading like
+~compass_fusion does, fed in the order the samples and the readings were recorded.
+The poses, one per encoder message, go to an .npz file (stamp, x, y, theta,
+linear_velocity, angular_velocity) and/or to a new bag as nav_msgs/Odometry on
+/cata/base_odom.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import roslib.packages
+
+# Python Libraries
+from optparse import OptionParser
+import math
+import os
+import sys
+import time
+
+import numpy
+
+from cata_bags.bag_columns import bagColumns
+
+# Peer Libraries
+import heading_filter
+import kinematics
+import wheel_odometry
+
+###  Constants  ###
+
+COLUMNS = ('stamp', 'x', 'y', 'theta', 'linear_velocity', 'angular_velocity')
+
+###  Functions  ###
+
+def splitMessages(columns, name):
+    """Per message arrays of a variable array column of bag_columns"""
+    values = numpy.asarray(columns[name])
+    lengths = columns.get(name + '.lengths')
+    if lengths is None:
+        return list(values) # 2-D, one row per message
+    return numpy.split(values, numpy.cumsum(lengths)[:-1])
+
+def sampleStamps(columns, arrival):
+    """Header stamps of the samples like ~use_header_stamps, the receive time when empty or arrival is set"""
+    t = numpy.asarray(columns['t'])
+    if arrival:
+        return t
+    stamps = numpy.asarray(columns['header.stamp'])
+    return numpy.where(stamps == 0, t, stamps)
+
+def replay(odometry, events, samples, batches, readings):
+    """Feeds the events in order to odometry, returns the (N, 6) COLUMNS of the pose after each sample
+
+    events are (kind, index) pairs, kind 0 for an encoder message and 1 for a compass
+    reading. samples are the (stamps, left, right) of the Encoder messages, batches the
+    per message arrays of the non empty EncoderBatch messages, readings the (stamps,
+    headings) of the compass.
+    """
+    poses = numpy.empty((len(events) - len(readings[0]), len(COLUMNS)))
+    row = 0
+    for kind, i in events:
+        if kind == 1:
+            odometry.compass(readings[0][i], readings[1][i])
+            continue
+        if batches is None:
+            odometry.update(samples[0][i], samples[1][i], samples[2][i])
+        else:
+            odometry.updateBatch(batches[0][i], batches[1][i], batches[2][i])
+        poses[row] = (odometry.stamp, odometry.x, odometry.y, odometry.theta,
+                      odometry.linear_velocity, odometry.angular_velocity)
+        row += 1
+    return poses[:row]
+
+def writeBag(path, receive_times, poses):
+    """Writes the poses as nav_msgs/Odometry on /cata/base_odom"""
+    import rosbag
+    import rospy
+    import tf
+    from nav_msgs.msg import Odometry
+    bag = rosbag.Bag(path, 'w')
+    try:
+        for t, (stamp, x, y, theta, linear, angular) in zip(receive_times, poses):
+            quat = tf.transformations.quaternion_from_euler(0,0,theta)
+            msg = Odometry()
+            msg.header.stamp = rospy.Time.from_sec(stamp)
+            msg.header.frame_id = "odom_wheel_frame"
+            msg.pose.pose.position.x = x
+            msg.pose.pose.position.y = y
+            msg.pose.pose.orientation.x = quat[0]
+            msg.pose.pose.orientation.y = quat[1]
+            msg.pose.pose.orientation.z = quat[2]
+            msg.pose.pose.orientation.w = quat[3]
+            msg.twist.twist.linear.x = linear
+            msg.twist.twist.angular.z = angular
+            bag.write('/cata/base_odom', msg, rospy.Time.from_sec(t))
+    finally:
+        bag.close()
+
+def compare(path, poses):
+    """Prints how the poses differ from those of an earlier --npz, returns True if they are identical"""
+    reference = numpy.load(path)
+    if len(reference['x']) != len(poses):
+        print "%d poses, %s has %d" % (len(poses), path, len(reference['x']))
+        return False
+    identical = True
+    for i, name in enumerate(COLUMNS):
+        difference = poses[:, i] != reference[name]
+        if difference.any():
+            identical = False
+            first = numpy.flatnonzero(difference)[0]
+            print "%-18s %d poses differ, the first at stamp %.6f, max difference %g" % (name, difference.sum(),
+                  poses[first, 0], numpy.abs(poses[:, i] - reference[name]).max())
+    if identical:
+        print "Identical to %s" % path
+    return identical
+
+###  If Main  ###
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] bag")
+    parser.add_option('--topic', default='/cata/motor_control_encoders', help="Encoder topic [%default]")
+    parser.add_option('--batch-topic', help="replay this EncoderBatch topic instead, like ~encoder_batch")
+    parser.add_option('--arrival-stamps', action='store_true',
+                      help="use the receive times of the Encoder messages instead of their header stamps, like ~use_header_stamps false")
+    parser.add_option('--kinematics', default=os.path.join(roslib.packages.get_pkg_dir('ax2550_python'), 'config', 'kinematics.yaml'),
+                      help="wheel base and wheel sizes shared with the driver [%default]")
+    parser.add_option('--compass-topic', help="fuse the CompassData of this topic into the heading, e.g. /compassData")
+    parser.add_option('--compass-noise', type='float', default=2.0, help="degrees [%default]")
+    parser.add_option('--compass-latency', type='float', default=0.1, help="seconds [%default]")
+    parser.add_option('--compass-gate', type='float', default=3.0, help="standard deviations [%default]")
+    parser.add_option('--heading-drift-noise', type='float', default=0.01, help="rad per sqrt(s) [%default]")
+    parser.add_option('--heading-slip-noise', type='float', default=0.1, help="rad per sqrt(rad) turned [%default]")
+    parser.add_option('--npz', help="write the poses to an .npz file")
+    parser.add_option('--bag', help="write the poses to a bag as nav_msgs/Odometry")
+    parser.add_option('--compare', help="compare the poses with an .npz of an earlier replay, exit status 1 if they differ")
+    parser.add_option('--cache-dir', help="where bag_columns caches the columns [<bag>.columns]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected one bag")
+    path = args[0]
+
+    started = time.time()
+    topic = options.batch_topic or options.topic
+    selection = {topic: ['stamps', 'left', 'right'] if options.batch_topic else ['header.stamp', 'left', 'right']}
+    if options.compass_topic:
+        selection[options.compass_topic] = ['yaw']
+    try:
+        columns = bagColumns(path, selection, options.cache_dir)
+    except ValueError, e:
+        sys.exit(str(e))
+    encoders = columns[topic]
+    receive_times = numpy.asarray(encoders['t'])
+    if options.batch_topic:
+        # The node integrates batches with the driver's stamps and skips the empty ones
+        samples = None
+        batches = (splitMessages(encoders, 'stamps'), splitMessages(encoders, 'left'), splitMessages(encoders, 'right'))
+        kept = [i for i in xrange(len(batches[0])) if len(batches[0][i])]
+        batches = tuple([arrays[i] for i in kept] for arrays in batches)
+        receive_times = receive_times[kept]
+    else:
+        batches = None
+        samples = (sampleStamps(encoders, options.arrival_stamps).tolist(),
+                   numpy.asarray(encoders['left']).tolist(), numpy.asarray(encoders['right']).tolist())
+
+    compass_filter = None
+    readings = ([], [])
+    kinds = numpy.zeros(len(receive_times), numpy.int8)
+    order_times = receive_times
+    if options.compass_topic:
+        compass_filter = heading_filter.HeadingFilter(
+            compass_noise=math.radians(options.compass_noise), drift_noise=options.heading_drift_noise,
+            slip_noise=options.heading_slip_noise, latency=options.compass_latency, gate=options.compass_gate)
+        compass = columns[options.compass_topic]
+        # CompassData has no header, the node stamps a reading with its arrival
+        readings = (numpy.asarray(compass['t']).tolist(),
+                    [heading_filter.compassHeading(float(yaw)) for yaw in compass['yaw']])
+        kinds = numpy.concatenate((kinds, numpy.ones(len(readings[0]), numpy.int8)))
+        order_times = numpy.concatenate((receive_times, compass['t']))
+    indices = numpy.concatenate((numpy.arange(len(receive_times)), numpy.arange(len(readings[0]))))
+    # In the order the node received them, a sample before a reading of the same time
+    order = numpy.argsort(order_times, kind='mergesort')
+    events = zip(kinds[order].tolist(), indices[order].tolist())
+    loaded = time.time()
+
+    odometry = wheel_odometry.WheelOdometry(kinematics.loadKinematicsFile(options.kinematics), compass_filter)
+    poses = replay(odometry, events, samples, batches, readings)
+    finished = time.time()
+    if len(poses) == 0:
+        sys.exit("No encoder samples on %s in %s" % (topic, path))
+    duration = poses[-1, 0] - poses[0, 0]
+    print "%d encoder messages over %.1f s replayed in %.2f s (%.2f s loading the bag), %.0fx real time" % (
+          len(poses), duration, finished - started, loaded - started, duration / max(finished - loaded, 1e-9))
+    print "final pose x: %.3f, y: %.3f, theta: %.3f" % tuple(poses[-1, 1:4])
+    if compass_filter is not None:
+        print "compass readings: %d used, %d rejected" % (compass_filter.accepted, compass_filter.rejected)
+
+    if options.npz:
+        numpy.savez(options.npz, **dict((name, poses[:, i]) for i, name in enumerate(COLUMNS)))
+    if options.bag:
+        writeBag(options.bag, receive_times, poses)
+    if options.compare and not compare(options.compare, poses):
+        sys.exit(1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_profile_replay.py - Replays recorded cmd_vel through the driver's velocity
+profile (velocity_profile.py) to compare acceleration and jerk limits offline
+
+Usage: ax2550_profile_replay.py [options] recording
+
+The recording is a bag with a cmd_vel topic, or a driver black box ring (see
+blackbox.py). The commands are turned into wheel speeds like ax2550_driver.py does,
+held until they go stale, sampled at the control rate and run through every
+combination of --accel and --jerk at once. For each setting it prints the peak
+acceleration and jerk of the setpoints and how far they lag behind the commands.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import roslib.packages
+
+# Python Libraries
+from optparse import OptionParser
+import os
+import sys
+
+import numpy
+
+# Peer Libraries
+import blackbox
+import kinematics
+import velocity_profile
+
+###  Functions  ###
+
+def floatList(text):
+    """Parses a comma separated list of floats"""
+    return [float(value) for value in text.split(',') if value.strip()]
+
+def readBag(path, topic):
+    """Returns the stamps, linear x and angular z of the Twists on a topic of a bag"""
+    import rosbag
+    stamps = []
+    linear = []
+    angular = []
+    bag = rosbag.Bag(path)
+    try:
+        for _, msg, stamp in bag.read_messages(topics=[topic]):
+            stamps.append(stamp.to_sec())
+            linear.append(msg.linear.x)
+            angular.append(msg.angular.z)
+    finally:
+        bag.close()
+    return numpy.array(stamps), numpy.array(linear), numpy.array(angular)
+
+def readBlackBox(path):
+    """Returns the stamps, linear x and angular z of the cmd_vel records of a black box ring"""
+    records = blackbox.readRecords(path)
+    records = records[records['event'] == blackbox.CMD_VEL]
+    return records['stamp'], records['a'].astype(numpy.float64), records['b'].astype(numpy.float64)
+
+def wheelSpeeds(linear, angular, base):
+    """(N, 2) wheel speeds in m/s, computed like ax2550_driver.py cmd_velReceived"""
+    left, right = base.speedToFractionBatch(*base.twistToWheelsBatch(*base.clipTwistBatch(linear, angular)))
+    return numpy.column_stack((left, right)) * base.max_wheel_velocity
+
+def sampleCommands(stamps, wheels, dt, timeout):
+    """Holds each command until the next one or until it is stale, sampled every dt"""
+    grid = numpy.arange(stamps[0], stamps[-1] + timeout, dt)
+    index = numpy.searchsorted(stamps, grid, side='right') - 1
+    fresh = grid - stamps[index] <= timeout
+    return grid, numpy.where(fresh[:, numpy.newaxis], wheels[index], 0.0)
+
+###  If Main  ###
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] recording")
+    parser.add_option('--topic', default='/cmd_vel', help="Twist topic in a bag [%default]")
+    parser.add_option('--rate', type='float', default=20.0, help="control rate in Hz [%default]")
+    parser.add_option('--timeout', type='float', default=0.5, help="seconds a command stays fresh [%default]")
+    parser.add_option('--kinematics', default=os.path.join(roslib.packages.get_pkg_dir('ax2550_python'), 'config', 'kinematics.yaml'),
+                      help="wheel base and max_wheel_velocity shared with the driver [%default]")
+    parser.add_option('--accel', default='0.5,1.0,2.0', help="comma separated acceleration limits in m/s^2 [%default]")
+    parser.add_option('--jerk', default='0', help="comma separated jerk limits in m/s^3, 0 for none [%default]")
+    parser.add_option('--csv', help="write the commands and every setpoint to a CSV file")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected one recording")
+    path = args[0]
+
+    if path.endswith('.bag'):
+        stamps, linear, angular = readBag(path, options.topic)
+    else:
+        stamps, linear, angular = readBlackBox(path)
+    if len(stamps) == 0:
+        sys.exit("No cmd_vel found in %s" % path)
+    order = numpy.argsort(stamps, kind='mergesort')
+    stamps, linear, angular = stamps[order], linear[order], angular[order]
+
+    dt = 1.0 / options.rate
+    wheels = wheelSpeeds(linear, angular, kinematics.loadKinematicsFile(options.kinematics))
+    grid, targets = sampleCommands(stamps, wheels, dt, options.timeout)
+    accel_limits = floatList(options.accel)
+    jerk_limits = floatList(options.jerk)
+    accels = numpy.repeat(accel_limits, len(jerk_limits))
+    jerks = numpy.tile(jerk_limits, len(accel_limits))
+    setpoints = velocity_profile.replay(targets, dt, accels, jerks) # (N, settings, 2)
+
+    print "%d commands over %.1f s, %d control steps" % (len(stamps), stamps[-1] - stamps[0], len(grid))
+    print "%8s %8s %12s %12s %12s %10s" % ("accel", "jerk", "peak accel", "peak jerk", "rms error", "max error")
+    acceleration = numpy.diff(setpoints, axis=0) / dt
+    jerk = numpy.diff(acceleration, axis=0) / dt
+    error = setpoints - targets[:, numpy.newaxis, :]
+    for i in xrange(len(accels)):
+        print "%8.2f %8.2f %12.3f %12.3f %12.4f %10.4f" % (accels[i], jerks[i],
+            numpy.abs(acceleration[:, i]).max() if len(acceleration) else 0.0,
+            numpy.abs(jerk[:, i]).max() if len(jerk) else 0.0,
+            numpy.sqrt((error[:, i] ** 2).mean()), numpy.abs(error[:, i]).max())
+
+    if options.csv:
+        columns = ['time', 'target_left', 'target_right']
+        for a, j in zip(accels, jerks):
+            columns += ['left_a%g_j%g' % (a, j), 'right_a%g_j%g' % (a, j)]
+        table = numpy.column_stack([grid - grid[0], targets, setpoints.reshape(len(grid), -1)])
+        out = open(options.csv, 'w')
+        out.write(','.join(columns) + '\n')
+        numpy.savetxt(out, table, delimiter=',', fmt='%.6g')
+        out.close()
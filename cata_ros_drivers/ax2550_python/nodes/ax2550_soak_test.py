@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+ax2550_soak_test.py - Soak and load test of ax2550_driver.py, ax2550_odom.py and
+ax2550_teleop.py against a fake motor controller (fake_ax2550.py)
+
+Run it with only a roscore up, it starts the three nodes itself:
+
+  rosrun ax2550_python ax2550_soak_test.py _duration:=14400 _cmd_vel_rate:=100
+
+cmd_vel, the Move srv and Joy are driven at the configured rates, switching between
+autonomous mode (cmd_vel) and manual mode (Move) every ~mode_period. Every
+~sample_period the RSS, thread count and open fds of each node and the latency
+percentiles of the last period are printed and appended to ~results. The nodes run
+under soakprobe.py, so when a resource keeps growing the report shows the threads,
+object types and fds that grew and the code that started the threads.
+
+Command latencies go from the publish or call until the speed code reaches the fake
+controller. Each command asks for a different speed code, so codes and commands can
+be matched even when some are dropped.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import rospy
+
+# ROS msg and srv imports
+from geometry_msgs.msg import Twist
+from sensor_msgs.msg import Joy
+from ax2550_python.srv import Move
+from ax2550_python.srv import NavMode
+
+# Python Libraries
+from threading import Thread, Lock
+import json
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# Peer Libraries
+from fake_ax2550 import FakeAX2550
+import kinematics
+import motor_calibration
+import soakprobe
+
+NODES_DIR = os.path.dirname(os.path.abspath(__file__))
+NODES = ('ax2550_driver', 'ax2550_odom', 'ax2550_teleop')
+MAX_WHEEL_VELOCITY = 1.0 # m/s, given to the driver so the harness knows the speed codes to expect
+COMMAND_TABLE_SIZE = 256
+
+###  Functions  ###
+
+def percentiles(values, points=(50, 95, 99)):
+    """Returns the given percentiles of values, nan when there are none"""
+    if not values:
+        return [float('nan')] * len(points)
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * p / 100.0))] for p in points]
+
+def slope(times, values):
+    """Least squares slope of values over times"""
+    n = float(len(times))
+    if n < 2:
+        return 0.0
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    variance = sum((t - mean_t) ** 2 for t in times)
+    if variance == 0:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / variance
+
+def processStats(pid):
+    """Returns (rss in kB, threads, open fds) of a process, None if it is gone"""
+    try:
+        rss = threads = 0
+        for line in open('/proc/%d/status' % pid):
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+        return rss, threads, len(os.listdir('/proc/%d/fd' % pid))
+    except (IOError, OSError):
+        return None
+
+def speedLevels():
+    """Returns [(fraction of max speed, left speed code)] with a different code each"""
+    table = motor_calibration.linearCommandTable(127.0, COMMAND_TABLE_SIZE)
+    levels = []
+    seen = set()
+    for i, code in enumerate(table):
+        # Low codes are left to the joystick, teleop scales its axes way down
+        if code >= 8 and code not in seen:
+            seen.add(code)
+            levels.append((i / float(COMMAND_TABLE_SIZE - 1), code))
+    return levels
+
+###  Classes  ###
+
+class CommandLatency(object):
+    """Matches the speed codes reaching the fake controller to the commands that asked for them"""
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = {} # code -> time of the latest command asking for it
+        self.latencies = []
+        self.sent = 0
+        self.matched = 0
+
+    def commandSent(self, code, stamp):
+        with self.lock:
+            self.pending[code] = stamp
+            self.sent += 1
+
+    def codeReceived(self, code, stamp):
+        with self.lock:
+            sent = self.pending.pop(code, None)
+            if sent is not None and stamp >= sent:
+                self.latencies.append(stamp - sent)
+                self.matched += 1
+
+    def take(self):
+        """Returns (latencies, sent, matched) since the last call"""
+        with self.lock:
+            result = (self.latencies, self.sent, self.matched)
+            self.latencies = []
+            self.sent = 0
+            self.matched = 0
+        return result
+
+# end class CommandLatency
+
+class SoakTest(object):
+    """Runs the driver stack under load and watches it"""
+    def __init__(self):
+        """Function called after object instantiation"""
+        rospy.init_node('ax2550_soak_test')
+
+        # Get parameters
+        self.duration = rospy.get_param('~duration', 3600.0) # seconds
+        self.cmd_vel_rate = rospy.get_param('~cmd_vel_rate', 50.0) # Hz
+        self.move_rate = rospy.get_param('~move_rate', 50.0) # Hz
+        self.joy_rate = rospy.get_param('~joy_rate', 50.0) # Hz
+        self.mode_period = rospy.get_param('~mode_period', 60.0) # seconds in each mode
+        self.sample_period = rospy.get_param('~sample_period', 10.0) # seconds
+        self.warmup = rospy.get_param('~warmup', 60.0) # seconds left out of the growth analysis
+        self.rss_growth = rospy.get_param('~rss_growth', 4096) # kB over the run that counts as a leak
+        self.thread_growth = rospy.get_param('~thread_growth', 2) # threads over the run that count as a leak
+        self.fd_growth = rospy.get_param('~fd_growth', 2) # fds over the run that count as a leak
+        self.results = os.path.expanduser(rospy.get_param('~results', '~/.ros/ax2550_soak_test.csv'))
+
+        self.levels = speedLevels()
+        self.mode = 0 # 0 for manual (Move), 1 for autonomous (cmd_vel)
+        self.cmd_vel_latency = CommandLatency()
+        self.move_latency = CommandLatency()
+        self.srv_latencies = []
+        self.poll_intervals = []
+        self.last_poll = None
+        self.stats_lock = Lock()
+        self.done = False
+
+        self.probe_dir = tempfile.mkdtemp(prefix='ax2550_soak_')
+        self.device = FakeAX2550(on_command=self.commandReceived, on_query=self.queryReceived)
+        self.device.start()
+        self.processes = {}
+        self.saved_params = {} # global parameters overridden for the run, their values before it
+        try:
+            self.run()
+        finally:
+            self.done = True
+            self.stopNodes()
+            self.restoreParams()
+            self.device.stop()
+            shutil.rmtree(self.probe_dir, ignore_errors=True)
+
+    def startNodes(self):
+        """Starts the nodes under test, each one under soakprobe.py"""
+        probe = os.path.splitext(soakprobe.__file__)[0] + '.py'
+        self.overrideParam(kinematics.PARAM_NAMESPACE + '/max_wheel_velocity', MAX_WHEEL_VELOCITY)
+        arguments = {
+            'ax2550_driver': ['_serial_port:=%s' % self.device.device, '_motor_calibration_file:=',
+                              '_motor_range_left:=127.0', '_motor_range_right:=127.0',
+                              '_command_table_size:=%d' % COMMAND_TABLE_SIZE,
+                              '_blackbox:=', '_claim_serial_port:=false'], # the fake pty stays out of the device cache
+            'ax2550_odom': ['_blackbox:=', '_checkpoint:='], # never the robot's saved pose
+            'ax2550_teleop': ['_speed_test_mode:=false'],
+        }
+        for name in NODES:
+            command = [sys.executable, probe, self.probe_dir, os.path.join(NODES_DIR, name + '.py'),
+                       '__name:=soak_' + name] + arguments[name]
+            self.processes[name] = subprocess.Popen(command)
+        rospy.wait_for_service('move', 60.0)
+        rospy.wait_for_service('joy_mode_switch', 60.0)
+
+    def overrideParam(self, name, value):
+        """Sets a global parameter for the run, restoreParams() puts the old value back"""
+        if name not in self.saved_params:
+            self.saved_params[name] = rospy.get_param(name) if rospy.has_param(name) else None
+        rospy.set_param(name, value)
+
+    def restoreParams(self):
+        """Restores the global parameters overridden by overrideParam()"""
+        for name, value in self.saved_params.items():
+            try:
+                if value is None:
+                    rospy.delete_param(name)
+                else:
+                    rospy.set_param(name, value)
+            except Exception as err:
+                rospy.logerr("Could not restore %s: %s" % (name, err))
+        self.saved_params = {}
+
+    def stopNodes(self):
+        """Stops the nodes under test"""
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.time() + 10.0
+        for process in self.processes.values():
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if process.poll() is None:
+                process.kill()
+
+    def commandReceived(self, stamp, channel, code):
+        """Called by the fake controller for every speed command"""
+        if channel != 0:
+            return
+        if self.mode == 1:
+            self.cmd_vel_latency.codeReceived(code, stamp)
+        else:
+            self.move_latency.codeReceived(code, stamp)
+
+    def queryReceived(self, stamp, channel):
+        """Called by the fake controller for every encoder query"""
+        if channel != 0:
+            return
+        with self.stats_lock:
+            if self.last_poll is not None:
+                self.poll_intervals.append(stamp - self.last_poll)
+            self.last_poll = stamp
+
+    def cmdVelLoop(self):
+        """Publishes cmd_vel, the driver only acts on it in autonomous mode"""
+        publisher = rospy.Publisher('/cmd_vel', Twist)
+        rate = rospy.Rate(self.cmd_vel_rate)
+        i = 0
+        while not self.done and not rospy.is_shutdown():
+            fraction, code = self.levels[i % len(self.levels)]
+            i += 1
+            msg = Twist()
+            msg.linear.x = fraction * MAX_WHEEL_VELOCITY
+            if self.mode == 1:
+                self.cmd_vel_latency.commandSent(code, time.time())
+            publisher.publish(msg)
+            rate.sleep()
+
+    def moveLoop(self):
+        """Calls the Move srv, the driver only acts on it in manual mode"""
+        move = rospy.ServiceProxy('move', Move, persistent=True)
+        rate = rospy.Rate(self.move_rate)
+        i = 0
+        while not self.done and not rospy.is_shutdown():
+            fraction, code = self.levels[i % len(self.levels)]
+            i += 1
+            start = time.time()
+            if self.mode == 0:
+                self.move_latency.commandSent(code, start)
+            try:
+                move(fraction, 0.0)
+            except rospy.ServiceException, e:
+                rospy.logwarn("Move call failed: %s" % e)
+                move = rospy.ServiceProxy('move', Move, persistent=True)
+            with self.stats_lock:
+                self.srv_latencies.append(time.time() - start)
+            rate.sleep()
+
+    def joyLoop(self):
+        """Publishes joystick messages for the teleop node, without pressing any button"""
+        publisher = rospy.Publisher('/joy', Joy)
+        rate = rospy.Rate(self.joy_rate)
+        i = 0
+        while not self.done and not rospy.is_shutdown():
+            msg = Joy()
+            msg.header.stamp = rospy.Time.now()
+            msg.axes = [0.0, math.sin(i * 0.05), math.cos(i * 0.05), 0.0, 0.0, 0.0]
+            msg.buttons = [0] * 12
+            i += 1
+            publisher.publish(msg)
+            rate.sleep()
+
+    def modeLoop(self):
+        """Switches between manual and autonomous mode"""
+        switch = rospy.ServiceProxy('joy_mode_switch', NavMode)
+        while not self.done and not rospy.is_shutdown():
+            try:
+                switch(self.mode)
+            except rospy.ServiceException, e:
+                rospy.logwarn("NavMode call failed: %s" % e)
+            end = time.time() + self.mode_period
+            while not self.done and time.time() < end:
+                time.sleep(0.1)
+            self.mode = 1 - self.mode
+
+    def readSnapshots(self):
+        """Returns the latest soakprobe snapshot of each node that has written one"""
+        snapshots = {}
+        for name, process in self.processes.items():
+            try:
+                snapshots[name] = json.load(open(os.path.join(self.probe_dir, '%d.json' % process.pid)))
+            except (IOError, ValueError):
+                pass
+        return snapshots
+
+    def requestSnapshots(self):
+        """Asks every node for a new soakprobe snapshot"""
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGUSR1)
+
+    def run(self):
+        """Drives the load, samples the nodes and reports"""
+        self.startNodes()
+        for loop in (self.modeLoop, self.cmdVelLoop, self.moveLoop, self.joyLoop):
+            thread = Thread(target=loop, name=loop.__name__)
+            thread.daemon = True
+            thread.start()
+
+        columns = ['elapsed']
+        for name in NODES:
+            columns += ['%s_rss_kb' % name, '%s_threads' % name, '%s_fds' % name]
+        for path in ('cmd_vel', 'move', 'move_srv'):
+            columns += ['%s_p50_ms' % path, '%s_p95_ms' % path, '%s_p99_ms' % path]
+        columns += ['cmd_vel_matched', 'move_matched', 'poll_p50_ms', 'poll_p99_ms']
+        results_dir = os.path.dirname(self.results)
+        if results_dir and not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        out = open(self.results, 'w')
+        out.write(','.join(columns) + '\n')
+
+        samples = dict((name, []) for name in NODES) # (elapsed, rss, threads, fds)
+        baseline = {}
+        snapshots = {}
+        start = time.time()
+        worst = {'cmd_vel': 0.0, 'move': 0.0, 'move_srv': 0.0}
+        self.requestSnapshots()
+        try:
+            while not rospy.is_shutdown() and time.time() - start < self.duration:
+                time.sleep(self.sample_period)
+                elapsed = time.time() - start
+                row = [elapsed]
+                for name in NODES:
+                    stats = processStats(self.processes[name].pid)
+                    if stats is None:
+                        rospy.logerr("%s exited with %s" % (name, self.processes[name].poll()))
+                        stats = (float('nan'),) * 3
+                    else:
+                        samples[name].append((elapsed,) + stats)
+                    row += list(stats)
+                snapshots = self.readSnapshots()
+                if elapsed >= self.warmup:
+                    for name, snapshot in snapshots.items():
+                        baseline.setdefault(name, snapshot)
+                self.requestSnapshots()
+
+                cmd_vel, cmd_vel_sent, cmd_vel_matched = self.cmd_vel_latency.take()
+                move, move_sent, move_matched = self.move_latency.take()
+                with self.stats_lock:
+                    srv, self.srv_latencies = self.srv_latencies, []
+                    polls, self.poll_intervals = self.poll_intervals, []
+                for path, latencies in (('cmd_vel', cmd_vel), ('move', move), ('move_srv', srv)):
+                    points = percentiles(latencies)
+                    row += [1000.0 * p for p in points]
+                    if latencies:
+                        worst[path] = max(worst[path], points[-1])
+                row += ['%d/%d' % (cmd_vel_matched, cmd_vel_sent), '%d/%d' % (move_matched, move_sent)]
+                row += [1000.0 * p for p in percentiles(polls, (50, 99))]
+                out.write(','.join(str(value) for value in row) + '\n')
+                out.flush()
+                print "%7.0f s  " % elapsed + "  ".join("%s %d kB %d thr %d fd" % ((name,) + tuple(samples[name][-1][1:]))
+                                                      for name in NODES if samples[name]) + \
+                      "  p99 cmd_vel %.1f ms move %.1f ms srv %.1f ms" % tuple(1000.0 * percentiles(l)[-1] for l in (cmd_vel, move, srv))
+        finally:
+            out.close()
+
+        # Take a last snapshot before stopping the nodes
+        self.requestSnapshots()
+        time.sleep(2.0)
+        snapshots.update(self.readSnapshots())
+        self.report(samples, baseline, snapshots, worst)
+
+    def report(self, samples, baseline, snapshots, worst):
+        """Prints which resources grew over the run and where they came from"""
+        print
+        print "Worst p99 latencies: cmd_vel %.1f ms, move %.1f ms, move srv %.1f ms" % (
+            1000.0 * worst['cmd_vel'], 1000.0 * worst['move'], 1000.0 * worst['move_srv'])
+        print "Fake controller: %d commands, %d encoder queries, %d reply bytes dropped" % (
+            self.device.commands, self.device.queries, self.device.dropped_bytes)
+        leaking = False
+        for name in NODES:
+            rows = [row for row in samples[name] if row[0] >= self.warmup]
+            if len(rows) < 2:
+                print "%s: not enough samples after the warmup" % name
+                continue
+            times = [row[0] for row in rows]
+            span = times[-1] - times[0]
+            growth = [slope(times, [row[i] for row in rows]) * span for i in (1, 2, 3)]
+            limits = (self.rss_growth, self.thread_growth, self.fd_growth)
+            grew = [g > limit for g, limit in zip(growth, limits)]
+            print "%s: RSS %+.0f kB, threads %+.1f, fds %+.1f over %.0f s%s" % (
+                name, growth[0], growth[1], growth[2], span, " <- GROWING" if any(grew) else "")
+            if not any(grew):
+                continue
+            leaking = True
+            before = baseline.get(name)
+            after = snapshots.get(name)
+            if before is None or after is None:
+                print "  no soakprobe snapshots to compare"
+                continue
+            if grew[1]:
+                print "  threads started by:"
+                for site, count in soakprobe.diffCounts(before['threads'], after['threads']):
+                    print "    %+5d  %s" % (count, site)
+            if grew[0]:
+                print "  object types:"
+                for type_name, count in soakprobe.diffCounts(before['types'], after['types']):
+                    print "    %+8d  %s" % (count, type_name)
+            if grew[2]:
+                print "  file descriptors:"
+                for target, count in soakprobe.diffCounts(before['fds'], after['fds']):
+                    print "    %+5d  %s" % (count, target)
+        print "Samples written to %s" % self.results
+        if leaking:
+            rospy.logwarn("Resources kept growing during the soak test")
+
+# end class SoakTest
+
+###  If Main  ###
+if __name__ == '__main__':
+    SoakTest()
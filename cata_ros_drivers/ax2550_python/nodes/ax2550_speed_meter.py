@@ -1,51 +1,219 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+"""
+ax2550_speed_meter.py - Runs a timed speed test on the motor controller and measures
+the wheel speeds from the encoder stream published by ax2550_driver.py
+
+The test is started with SpeedTestRunner.start(), which returns right away. The
+end of the test is handled by a one-shot timer and the encoder samples are recorded
+by a subscriber that only exists while the test is running.
+"""
+
+###  Imports  ###
+
+# ROS imports
 import roslib; roslib.load_manifest('ax2550_python')
 import rospy
-from rospy.rostime import Time
 from std_msgs.msg import String
 
+# ROS msg and srv imports
 from ax2550_python.msg import Encoder
 
-def ax2550SpeedTest():
-    speed_test_pub = rospy.Publisher('/cata/speed_test', String)
-
-    # Setup Publisher for publishing voice messages 
-    voice_pub = rospy.Publisher('/cata/cata_voice', String)
-    
-    current_time = rospy.Time.now().secs
-    init_time = current_time
-    time_difference = 0
-    
-    test_direction = rospy.get_param('~speed_test_direction', "cw") # cw: clockwise, ccw: counter-clockwise
-    max_duration = rospy.get_param('~max_duration', 10) # seconds
-    
-    test_msg = "end" # just in case
-    init_msg = "Beggining speed test"
-    if test_direction == "cw": # Turn clockwise
-        test_msg = "cw"
-        init_msg += " in the clockwise direction!"
-    if test_direction == "ccw": # Turn counter-clockwise
-        test_msg = "ccw"
-        init_msg += " in the counterclockwise direction!"
-    
-    voice_pub.publish(String(init_msg))
-
-    speed_test_pub.publish(String(test_msg))
-    while time_difference < max_duration:
-        current_time = rospy.Time.now().secs
-        time_difference = current_time - init_time
-    
-    # Send stop command
-    test_msg = "end"
-    speed_test_pub.publish(String(test_msg))
-    
-    end_summary = "Speed test ran for %d seconds. GAME OVER" %time_difference
-    rospy.loginfo(end_summary)     
-
-    voice_pub.publish(String(end_summary))
-        
+# Python Libraries
+from threading import Timer, Lock
+import os
+import time
+
+# Peer Libraries
+import kinematics
+
+###  Functions  ###
+
+def computeSpeedStats(samples, meters_per_count_left, meters_per_count_right):
+    """Computes top speed, acceleration and left/right asymmetry from encoder samples
+
+    samples is a list of (stamp_in_seconds, left_counts, right_counts) tuples where the
+    counts are the relative encoder counts since the previous poll, as published on
+    /cata/motor_control_encoders. Returns a dictionary with the results.
+    """
+    speeds_left = []
+    speeds_right = []
+    times = []
+    distance_left = 0.0
+    distance_right = 0.0
+    for i in range(1, len(samples)):
+        time_delta = samples[i][0] - samples[i-1][0]
+        if time_delta <= 0.0:
+            continue
+        left = samples[i][1] * meters_per_count_left
+        right = samples[i][2] * meters_per_count_right
+        distance_left += abs(left)
+        distance_right += abs(right)
+        speeds_left.append(abs(left) / time_delta)
+        speeds_right.append(abs(right) / time_delta)
+        times.append(samples[i][0] - samples[0][0])
+
+    stats = {'samples': len(samples),
+             'top_speed_left': 0.0, 'top_speed_right': 0.0,
+             'acceleration_left': 0.0, 'acceleration_right': 0.0,
+             'distance_left': distance_left, 'distance_right': distance_right,
+             'asymmetry': 0.0}
+    if not times:
+        return stats
+
+    for side, speeds in (('left', speeds_left), ('right', speeds_right)):
+        top_speed = max(speeds)
+        stats['top_speed_' + side] = top_speed
+        # Average acceleration up to 90% of the top speed
+        for t, v in zip(times, speeds):
+            if v >= 0.9 * top_speed and t > 0.0:
+                stats['acceleration_' + side] = v / t
+                break
+
+    # Asymmetry is measured once both wheels reached their steady state speed
+    steady_left = []
+    steady_right = []
+    for vl, vr in zip(speeds_left, speeds_right):
+        if vl >= 0.9 * stats['top_speed_left'] and vr >= 0.9 * stats['top_speed_right']:
+            steady_left.append(vl)
+            steady_right.append(vr)
+    if steady_left:
+        mean_left = sum(steady_left) / len(steady_left)
+        mean_right = sum(steady_right) / len(steady_right)
+        if mean_left + mean_right > 0.0:
+            stats['asymmetry'] = (mean_left - mean_right) / ((mean_left + mean_right) / 2.0)
+    return stats
+
+###  Classes  ###
+
+class SpeedTestRunner(object):
+    """Timer driven speed test that records the encoders while the robot turns in place"""
+
+    results_fields = ('stamp', 'direction', 'duration', 'samples',
+                      'top_speed_left', 'top_speed_right',
+                      'acceleration_left', 'acceleration_right',
+                      'distance_left', 'distance_right', 'asymmetry')
+
+    def __init__(self, on_finish=None):
+        """Function called after object instantiation"""
+        # Get parameters
+        self.test_direction = rospy.get_param('~speed_test_direction', "cw") # cw: clockwise, ccw: counter-clockwise
+        self.max_duration = rospy.get_param('~max_duration', 10) # seconds
+        self.results_file = os.path.expanduser(rospy.get_param('~speed_test_results', '~/.ros/ax2550_speed_tests.csv'))
+        self.kinematics = kinematics.loadKinematics() # wheel sizes shared with the driver and the odometry
+        self.on_finish = on_finish
+
+        self.speed_test_pub = rospy.Publisher('/cata/speed_test', String)
+        # Setup Publisher for publishing voice messages
+        self.voice_pub = rospy.Publisher('/cata/cata_voice', String)
+
+        self.lock = Lock()
+        self.running = False
+        self.samples = []
+        self.encoder_sub = None
+        self.end_timer = None
+        self.init_time = None
+
+    def isRunning(self):
+        """Returns True while a test is in progress"""
+        with self.lock:
+            return self.running
+
+    def start(self):
+        """Starts a speed test and returns immediately, returns False if one is already running"""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.samples = []
+
+        test_msg = "end" # just in case
+        init_msg = "Beggining speed test"
+        if self.test_direction == "cw": # Turn clockwise
+            test_msg = "cw"
+            init_msg += " in the clockwise direction!"
+        if self.test_direction == "ccw": # Turn counter-clockwise
+            test_msg = "ccw"
+            init_msg += " in the counterclockwise direction!"
+
+        self.voice_pub.publish(String(init_msg))
+        rospy.loginfo(init_msg)
+
+        self.encoder_sub = rospy.Subscriber('/cata/motor_control_encoders', Encoder, self.encoderDataReceived)
+        self.init_time = rospy.Time.now()
+        self.speed_test_pub.publish(String(test_msg))
+
+        # The end of the test is handled from the timer's thread
+        self.end_timer = Timer(self.max_duration, self.finish)
+        self.end_timer.start()
+        return True
+
+    def encoderDataReceived(self, data):
+        """Records the encoder samples while the test is running"""
+        with self.lock:
+            if self.running:
+                self.samples.append((data.header.stamp.to_sec(), data.left, data.right))
+
+    def finish(self):
+        """Stops the motors, computes the results and stores them"""
+        # Send stop command
+        self.speed_test_pub.publish(String("end"))
+
+        with self.lock:
+            self.running = False
+            samples = self.samples
+            self.samples = []
+        if self.encoder_sub is not None:
+            self.encoder_sub.unregister()
+            self.encoder_sub = None
+
+        time_difference = (rospy.Time.now() - self.init_time).to_sec()
+        stats = computeSpeedStats(samples, self.kinematics.meters_per_count_left,
+                                  self.kinematics.meters_per_count_right)
+        stats['stamp'] = self.init_time.to_sec()
+        stats['direction'] = self.test_direction
+        stats['duration'] = time_difference
+        try:
+            self.saveResults(stats)
+        except (IOError, OSError) as err:
+            rospy.logerr("Could not save the speed test results to %s: %s" % (self.results_file, err))
+
+        end_summary = "Speed test ran for %d seconds. Top speed left %0.2f, right %0.2f meters per second. GAME OVER" \
+                      % (time_difference, stats['top_speed_left'], stats['top_speed_right'])
+        rospy.loginfo(end_summary)
+        rospy.loginfo("Speed test results: " + ", ".join("%s=%s" % (key, stats[key]) for key in self.results_fields))
+        self.voice_pub.publish(String(end_summary))
+
+        if self.on_finish is not None:
+            self.on_finish(stats)
+
+    def saveResults(self, stats):
+        """Appends one line per test to the results file"""
+        directory = os.path.dirname(self.results_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        new_file = not os.path.exists(self.results_file)
+        results = open(self.results_file, 'a')
+        try:
+            if new_file:
+                results.write(','.join(self.results_fields) + '\n')
+            values = []
+            for key in self.results_fields:
+                if isinstance(stats[key], float):
+                    values.append("%0.4f" % stats[key])
+                else:
+                    values.append(str(stats[key]))
+            results.write(','.join(values) + '\n')
+        finally:
+            results.close()
+# end class SpeedTestRunner
+
+###  If Main  ###
 if __name__ == '__main__':
+    rospy.init_node('ax2550_speed_meter', anonymous=True)
+    runner = SpeedTestRunner(on_finish=lambda stats: rospy.signal_shutdown("Speed test finished"))
+    # Give the driver some time to connect to our publishers
+    time.sleep(1.0)
+    runner.start()
     rospy.spin()
-    ax2550SpeedTest()
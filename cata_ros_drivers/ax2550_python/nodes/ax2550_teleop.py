@@ -29,6 +29,8 @@ min_speed_sensitivity_factor = 7
 max_speed_sensitivity_factor = 1
 
 speed_test_mode = False
+speed_test_runner = None
+previous_buttons = None # buttons of the last Joy message, the joystick repeats them while they are held
 
 #Parameteres:
 button_toggler = 0
@@ -78,24 +80,41 @@ def changeSpeed(decrease_button, increase_button):
       elif (decrease_button == 1  and speed_sensitivity_factor < min_speed_sensitivity_factor): # button to decrease sensitivity is pressed
 	  speed_sensitivity_factor = speed_sensitivity_factor + 1 
             
+def buttonPressed(buttons, button):
+    """1 if the button went down since the last Joy message, 0 while it is held or released"""
+    if buttons[button] != 1:
+        return 0
+    if previous_buttons is not None and button < len(previous_buttons) and previous_buttons[button] == 1:
+        return 0
+    return 1
+
 def joystickCallback(data):
     """Called everytime the joystick updates"""
-    global button_toggler, button_speed_test, button_speed_increaser, button_speed_decreaser, speed_test_mode
-    if data.buttons[button_speed_test] == 1 and speed_test_mode == True:
-        # run speed test
-        ax2550_speed_meter.ax2550SpeedTest()
+    global button_toggler, button_speed_test, button_speed_increaser, button_speed_decreaser, speed_test_mode, speed_test_runner
+    global previous_buttons
+    pressed = dict((button, buttonPressed(data.buttons, button))
+                   for button in (button_toggler, button_speed_test, button_speed_increaser, button_speed_decreaser))
+    previous_buttons = list(data.buttons)
+    if speed_test_mode == True and speed_test_runner.isRunning():
+        # The test drives the motors until its timer stops them, the joystick must not interfere
+        return
+    if pressed[button_speed_test] and speed_test_mode == True:
+        # run speed test (returns right away, the runner takes care of stopping it)
+        speed_test_runner.start()
     else:    
         #    move(data.axes[1], data.axes[0]) # Game mode
         moveCmdFromJoy(data.axes[1], data.axes[2]) # Speed/Direction Separate control on joystick
-        navModeCmdFromJoy(data.buttons[button_toggler]) # Check if this button has been pressed 
-        changeSpeed(data.buttons[button_speed_decreaser], data.buttons[button_speed_increaser]) # Modifies joystick's speed sensitivity according to button
+        navModeCmdFromJoy(pressed[button_toggler]) # Check if this button has been pressed 
+        changeSpeed(pressed[button_speed_decreaser], pressed[button_speed_increaser]) # Modifies joystick's speed sensitivity according to button
 
 def joystickListener():
     """Listens for Joystick signals"""
-    global button_toggler, button_speed_test, button_speed_increaser, button_speed_decreaser, speed_test_mode
+    global button_toggler, button_speed_test, button_speed_increaser, button_speed_decreaser, speed_test_mode, speed_test_runner
     
     rospy.init_node('ax2550_teleop', anonymous=True)    
     speed_test_mode = rospy.get_param('~speed_test_mode', False) # To allow for speed testing
+    if speed_test_mode:
+        speed_test_runner = ax2550_speed_meter.SpeedTestRunner()
     button_toggler = rospy.get_param('~button_as_toggle', 0) # Mapped to a certain button
     button_speed_test = rospy.get_param('~button_for_speed_test', 1) # to start speed test
     button_speed_decreaser = rospy.get_param('~button_speed_decrease', 2)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+cata_serial_discovery.py - Probes the tty devices, prints which CATA peripheral is on
+each one and refreshes the device cache used by ax2550_driver.py and arduino_safety_light.py
+
+Usage: cata_serial_discovery.py [--cache FILE] [--set-params] [device ...]
+
+Stop the nodes that use the serial devices before running it, the ax2550 handshake
+resets the motor controller.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib; roslib.load_manifest('ax2550_python')
+import rospy
+
+# Python Libraries
+from optparse import OptionParser
+import sys
+
+# Peer Libraries
+import serial_discovery
+
+###  If Main  ###
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] [device ...]")
+    parser.add_option('--cache', default=serial_discovery.DEFAULT_CACHE, help="device cache file [%default]")
+    parser.add_option('--set-params', action='store_true', default=False,
+                      help="also store the map under /cata/serial_devices on the parameter server")
+    options, devices = parser.parse_args(rospy.myargv()[1:])
+
+    with serial_discovery.CacheLock(options.cache):
+        found = serial_discovery.discoverDevices(devices or None)
+        cache = serial_discovery.updateCache(serial_discovery.loadCache(options.cache), found)
+        serial_discovery.saveCache(cache, options.cache)
+
+    for name, probe in serial_discovery.PROBES:
+        if name in found:
+            print "%-8s %s (%s)" % (name, found[name], cache[name]['by_id'] or "no stable name")
+        else:
+            print "%-8s not found" % name
+    if options.set_params:
+        rospy.set_param('/cata/serial_devices', found)
+    sys.exit(0 if found else 1)
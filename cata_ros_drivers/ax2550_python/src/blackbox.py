@@ -0,0 +1,204 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+blackbox.py - Always-on flight recorder for the motor control stack
+
+Each process writes fixed size binary records (time stamp, event type and three
+values) into its own memory-mapped ring file. Writing a record is one struct
+pack_into into the mapping, without locks or system calls, so it can be done on the
+hot path. The pages belong to the kernel, so the last records survive a crash or a
+respawn of the node, and a restarted recorder carries on after the newest record it
+finds in the ring.
+
+A ring file is a HEADER_SIZE header followed by capacity records:
+
+  header: magic, version, record size, capacity, creation time
+  record: stamp (float64), seq (uint32), event (uint16), flags (uint16),
+          a, b, c (float32), 4 bytes of padding
+
+seq increases with every record, so the decoder orders the ring by it. Slots that
+were never written have a zero stamp.
+
+Decode a ring with ax2550_blackbox_dump.py, or readRecords() for NumPy arrays.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import itertools
+import mmap
+import os
+import struct
+import time
+
+###  Constants  ###
+
+MAGIC = 'CATABBX\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHHId')
+HEADER_SIZE = 64
+RECORD = struct.Struct('<dIHHfff4x')
+RECORD_SIZE = RECORD.size # 32 bytes
+DEFAULT_CAPACITY = 16384 # records, 512 KB per ring
+DEFAULT_DIRECTORY = os.path.expanduser('~/.ros/blackbox')
+
+# Event types and the meaning of their a, b, c values
+CMD = 1 # left, right wheel speed (fraction of max_wheel_velocity) sent to the motors
+CODES = 2 # left, right raw speed codes sent to the motors
+ENCODER = 3 # left, right encoder counts, seconds spent polling
+NAV_MODE = 4 # new mode (0 manual, 1 autonomous)
+SYNC = 5 # seconds it took to sync the motor controller
+MOVE = 6 # speed, direction of a Move srv request, mode it arrived in
+CMD_VEL = 7 # linear x, angular z of a cmd_vel message, mode it arrived in
+ODOM = 8 # x, y, theta of the wheel odometry
+SPEED_TEST = 9 # direction of a speed test command
+ERROR = 10 # no values, a, b, c are free for the caller
+
+EVENT_NAMES = {
+    CMD: 'cmd',
+    CODES: 'codes',
+    ENCODER: 'encoder',
+    NAV_MODE: 'nav_mode',
+    SYNC: 'sync',
+    MOVE: 'move',
+    CMD_VEL: 'cmd_vel',
+    ODOM: 'odom',
+    SPEED_TEST: 'speed_test',
+    ERROR: 'error',
+}
+
+SEQ_MASK = 0xFFFFFFFF
+
+###  Classes  ###
+
+class BlackBox(object):
+    """Writer of one ring file, safe to share between the threads of a process"""
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            reuse = os.fstat(fd).st_size == size and self.__headerMatches(fd, capacity)
+            if not reuse:
+                # New ring, or one written with other settings: start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        if reuse:
+            start = self.__lastSeq() + 1
+        else:
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, time.time())
+            start = 0
+        # next() on an itertools.count is atomic under the GIL, so threads never share a slot
+        self.counter = itertools.count(start)
+        self.pack_into = RECORD.pack_into
+
+    def __headerMatches(self, fd, capacity):
+        """True if the file already is a ring with this layout"""
+        data = os.read(fd, HEADER.size)
+        if len(data) != HEADER.size:
+            return False
+        magic, version, record_size, file_capacity, created = HEADER.unpack(data)
+        return magic == MAGIC and version == VERSION and record_size == RECORD_SIZE and file_capacity == capacity
+
+    def __lastSeq(self):
+        """Returns the seq of the newest record in the ring, -1 if it is empty"""
+        last = -1
+        for i in xrange(self.capacity):
+            stamp, seq = struct.unpack_from('<dI', self.map, HEADER_SIZE + i * RECORD_SIZE)
+            if stamp != 0.0 and seq > last:
+                last = seq
+        return last
+
+    def record(self, event, a=0.0, b=0.0, c=0.0, flags=0):
+        """Appends one record to the ring, overwriting the oldest one when it is full"""
+        seq = self.counter.next()
+        self.pack_into(self.map, HEADER_SIZE + (seq % self.capacity) * RECORD_SIZE,
+                       time.time(), seq & SEQ_MASK, event, flags, a, b, c)
+
+    def flush(self):
+        """Forces the ring to disk, only needed to survive a power loss"""
+        self.map.flush()
+
+    def close(self):
+        """Unmaps the ring"""
+        self.map.close()
+
+# end class BlackBox
+
+class NullBlackBox(object):
+    """Stands in for a BlackBox when recording is disabled or the ring could not be opened"""
+    path = None
+    capacity = 0
+
+    def record(self, event, a=0.0, b=0.0, c=0.0, flags=0):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+# end class NullBlackBox
+
+###  Functions  ###
+
+def openBlackBox(name_or_path, capacity=DEFAULT_CAPACITY):
+    """Opens a ring by path, or by name in DEFAULT_DIRECTORY, an empty name disables recording"""
+    if not name_or_path:
+        return NullBlackBox()
+    path = os.path.expanduser(name_or_path)
+    if os.sep not in path:
+        path = os.path.join(DEFAULT_DIRECTORY, path + '.bbx')
+    return BlackBox(path, capacity)
+
+def readHeader(path):
+    """Returns (magic, version, record size, capacity, creation time) of a ring file"""
+    f = open(path, 'rb')
+    try:
+        header = HEADER.unpack(f.read(HEADER.size))
+    finally:
+        f.close()
+    if header[0] != MAGIC or header[1] != VERSION or header[2] != RECORD_SIZE:
+        raise ValueError("%s is not a version %d black box ring" % (path, VERSION))
+    return header
+
+def iterRecords(path):
+    """Yields the (stamp, seq, event, flags, a, b, c) records of a ring, oldest first"""
+    capacity = readHeader(path)[3]
+    f = open(path, 'rb')
+    try:
+        f.seek(HEADER_SIZE)
+        data = f.read(capacity * RECORD_SIZE)
+    finally:
+        f.close()
+    records = [RECORD.unpack_from(data, i * RECORD_SIZE) for i in xrange(len(data) // RECORD_SIZE)]
+    records = [r for r in records if r[0] != 0.0]
+    records.sort(key=lambda r: r[1])
+    return iter(records)
+
+def readRecords(path):
+    """Returns the records of a ring as a NumPy structured array, oldest first
+
+    The fields are stamp, seq, event, flags, a, b and c.
+    """
+    import numpy
+    dtype = numpy.dtype([('stamp', '<f8'), ('seq', '<u4'), ('event', '<u2'), ('flags', '<u2'),
+                         ('a', '<f4'), ('b', '<f4'), ('c', '<f4'), ('pad', 'V4')])
+    capacity = readHeader(path)[3]
+    f = open(path, 'rb')
+    try:
+        f.seek(HEADER_SIZE)
+        records = numpy.fromfile(f, dtype, capacity)
+    finally:
+        f.close()
+    records = records[records['stamp'] != 0.0]
+    return records[numpy.argsort(records['seq'], kind='mergesort')]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+command_arbiter.py - Chooses which source of wheel speed commands drives the motors
+
+Each source (joystick, cmd_vel, ...) has a priority and a staleness timeout, and only
+its latest command is kept. The active source is the enabled, fresh source with the
+highest priority. A new command only compares its source with the active one, so it
+costs O(1); the sources are only scanned again when the active one goes stale or is
+disabled. When no source is left the command is zero, and the driver's
+CommandWatchdog ramps the motors down to a stop.
+
+submit() never does I/O and only holds the arbiter's own lock for a few assignments,
+so it can be called from ROS callbacks while another thread writes to the motors.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import time
+from threading import Event, Lock
+
+###  Classes  ###
+
+class CommandSource(object):
+    """A named source of wheel speed commands"""
+    __slots__ = ('name', 'priority', 'timeout', 'enabled', 'left', 'right', 'stamp')
+
+    def __init__(self, name, priority, timeout, enabled=True):
+        self.name = name
+        self.priority = priority # higher wins
+        self.timeout = timeout # seconds a command stays valid
+        self.enabled = enabled
+        self.left = 0.0
+        self.right = 0.0
+        self.stamp = None # time of the latest command, None if there is none
+
+    def isFresh(self, now):
+        """True if the source is enabled and its latest command has not timed out"""
+        return self.enabled and self.stamp is not None and now - self.stamp <= self.timeout
+
+# end class CommandSource
+
+class CommandArbiter(object):
+    """Keeps the latest command of each source and selects the one to send"""
+    def __init__(self):
+        self.lock = Lock()
+        self.sources = {}
+        self.active = None
+        self.changed = Event() # set when the active command changes
+        self.on_change = None # also called when the active command changes
+        self.expired_at = None # when the last active command went stale or was disabled
+
+    def addSource(self, name, priority, timeout, enabled=True):
+        """Registers a source of commands"""
+        with self.lock:
+            self.sources[name] = CommandSource(name, priority, timeout, enabled)
+
+    def setEnabled(self, name, enabled):
+        """Enables or disables a source, its pending command is dropped either way"""
+        with self.lock:
+            source = self.sources[name]
+            source.enabled = enabled
+            source.stamp = None
+            if self.active is source or (enabled and self.active is None):
+                now = time.time()
+                if self.active is source:
+                    self.expired_at = now
+                self.active = self.__rescan(now)
+        self.__notify()
+
+    def submit(self, name, left, right, now=None):
+        """Stores the latest command of a source, returns True if it is the active one"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            source = self.sources[name]
+            source.left = left
+            source.right = right
+            source.stamp = now
+            if not source.enabled:
+                return False
+            active = self.active
+            if active is not source:
+                if active is None or source.priority > active.priority:
+                    self.active = source
+                elif not active.isFresh(now):
+                    self.active = self.__rescan(now)
+                if self.active is not source:
+                    return False
+        self.__notify()
+        return True
+
+    def select(self, now=None):
+        """Returns (source name, left, right) to send, (None, 0.0, 0.0) when no source is fresh"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            active = self.active
+            if active is not None and not active.isFresh(now):
+                if active.stamp is not None:
+                    self.expired_at = active.stamp + active.timeout
+                active = self.active = self.__rescan(now)
+            if active is None:
+                return None, 0.0, 0.0
+            return active.name, active.left, active.right
+
+    def wait(self, timeout):
+        """Waits until the active command changes or timeout seconds pass"""
+        self.changed.wait(timeout)
+        self.changed.clear()
+
+    def __notify(self):
+        self.changed.set()
+        if self.on_change is not None:
+            self.on_change()
+
+    def __rescan(self, now):
+        """Returns the fresh source with the highest priority, None if there is none"""
+        best = None
+        for source in self.sources.itervalues():
+            if source.isFresh(now) and (best is None or source.priority > best.priority):
+                best = source
+        return best
+
+# end class CommandArbiter
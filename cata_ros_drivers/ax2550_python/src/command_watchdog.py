@@ -0,0 +1,72 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+command_watchdog.py - Decides what the driver sends to the motor controller over time
+
+The motor controller stops on its own when it gets no command for a while, so a
+fresh command is sent again every refresh_period. That only happens while the
+command is fresh, the CommandArbiter decides when it is stale. Once it is stale, the
+last command is ramped down to zero over ramp_time and an explicit stop is sent. The
+time from the deadline of the stale command to that stop is the stale run, kept in
+stale_run until the caller takes it.
+
+CommandWatchdog does no I/O. update() returns the speeds to send, or None when
+nothing has to be sent.
+"""
+
+###  Classes  ###
+
+class CommandWatchdog(object):
+    """Refreshes fresh commands, ramps stale ones down to an explicit stop"""
+    IDLE, ACTIVE, RAMPING = range(3)
+
+    def __init__(self, refresh_period=0.4, ramp_time=0.3):
+        self.refresh_period = refresh_period # seconds between two sends of the same command
+        self.ramp_time = ramp_time # seconds to go from the stale command to zero
+        self.state = CommandWatchdog.IDLE
+        self.last_sent = (0.0, 0.0)
+        self.last_send_time = None
+        self.stale_since = None
+        self.ramp_start = None
+        self.ramp_from = (0.0, 0.0)
+        self.stale_run = None # seconds the motors ran on the last stale command, None until one ends
+
+    def update(self, now, source, left, right, expired_at=None):
+        """Returns the (left, right) speeds to send now, or None
+
+        source is the name of the active command source, None when no command is fresh.
+        expired_at is when the last command went stale, now is used when it is unknown.
+        """
+        if source is not None:
+            if self.state == CommandWatchdog.RAMPING:
+                self.stale_run = now - self.stale_since
+            self.state = CommandWatchdog.ACTIVE
+            if (left, right) != self.last_sent or self.last_send_time is None or \
+               now - self.last_send_time >= self.refresh_period:
+                return self.__send(now, (left, right))
+            return None
+        if self.state == CommandWatchdog.ACTIVE:
+            self.stale_since = now if expired_at is None else min(expired_at, now)
+            if self.last_sent == (0.0, 0.0):
+                # The motors were already stopped, nothing ran on the stale command
+                self.state = CommandWatchdog.IDLE
+                return self.__send(now, (0.0, 0.0))
+            self.state = CommandWatchdog.RAMPING
+            self.ramp_start = now
+            self.ramp_from = self.last_sent
+        if self.state == CommandWatchdog.RAMPING:
+            remaining = 1.0 - (now - self.ramp_start) / self.ramp_time if self.ramp_time > 0 else 0.0
+            if remaining <= 0.0:
+                self.state = CommandWatchdog.IDLE
+                self.stale_run = now - self.stale_since
+                return self.__send(now, (0.0, 0.0))
+            return self.__send(now, (self.ramp_from[0] * remaining, self.ramp_from[1] * remaining))
+        return None
+
+    def __send(self, now, speeds):
+        self.last_sent = speeds
+        self.last_send_time = now
+        return speeds
+
+# end class CommandWatchdog
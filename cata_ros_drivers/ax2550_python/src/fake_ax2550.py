@@ -0,0 +1,126 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+fake_ax2550.py - Stand-in for the ax2550 motor controller on a pseudo terminal
+
+Point ax2550_driver.py at FakeAX2550().device and it answers the commands the driver
+uses: the %rrrrrr reset with OK, the !A/!a/!B/!b speed commands with +, and the ?Q4/?Q5
+encoder queries with relative counts proportional to the last speed code. Every
+command is echoed like the real controller does. on_command and on_query are called
+from the reader thread with the time the command arrived, so a test can measure how
+long commands take to get through the driver.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import errno
+import fcntl
+import os
+import pty
+import select
+import time
+import tty
+from threading import Thread
+
+###  Classes  ###
+
+class FakeAX2550(object):
+    """AX2550 motor controller answering on a pseudo terminal"""
+    def __init__(self, counts_per_code=2, on_command=None, on_query=None):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        # Replies are dropped rather than blocking when the driver stops reading
+        flags = fcntl.fcntl(self.master, fcntl.F_GETFL)
+        fcntl.fcntl(self.master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.device = os.ttyname(self.slave)
+        self.counts_per_code = counts_per_code # encoder counts per poll for each unit of speed code
+        self.on_command = on_command # on_command(stamp, channel, code), channel 0 is left
+        self.on_query = on_query # on_query(stamp, channel)
+        self.codes = [0, 0]
+        self.commands = 0
+        self.queries = 0
+        self.dropped_bytes = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Starts answering in a daemon thread"""
+        self.running = True
+        self.thread = Thread(target=self.run, name='fake_ax2550')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops answering and closes the pseudo terminal"""
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        """Reads the commands line by line"""
+        pending = ''
+        while self.running:
+            readable = select.select([self.master], [], [], 0.2)[0]
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EIO):
+                    time.sleep(0.01)
+                    continue
+                raise
+            stamp = time.time()
+            pending += data
+            while True:
+                ends = [i for i in (pending.find('\r'), pending.find('\n')) if i >= 0]
+                if not ends:
+                    break
+                end = min(ends)
+                line, pending = pending[:end].strip(), pending[end + 1:]
+                if line:
+                    self.handle(line, stamp)
+
+    def handle(self, line, stamp):
+        """Answers one command"""
+        if line.endswith('%rrrrrr'):
+            self.codes = [0, 0]
+            self.write('\r\nOK\r\n')
+        elif len(line) == 4 and line[0] == '!' and line[1] in 'AaBb':
+            try:
+                code = int(line[2:], 16)
+            except ValueError:
+                self.write(line + '\r-\r')
+                return
+            channel = 0 if line[1] in 'Aa' else 1
+            if line[1] in 'ab':
+                code = -code
+            self.codes[channel] = code
+            self.commands += 1
+            self.write(line + '\r+\r')
+            if self.on_command:
+                self.on_command(stamp, channel, code)
+        elif line in ('?Q4', '?Q5'):
+            channel = 0 if line == '?Q4' else 1
+            count = self.codes[channel] * self.counts_per_code
+            self.queries += 1
+            self.write('%s\r%08X\r' % (line, count & 0xFFFFFFFF))
+            if self.on_query:
+                self.on_query(stamp, channel)
+        else:
+            self.write(line + '\r-\r')
+
+    def write(self, data):
+        """Sends a reply, dropping it if the driver is not reading"""
+        try:
+            os.write(self.master, data)
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EIO):
+                raise
+            self.dropped_bytes += len(data)
+
+# end class FakeAX2550
@@ -0,0 +1,122 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+heading_filter.py - 1-D Kalman filter fusing the wheel heading with the OS5000 compass
+
+The state is the heading of the robot in the odometry frame. Every encoder sample
+predicts it with the heading change of the wheels; the variance grows with time
+(drift_noise) and with how far the robot turned (slip_noise, the wheels slip most
+while turning in place). Every compass reading corrects it.
+
+The compass is late by a roughly fixed latency, so a reading is compared with the
+heading the filter had at that time. The filter keeps the heading integrated from the
+wheels alone (raw) and the sum of the compass corrections apart, and remembers the
+raw heading of the last second or so of samples. The heading at a past time is its
+raw heading plus the current correction, so a correction found from an old reading
+applies as is to the current heading. Readings arrive in order, so the history is
+trimmed from the front and every update is O(1) amortized.
+
+The compass reads the heading from magnetic north while the odometry starts at zero,
+the offset between them is set from the first reading. Readings whose innovation is
+further than gate standard deviations are magnetic outliers (steel, motors) and are
+dropped; after max_rejections in a row the filter trusts the compass again, in case
+it is the wheel heading that went wrong.
+
+All angles are in radians, counter-clockwise positive.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+from collections import deque
+import math
+
+# Peer Libraries
+from kinematics import normalizeAngle
+
+###  Classes  ###
+
+class HeadingFilter(object):
+    """Wheel heading corrected by a delayed compass"""
+    def __init__(self, compass_noise=math.radians(2.0), drift_noise=0.01, slip_noise=0.1,
+                 latency=0.1, gate=3.0, max_rejections=30, history=2.0):
+        self.compass_variance = compass_noise ** 2 # rad^2
+        self.drift_variance = drift_noise ** 2 # rad^2 per second
+        self.slip_variance = slip_noise ** 2 # rad^2 per radian turned
+        self.latency = latency # seconds the compass reading is older than its arrival
+        self.gate = gate # standard deviations
+        self.max_rejections = max_rejections
+        self.history_length = history # seconds of raw headings kept for late readings
+        self.reset()
+
+    def reset(self, heading=0.0):
+        """Starts over at a heading, the compass offset is set again by the next reading"""
+        self.raw = heading
+        self.correction = 0.0
+        self.variance = 0.0
+        self.offset = None
+        self.last_stamp = None
+        self.history = deque()
+        self.rejections = 0
+        self.rejected = 0
+        self.accepted = 0
+        self.innovation = 0.0
+
+    def heading(self):
+        """Current fused heading in (-pi, pi]"""
+        return normalizeAngle(self.raw + self.correction)
+
+    def predict(self, stamp, delta_heading):
+        """Adds the heading change of the wheels since the previous sample, taken at stamp (seconds)"""
+        dt = 0.0 if self.last_stamp is None else max(0.0, stamp - self.last_stamp)
+        self.last_stamp = stamp
+        self.raw += delta_heading
+        self.variance += self.drift_variance * dt + self.slip_variance * abs(delta_heading)
+        self.history.append((stamp, self.raw))
+        while self.history and self.history[0][0] < stamp - self.history_length:
+            self.history.popleft()
+        return self.heading()
+
+    def rawAt(self, stamp):
+        """Raw heading of the last sample at or before stamp, dropping the older ones"""
+        history = self.history
+        while len(history) > 1 and history[1][0] <= stamp:
+            history.popleft()
+        return history[0][1] if history else self.raw
+
+    def update(self, stamp, compass_heading):
+        """Corrects the heading with a compass reading that arrived at stamp (seconds)
+
+        Returns True if the reading was used, False if it was gated out as an outlier.
+        """
+        past = self.rawAt(stamp - self.latency) + self.correction
+        if self.offset is None:
+            self.offset = normalizeAngle(compass_heading - past)
+            self.accepted += 1
+            return True
+        innovation = normalizeAngle(compass_heading - self.offset - past)
+        self.innovation = innovation
+        innovation_variance = self.variance + self.compass_variance
+        if innovation * innovation > self.gate * self.gate * innovation_variance:
+            self.rejections += 1
+            self.rejected += 1
+            if self.rejections < self.max_rejections:
+                return False
+            # Too many outliers in a row, the wheels are more likely wrong than the compass
+            self.variance = max(self.variance, innovation * innovation)
+            innovation_variance = self.variance + self.compass_variance
+        self.rejections = 0
+        self.accepted += 1
+        gain = self.variance / innovation_variance
+        self.correction += gain * innovation
+        self.variance *= 1.0 - gain
+        return True
+
+# end class HeadingFilter
+
+###  Functions  ###
+
+def compassHeading(yaw):
+    """OS5000 yaw in degrees, clockwise from north, to a counter-clockwise heading in radians"""
+    return normalizeAngle(-math.radians(yaw))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+kinematics.py - Differential drive kinematics of CATA shared by the driver, the
+odometry and the offline tools
+
+The parameters live in config/kinematics.yaml, loaded by the launch files under
+/cata/kinematics, so every node uses the same wheel base and wheel sizes:
+
+  wheel_base: 0.70             # meters between the wheels
+  wheel_diameter_left: 0.30    # meters
+  wheel_diameter_right: 0.30   # meters
+  encoder_resolution: 1920     # pulses per wheel revolution (quadrature)
+  max_wheel_velocity: 2.1      # m/s at full speed command
+
+The plain methods work on floats for the live nodes; the *Batch methods take NumPy
+arrays of any shape for the offline tools. Wheel velocities are in m/s, twists in
+m/s and rad/s, and headings in radians, counter-clockwise positive.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import math
+
+import numpy
+
+###  Constants  ###
+
+PARAM_NAMESPACE = '/cata/kinematics'
+DEFAULTS = {
+    'wheel_base': 0.70,
+    'wheel_diameter_left': 0.30,
+    'wheel_diameter_right': 0.30,
+    'encoder_resolution': 1920,
+    'max_wheel_velocity': 2.1,
+}
+SMALL_ANGLE = 1e-9 # below this a heading change is integrated as a straight line
+
+###  Classes  ###
+
+class DiffDriveKinematics(object):
+    """Conversions between twists, wheel velocities, encoder counts and poses"""
+    def __init__(self, wheel_base=DEFAULTS['wheel_base'],
+                 wheel_diameter_left=DEFAULTS['wheel_diameter_left'],
+                 wheel_diameter_right=DEFAULTS['wheel_diameter_right'],
+                 encoder_resolution=DEFAULTS['encoder_resolution'],
+                 max_wheel_velocity=DEFAULTS['max_wheel_velocity']):
+        self.wheel_base = float(wheel_base)
+        self.half_wheel_base = self.wheel_base / 2.0
+        self.wheel_diameter_left = float(wheel_diameter_left)
+        self.wheel_diameter_right = float(wheel_diameter_right)
+        self.encoder_resolution = float(encoder_resolution)
+        self.max_wheel_velocity = float(max_wheel_velocity)
+        self.max_angular_velocity = 2.0 * self.max_wheel_velocity / self.wheel_base
+        self.meters_per_count_left = math.pi * self.wheel_diameter_left / self.encoder_resolution
+        self.meters_per_count_right = math.pi * self.wheel_diameter_right / self.encoder_resolution
+
+    def __repr__(self):
+        return "DiffDriveKinematics(wheel_base=%r, wheel_diameter_left=%r, wheel_diameter_right=%r, " \
+               "encoder_resolution=%r, max_wheel_velocity=%r)" % (self.wheel_base, self.wheel_diameter_left,
+               self.wheel_diameter_right, self.encoder_resolution, self.max_wheel_velocity)
+
+    # Scalar fast paths
+
+    def twistToWheels(self, linear, angular):
+        """Returns the (left, right) wheel velocities for a linear and angular velocity"""
+        offset = angular * self.half_wheel_base
+        return linear - offset, linear + offset
+
+    def wheelsToTwist(self, left, right):
+        """Returns the (linear, angular) velocity for the wheel velocities"""
+        return (right + left) / 2.0, (right - left) / self.wheel_base
+
+    def countsToDistance(self, left_counts, right_counts):
+        """Returns the (left, right) distances in meters traveled for encoder counts"""
+        return left_counts * self.meters_per_count_left, right_counts * self.meters_per_count_right
+
+    def distanceToCounts(self, left, right):
+        """Returns the (left, right) encoder counts for distances in meters"""
+        return left / self.meters_per_count_left, right / self.meters_per_count_right
+
+    def speedToFraction(self, left, right):
+        """Returns the (left, right) wheel velocities as fractions of max_wheel_velocity, clipped to [-1, 1]"""
+        return (max(-1.0, min(1.0, left / self.max_wheel_velocity)),
+                max(-1.0, min(1.0, right / self.max_wheel_velocity)))
+
+    def clipTwist(self, linear, angular):
+        """Clips the angular velocity to what the wheels can turn at max_wheel_velocity"""
+        return linear, max(-self.max_angular_velocity, min(self.max_angular_velocity, angular))
+
+    def integrate(self, x, y, theta, left, right):
+        """Moves a pose (x, y, theta) along the arc driven by left and right wheel distances"""
+        distance = (right + left) / 2.0
+        delta_theta = (right - left) / self.wheel_base
+        if abs(delta_theta) < SMALL_ANGLE:
+            return x + distance * math.cos(theta), y + distance * math.sin(theta), theta
+        radius = distance / delta_theta
+        new_theta = theta + delta_theta
+        return (x + radius * (math.sin(new_theta) - math.sin(theta)),
+                y - radius * (math.cos(new_theta) - math.cos(theta)),
+                new_theta)
+
+    # Batch NumPy entry points
+
+    def twistToWheelsBatch(self, linear, angular):
+        """Array version of twistToWheels"""
+        offset = numpy.asarray(angular, numpy.float64) * self.half_wheel_base
+        linear = numpy.asarray(linear, numpy.float64)
+        return linear - offset, linear + offset
+
+    def wheelsToTwistBatch(self, left, right):
+        """Array version of wheelsToTwist"""
+        left = numpy.asarray(left, numpy.float64)
+        right = numpy.asarray(right, numpy.float64)
+        return (right + left) / 2.0, (right - left) / self.wheel_base
+
+    def countsToDistanceBatch(self, left_counts, right_counts):
+        """Array version of countsToDistance"""
+        return (numpy.asarray(left_counts, numpy.float64) * self.meters_per_count_left,
+                numpy.asarray(right_counts, numpy.float64) * self.meters_per_count_right)
+
+    def distanceToCountsBatch(self, left, right):
+        """Array version of distanceToCounts"""
+        return (numpy.asarray(left, numpy.float64) / self.meters_per_count_left,
+                numpy.asarray(right, numpy.float64) / self.meters_per_count_right)
+
+    def speedToFractionBatch(self, left, right):
+        """Array version of speedToFraction"""
+        return (numpy.clip(numpy.asarray(left, numpy.float64) / self.max_wheel_velocity, -1.0, 1.0),
+                numpy.clip(numpy.asarray(right, numpy.float64) / self.max_wheel_velocity, -1.0, 1.0))
+
+    def clipTwistBatch(self, linear, angular):
+        """Array version of clipTwist"""
+        return (numpy.asarray(linear, numpy.float64),
+                numpy.clip(numpy.asarray(angular, numpy.float64), -self.max_angular_velocity, self.max_angular_velocity))
+
+    def integrateBatch(self, left, right, x=0.0, y=0.0, theta=0.0):
+        """Integrates sequences of wheel distances from a start pose
+
+        left and right are (N,) distances per step. Returns the (N,) x, y and theta
+        arrays of the pose after each step, the same poses integrate() gives.
+        """
+        left = numpy.asarray(left, numpy.float64)
+        right = numpy.asarray(right, numpy.float64)
+        distance = (right + left) / 2.0
+        delta_theta = (right - left) / self.wheel_base
+        thetas = theta + numpy.cumsum(delta_theta)
+        previous = thetas - delta_theta
+        straight = numpy.abs(delta_theta) < SMALL_ANGLE
+        safe = numpy.where(straight, 1.0, delta_theta)
+        # Chord of each arc, a straight segment when the heading does not change
+        dx = numpy.where(straight, distance * numpy.cos(previous),
+                         distance / safe * (numpy.sin(thetas) - numpy.sin(previous)))
+        dy = numpy.where(straight, distance * numpy.sin(previous),
+                         -distance / safe * (numpy.cos(thetas) - numpy.cos(previous)))
+        return x + numpy.cumsum(dx), y + numpy.cumsum(dy), thetas
+
+# end class DiffDriveKinematics
+
+###  Functions  ###
+
+def normalizeAngle(angle):
+    """Wraps an angle in radians to (-pi, pi]"""
+    angle = math.fmod(angle, 2.0 * math.pi)
+    if angle > math.pi:
+        angle -= 2.0 * math.pi
+    elif angle <= -math.pi:
+        angle += 2.0 * math.pi
+    return angle
+
+def fromParams(params):
+    """Builds a DiffDriveKinematics from a dictionary, missing entries take DEFAULTS"""
+    values = dict(DEFAULTS)
+    values.update((key, params[key]) for key in DEFAULTS if key in params)
+    return DiffDriveKinematics(**values)
+
+def loadKinematics(namespace=PARAM_NAMESPACE):
+    """Builds a DiffDriveKinematics from the shared parameters on the parameter server"""
+    import rospy
+    return fromParams(rospy.get_param(namespace, {}))
+
+def loadKinematicsFile(path):
+    """Builds a DiffDriveKinematics from config/kinematics.yaml, for the offline tools"""
+    import yaml
+    f = open(path)
+    try:
+        return fromParams(yaml.safe_load(f) or {})
+    finally:
+        f.close()
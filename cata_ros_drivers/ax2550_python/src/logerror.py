@@ -6,6 +6,13 @@ logerror.py - Contains a set of functions that facilitate special error
 logs that account for control code and Hardware Module special cases
 
 Created by William Woodall on 2010-02-22.
+
+logError only formats and logs the first occurrence of an error in full. The same
+error (same exception type raised through the same code locations) is then counted
+and reported as one summary line at most every REPORT_INTERVAL seconds, so a failing
+device polled at a high rate does not turn into a logging storm. Occurrences still
+counted when a burst stops are reported by a timer once their interval is over, and
+by flushErrors() at exit.
 """
 __author__ = "William Woodall"
 __copyright__ = "Copyright (c) 2010 John Harrison, William Woodall"
@@ -17,21 +24,141 @@ import sys
 import os
 import traceback
 import linecache
+import time
+import atexit
+from threading import Lock, Timer
+
+###  Variables  ###
+
+REPORT_INTERVAL = 10.0 # seconds between two reports of the same error
+MAX_FINGERPRINTS = 256 # distinct errors remembered before the history is reset
+
+_errors_lock = Lock()
+_errors = {} # fingerprint -> ErrorRecord
+_source_lines = {} # (filename, lineno) -> stripped source line or None
+_flush_timer = None # reports the suppressed occurrences of a burst that stopped
 
 ###  Class  ###
 
+class ErrorRecord(object):
+    """Occurrences of one error fingerprint"""
+    def __init__(self, now):
+        self.total = 1
+        self.suppressed = 0
+        self.last_report = now
+        self.pending = None # (log_func, msg, exception type, value, report interval) of the last suppressed one
+
+    def report(self, repeated, now):
+        """Returns the log function and the summary line of repeated occurrences, starts a new interval"""
+        log_func, msg, exceptionType, exceptionValue, report_interval = self.pending
+        if exceptionType is None:
+            summary = '' # called outside of an except block
+        else:
+            summary = ''.join(traceback.format_exception_only(exceptionType, exceptionValue)).strip()
+        line = "%s%s (repeated %d times in the last %.1f s, %d in total)" % (msg, summary, repeated, now - self.last_report, self.total)
+        self.suppressed = 0
+        self.pending = None
+        self.last_report = now
+        return log_func, line
+
 
 ###  Functions  ###
 
-def logError(exc_info, log_func, msg, line_no_delta=0):
-    """Logs an error with a traceback"""
+def logError(exc_info, log_func, msg, line_no_delta=0, report_interval=None):
+    """Logs an error with a traceback the first time, then aggregated counts"""
     exceptionType, exceptionValue, exceptionTraceback = exc_info
+    if report_interval is None:
+        report_interval = REPORT_INTERVAL
+    key = fingerprint(exceptionType, exceptionTraceback, msg)
+    now = time.time()
+    with _errors_lock:
+        record = _errors.get(key)
+        if record is None:
+            if len(_errors) >= MAX_FINGERPRINTS:
+                _errors.clear()
+            _errors[key] = ErrorRecord(now)
+        else:
+            record.total += 1
+            record.pending = (log_func, msg, exceptionType, exceptionValue, report_interval)
+            if now - record.last_report < report_interval:
+                record.suppressed += 1
+                _scheduleFlush(record.last_report + report_interval - now)
+                return
+            report = record.report(record.suppressed + 1, now)
+    if record is not None:
+        report[0](report[1])
+        return
+    if exceptionType is None:
+        log_func(msg)
+        return
     tb_list = format_exception(exceptionType, exceptionValue, exceptionTraceback, special_file_offset=line_no_delta)
     tb_message = ''.join(tb_list)
     tb_message = tb_message[:-1]
     message = msg+'\n'+tb_message
     log_func(message)
-    
+
+def fingerprint(etype, tb, msg=None):
+    """Identifies an error by its exception type and the code locations it was raised through
+
+    Without a traceback (logError called outside of an except block) there are no
+    locations to tell the errors apart, so the message identifies them instead.
+    """
+    locations = []
+    while tb is not None:
+        locations.append((tb.tb_frame.f_code.co_filename, tb.tb_lineno))
+        tb = tb.tb_next
+    if not locations:
+        return (etype, msg)
+    return (etype, tuple(locations))
+
+def _scheduleFlush(delay):
+    """Starts the flush timer unless it is already pending, called with _errors_lock held"""
+    global _flush_timer
+    if _flush_timer is not None:
+        return
+    _flush_timer = Timer(max(delay, 0.0), _flushDue)
+    _flush_timer.daemon = True
+    _flush_timer.start()
+
+def _flushDue():
+    """Timer callback reporting the suppressed occurrences whose interval is over"""
+    global _flush_timer
+    now = time.time()
+    reports = []
+    with _errors_lock:
+        _flush_timer = None
+        next_due = None
+        for record in _errors.values():
+            if not record.suppressed:
+                continue
+            due = record.last_report + record.pending[4]
+            if due <= now:
+                reports.append(record.report(record.suppressed, now))
+            elif next_due is None or due < next_due:
+                next_due = due
+        if next_due is not None:
+            _scheduleFlush(next_due - now)
+    for log_func, line in reports:
+        log_func(line)
+
+def flushErrors():
+    """Reports the occurrences suppressed so far right away, called at exit"""
+    now = time.time()
+    with _errors_lock:
+        reports = [record.report(record.suppressed, now) for record in _errors.values() if record.suppressed]
+    for log_func, line in reports:
+        try:
+            log_func(line)
+        except Exception:
+            pass # the logging may already be shut down
+
+atexit.register(flushErrors)
+
+def resetErrors():
+    """Forgets all the errors seen so far, the next occurrence of each is logged in full again"""
+    with _errors_lock:
+        _errors.clear()
+
 def format_exception(etype, value, tb, limit = None, special_file_offset=0):
     """Format a stack trace and the exception information.
 
@@ -69,10 +196,14 @@ def extract_tb(tb, limit = None, special_line_offset=0):
         if filename[-3:] == '.cc' or filename[-4:] == '.hwm':
             lineno -= special_line_offset
         name = co.co_name
-        linecache.checkcache(filename)
-        line = linecache.getline(filename, lineno, f.f_globals)
-        if line: line = line.strip()
-        else: line = None
+        # The sources do not change while running, so each line is read only once
+        try:
+            line = _source_lines[(filename, lineno)]
+        except KeyError:
+            line = linecache.getline(filename, lineno, f.f_globals)
+            if line: line = line.strip()
+            else: line = None
+            _source_lines[(filename, lineno)] = line
         list.append((filename, lineno, name, line))
         tb = tb.tb_next
         n = n+1
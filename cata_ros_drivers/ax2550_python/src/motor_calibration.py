@@ -0,0 +1,104 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+motor_calibration.py - Fits and stores the mapping between ax2550 speed codes and the
+measured wheel speeds, and precomputes the lookup tables used by ax2550_driver.py
+
+A calibration file looks like:
+
+  left:
+    codes: [0, 8, 16, ...]     # speed codes sent to the motor controller (0 to 127)
+    speeds: [0.0, 0.0, 0.11, ...] # measured wheel speeds in m/s
+  right:
+    codes: [...]
+    speeds: [...]
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import bisect
+import os
+import yaml
+
+###  Constants  ###
+
+MAX_MOTOR_CODE = 127 # Speed or position value in 2 Hexadecimal digits from 00 to 7F
+
+###  Functions  ###
+
+def fitSpeedCurve(codes, speeds):
+    """Returns the (codes, speeds) points sorted by code with a non-decreasing speed
+
+    Measurement noise can make a higher code look slower than a lower one, which would
+    make the curve impossible to invert, so decreasing runs are replaced by their mean
+    (pool adjacent violators).
+    """
+    points = sorted(zip(codes, speeds))
+    blocks = [] # [sum of speeds, number of points]
+    for code, speed in points:
+        blocks.append([abs(float(speed)), 1])
+        while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] > blocks[-1][0] / blocks[-1][1]:
+            total, count = blocks.pop()
+            blocks[-1][0] += total
+            blocks[-1][1] += count
+    fitted = []
+    for total, count in blocks:
+        fitted.extend([total / count] * count)
+    return [int(code) for code, speed in points], fitted
+
+def buildCommandTable(codes, speeds, max_wheel_velocity, size=256):
+    """Builds a table from a fraction of max_wheel_velocity to a motor speed code
+
+    Entry i of the table holds the code that drives the wheel at
+    (i / (size - 1)) * max_wheel_velocity according to the fitted curve. Speeds above
+    the fastest measured one saturate at its code.
+    """
+    codes, speeds = fitSpeedCurve(codes, speeds)
+    table = []
+    for i in range(size):
+        target = max_wheel_velocity * i / float(size - 1)
+        if i == 0 or not codes:
+            table.append(0)
+            continue
+        k = bisect.bisect_left(speeds, target)
+        if k >= len(speeds):
+            code = codes[-1]
+        elif k == 0 or speeds[k] == speeds[k-1]:
+            code = codes[k]
+        else:
+            # Linear interpolation between the two closest measurements
+            ratio = (target - speeds[k-1]) / (speeds[k] - speeds[k-1])
+            code = codes[k-1] + ratio * (codes[k] - codes[k-1])
+        table.append(min(MAX_MOTOR_CODE, max(0, int(round(code)))))
+    return table
+
+def linearCommandTable(motor_range, size=256):
+    """Builds the uncalibrated table, a straight line from 0 to motor_range"""
+    return [min(MAX_MOTOR_CODE, int(motor_range * i / float(size - 1))) for i in range(size)]
+
+def loadCalibration(path):
+    """Loads a calibration file, returns None if it does not exist"""
+    if not path or not os.path.exists(path):
+        return None
+    calibration_file = open(path, 'r')
+    try:
+        calibration = yaml.safe_load(calibration_file)
+    finally:
+        calibration_file.close()
+    for side in ('left', 'right'):
+        if side not in calibration or len(calibration[side]['codes']) != len(calibration[side]['speeds']):
+            raise ValueError("Invalid motor calibration file %s: bad '%s' entry" % (path, side))
+    return calibration
+
+def saveCalibration(path, calibration):
+    """Writes a calibration dictionary as a yaml parameter file"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    calibration_file = open(path, 'w')
+    try:
+        yaml.safe_dump(calibration, calibration_file, default_flow_style=None)
+    finally:
+        calibration_file.close()
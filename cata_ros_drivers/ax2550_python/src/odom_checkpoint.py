@@ -0,0 +1,172 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+odom_checkpoint.py - Crash-safe checkpoint of the wheel odometry pose
+
+ax2550_odom saves its pose, pose variances, compass offset and the time of the save
+into a small memory-mapped file at a bounded rate. When the node is respawned it
+resumes from the checkpoint if it is recent enough, instead of jumping back to the
+origin. Like the black box (blackbox.py) the pages belong to the kernel, so a save is
+a pack into the mapping and survives a crash of the process.
+
+A checkpoint file is a HEADER_SIZE header followed by two slots:
+
+  header: magic, version, slot size
+  slot: seq (uint32), stamp (float64, wall time of the save), x, y, theta,
+        x, y and yaw variances, compass offset (NaN when unknown) (float64),
+        crc32 of everything before it (uint32)
+
+Saves alternate between the slots, so a crash in the middle of a save leaves the
+other slot intact; a torn slot fails its crc and the reader takes the other one.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import mmap
+import os
+import struct
+import time
+import zlib
+
+###  Constants  ###
+
+MAGIC = 'CATAODO\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHH')
+HEADER_SIZE = 32
+PAYLOAD = struct.Struct('<Id3d3dd')
+CRC = struct.Struct('<I')
+SLOT_SIZE = PAYLOAD.size + CRC.size # 76 bytes
+FILE_SIZE = HEADER_SIZE + 2 * SLOT_SIZE
+DEFAULT_DIRECTORY = os.path.expanduser('~/.ros/checkpoint')
+
+SEQ_MASK = 0xFFFFFFFF
+
+###  Classes  ###
+
+class Checkpoint(object):
+    """One saved odometry state"""
+    __slots__ = ('seq', 'stamp', 'x', 'y', 'theta', 'variance', 'heading_offset')
+
+    def __init__(self, seq, stamp, x, y, theta, variance, heading_offset):
+        self.seq = seq
+        self.stamp = stamp # wall time of the save
+        self.x = x
+        self.y = y
+        self.theta = theta
+        self.variance = variance # (x, y, yaw)
+        self.heading_offset = heading_offset # compass offset of heading_filter.py, None when unknown
+
+    def age(self, now=None):
+        """Seconds since the checkpoint was saved"""
+        return (time.time() if now is None else now) - self.stamp
+
+    def __repr__(self):
+        return "Checkpoint(seq=%d, stamp=%.3f, x=%.3f, y=%.3f, theta=%.3f)" % (self.seq, self.stamp, self.x, self.y, self.theta)
+
+# end class Checkpoint
+
+class OdomCheckpoint(object):
+    """Reader and writer of one checkpoint file"""
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            header = os.read(fd, HEADER.size)
+            reuse = os.fstat(fd).st_size == FILE_SIZE and len(header) == HEADER.size and \
+                    HEADER.unpack(header) == (MAGIC, VERSION, SLOT_SIZE)
+            if not reuse:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, FILE_SIZE)
+            self.map = mmap.mmap(fd, FILE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        if not reuse:
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, SLOT_SIZE)
+        last = self.load()
+        self.seq = last.seq if last is not None else 0
+
+    def load(self):
+        """Returns the newest valid Checkpoint, None if there is none"""
+        return newestSlot(self.map)
+
+    def save(self, x, y, theta, variance=(0.0, 0.0, 0.0), heading_offset=None, stamp=None):
+        """Saves a state into the older slot"""
+        self.seq = self.seq % SEQ_MASK + 1 # 0 marks a slot that was never written
+        offset = HEADER_SIZE + (self.seq % 2) * SLOT_SIZE
+        data = PAYLOAD.pack(self.seq, time.time() if stamp is None else stamp, x, y, theta,
+                            variance[0], variance[1], variance[2],
+                            float('nan') if heading_offset is None else heading_offset)
+        self.map[offset:offset + SLOT_SIZE] = data + CRC.pack(zlib.crc32(data) & 0xFFFFFFFF)
+
+    def flush(self):
+        """Forces the checkpoint to disk, only needed to survive a power loss"""
+        self.map.flush()
+
+    def close(self):
+        """Unmaps the file"""
+        self.map.close()
+
+# end class OdomCheckpoint
+
+class NullCheckpoint(object):
+    """Stands in for an OdomCheckpoint when checkpointing is disabled or the file could not be opened"""
+    path = None
+
+    def load(self):
+        return None
+
+    def save(self, x, y, theta, variance=(0.0, 0.0, 0.0), heading_offset=None, stamp=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+# end class NullCheckpoint
+
+###  Functions  ###
+
+def newestSlot(data):
+    """Returns the newest slot of a checkpoint file's contents with a valid crc, None if there is none"""
+    if len(data) < FILE_SIZE or HEADER.unpack_from(data, 0) != (MAGIC, VERSION, SLOT_SIZE):
+        return None
+    newest = None
+    for i in xrange(2):
+        offset = HEADER_SIZE + i * SLOT_SIZE
+        payload = data[offset:offset + PAYLOAD.size]
+        crc = CRC.unpack_from(data, offset + PAYLOAD.size)[0]
+        if zlib.crc32(payload) & 0xFFFFFFFF != crc:
+            continue
+        seq, stamp, x, y, theta, var_x, var_y, var_yaw, heading_offset = PAYLOAD.unpack(payload)
+        if seq == 0:
+            continue # never written
+        if newest is not None and ((seq - newest.seq) & SEQ_MASK) > SEQ_MASK // 2:
+            continue # older than the other slot, allowing for wrap around
+        newest = Checkpoint(seq, stamp, x, y, theta, (var_x, var_y, var_yaw),
+                            None if heading_offset != heading_offset else heading_offset)
+    return newest
+
+def openCheckpoint(name_or_path):
+    """Opens a checkpoint by path, or by name in DEFAULT_DIRECTORY, an empty name disables checkpointing"""
+    if not name_or_path:
+        return NullCheckpoint()
+    path = os.path.expanduser(name_or_path)
+    if os.sep not in path:
+        path = os.path.join(DEFAULT_DIRECTORY, path + '.ckpt')
+    return OdomCheckpoint(path)
+
+def readCheckpoint(path):
+    """Returns the newest valid Checkpoint of a file without mapping it, None if there is none"""
+    f = open(path, 'rb')
+    try:
+        return newestSlot(f.read(FILE_SIZE))
+    finally:
+        f.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+path_simplifier.py - Online simplification of the odometry trajectory for display
+
+Every pose of the odometry is offered to add(); only the poses where the trajectory
+turns by more than the tolerance are kept. The simplification is the cone (opening
+window) variant of Douglas-Peucker: from the last kept point (the anchor), every pose
+further than tolerance allows the directions that pass within tolerance of it, and
+the cone of directions that suits all of them is kept as an interval. When a pose
+falls outside the cone, the previous pose becomes the new anchor. Each pose costs
+O(1) and no pose is buffered.
+
+The number of kept points is bounded by max_points: when it is reached the tolerance
+doubles and the kept points are simplified again with it, which at least roughly
+halves them, so the cost stays O(1) amortized. Simplifying the kept points again
+adds up the tolerances, so a pose is then within twice the current tolerance of the
+path. The generation counter changes when that happens, so callers caching messages
+for the points know to rebuild them.
+
+Points are (stamp, x, y, theta) tuples, distances in meters and angles in radians.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import math
+
+# Peer Libraries
+from kinematics import normalizeAngle
+
+###  Classes  ###
+
+class PathSimplifier(object):
+    """Keeps the corners of a trajectory within a tolerance"""
+    def __init__(self, tolerance=0.05, max_points=2000):
+        self.initial_tolerance = tolerance
+        self.max_points = max(4, max_points)
+        self.reset()
+
+    def reset(self):
+        """Forgets the trajectory"""
+        self.tolerance = self.initial_tolerance
+        self.points = [] # kept points, the first one is the anchor of the current cone
+        self.tail = None # last pose offered, not kept yet
+        self.generation = 0
+        self.__resetCone()
+
+    def __resetCone(self):
+        """Opens a new cone at the last kept point"""
+        self.reference = None # direction of the cone, from the anchor
+        self.low = -math.pi
+        self.high = math.pi
+
+    def add(self, stamp, x, y, theta):
+        """Offers a pose, returns True if a new point was kept"""
+        point = (stamp, x, y, theta)
+        if not self.points:
+            self.points.append(point)
+            return True
+        kept = False
+        if not self.__fits(point):
+            # The previous pose is a corner, the new cone starts there
+            self.points.append(self.tail)
+            if len(self.points) >= self.max_points:
+                self.__decimate()
+            self.__resetCone()
+            self.__fits(point)
+            kept = True
+        self.tail = point
+        return kept
+
+    def __fits(self, point):
+        """Narrows the cone to point, returns False if the cone cannot contain it"""
+        anchor = self.points[-1]
+        dx = point[1] - anchor[1]
+        dy = point[2] - anchor[2]
+        distance = math.hypot(dx, dy)
+        if distance <= self.tolerance:
+            return True # close enough to any segment starting at the anchor
+        direction = math.atan2(dy, dx)
+        half = math.asin(self.tolerance / distance)
+        if self.reference is None:
+            self.reference = direction
+            self.low = -half
+            self.high = half
+            return True
+        relative = normalizeAngle(direction - self.reference)
+        if relative < self.low or relative > self.high:
+            return False
+        self.low = max(self.low, relative - half)
+        self.high = min(self.high, relative + half)
+        return True
+
+    def __decimate(self):
+        """Doubles the tolerance and simplifies the kept points again"""
+        points = self.points
+        while len(points) >= self.max_points * 3 // 4:
+            self.tolerance *= 2.0
+            self.points = [points[0]]
+            self.tail = None
+            self.__resetCone()
+            for point in points[1:]:
+                if not self.__fits(point):
+                    self.points.append(self.tail)
+                    self.__resetCone()
+                    self.__fits(point)
+                self.tail = point
+            if self.tail is not None and self.tail is not self.points[-1]:
+                self.points.append(self.tail)
+                self.__resetCone()
+            if len(self.points) >= len(points):
+                # Nothing left to merge at any tolerance, drop every other point instead
+                self.points = points[::2] + ([points[-1]] if len(points) % 2 == 0 else [])
+                self.__resetCone()
+            points = self.points
+        self.tail = None
+        self.generation += 1
+
+    def path(self):
+        """Kept points followed by the last pose offered"""
+        if self.tail is None or (self.points and self.tail is self.points[-1]):
+            return list(self.points)
+        return self.points + [self.tail]
+
+# end class PathSimplifier
@@ -0,0 +1,115 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+scheduler.py - Runs periodic and one-shot tasks on a single shared thread
+
+A threading.Timer per tick starts a new thread every period. A Scheduler keeps its
+tasks in a heap ordered by due time and runs them one after the other on one thread.
+Periodic tasks keep a fixed rate. If a run overruns, the missed periods are skipped
+rather than run back to back. trigger() runs a task as soon as possible, and a
+periodic task then carries on one period after that run.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import heapq
+import itertools
+import sys
+import time
+from threading import Condition, Thread
+
+###  Classes  ###
+
+class ScheduledTask(object):
+    """Handle of a task added to a Scheduler"""
+    def __init__(self, scheduler, func, period, name):
+        self.scheduler = scheduler
+        self.func = func
+        self.period = period # seconds, None for a one-shot task
+        self.name = name
+        self.cancelled = False
+        self.generation = 0 # heap entries of older generations are stale
+
+    def cancel(self):
+        """Stops the task, a run in progress finishes"""
+        self.cancelled = True
+
+    def trigger(self):
+        """Runs the task as soon as the scheduler thread is free"""
+        self.scheduler.reschedule(self, time.time())
+
+# end class ScheduledTask
+
+class Scheduler(object):
+    """Single thread running scheduled tasks"""
+    def __init__(self, name='scheduler', on_error=None):
+        self.on_error = on_error # on_error(task, exc_info), the task keeps running either way
+        self.condition = Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        self.running = True
+        self.thread = Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def every(self, period, func, name=None, delay=0.0):
+        """Runs func every period seconds, the first time after delay"""
+        task = ScheduledTask(self, func, period, name or func.__name__)
+        self.reschedule(task, time.time() + delay)
+        return task
+
+    def after(self, delay, func, name=None):
+        """Runs func once after delay seconds"""
+        task = ScheduledTask(self, func, None, name or func.__name__)
+        self.reschedule(task, time.time() + delay)
+        return task
+
+    def reschedule(self, task, due):
+        """Moves the next run of a task to due"""
+        with self.condition:
+            task.generation += 1
+            heapq.heappush(self.queue, (due, self.counter.next(), task, task.generation))
+            self.condition.notify()
+
+    def shutdown(self, timeout=None):
+        """Stops the thread once the task in progress returns"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def run(self):
+        """Scheduler thread"""
+        self.condition.acquire()
+        try:
+            while self.running:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                due, count, task, generation = self.queue[0]
+                now = time.time()
+                if due > now:
+                    self.condition.wait(due - now)
+                    continue
+                heapq.heappop(self.queue)
+                if task.cancelled or generation != task.generation:
+                    continue
+                if task.period is not None:
+                    next_due = due + task.period
+                    if next_due <= now:
+                        next_due += task.period * int((now - next_due) / task.period + 1)
+                    heapq.heappush(self.queue, (next_due, self.counter.next(), task, generation))
+                self.condition.release()
+                try:
+                    task.func()
+                except Exception:
+                    if self.on_error is not None:
+                        self.on_error(task, sys.exc_info())
+                finally:
+                    self.condition.acquire()
+        finally:
+            self.condition.release()
+
+# end class Scheduler
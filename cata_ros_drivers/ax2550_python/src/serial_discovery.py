@@ -0,0 +1,321 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+serial_discovery.py - Finds which tty device each CATA serial peripheral is plugged into
+
+The candidate devices are probed with short, protocol specific handshakes, one
+handshake at a time over all the devices at once, in this order:
+
+  os5000   listens for a '$C<yaw>P<pitch>R<roll>...' compass sentence (19200 baud, 8N1)
+  arduino  sends the safety light query and waits for a mode letter (9600 baud, 8N1)
+  ax2550   sends the '%rrrrrr' reset and waits for 'OK' (9600 baud, 7E1)
+
+A device that answered one handshake is not sent the later ones, so the read only
+probe identifies the compass before anything is written to it, and the ax2550 reset,
+whose 'r's the safety light sketch would take for a mode, only goes to the ports
+nothing else answered on. Ports another process has open are never probed, and a
+node looking for its own device only runs its own handshake, so the safety light
+never resets the motor controller.
+
+The resulting device map is cached in a yaml file. A node looking for its device first
+revalidates the cached port with a single handshake and only probes everything when
+that fails. The cache is protected with a file lock so nodes starting together probe
+the devices one at a time.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+from threading import Thread, Event, Lock
+import fcntl
+import glob
+import os
+import re
+import time
+import yaml
+
+# pySerial
+import serial
+
+###  Constants  ###
+
+DEFAULT_CACHE = os.path.expanduser('~/.ros/cata_serial_devices.yaml')
+ARDUINO_QUERY = '?'
+ARDUINO_REPLIES = 'arso' # The letter of the current light mode
+OS5000_SENTENCE = re.compile(r'\$C-?[0-9.]+P-?[0-9.]+R-?[0-9.]+')
+
+###  Probes  ###
+# Each probe returns the open serial port when the device answered, None otherwise
+
+def probeAX2550(device, timeout=0.5, cancel=None):
+    """Resets an ax2550 into serial mode and waits for its 'OK'"""
+    try:
+        port = serial.Serial(device, 9600, bytesize=serial.SEVENBITS, parity=serial.PARITY_EVEN,
+                             stopbits=serial.STOPBITS_ONE, timeout=0.05)
+    except (serial.SerialException, OSError):
+        return None
+    deadline = time.time() + timeout
+    try:
+        port.flushInput()
+        port.write('\r\n' + '%' + 'rrrrrr\r\n')
+        last = ''
+        while time.time() < deadline and not (cancel and cancel.isSet()):
+            token = port.read(1)
+            if token == '\r':
+                port.write('\r')
+            if last + token == 'OK':
+                return port
+            last = token
+    except (serial.SerialException, OSError):
+        pass
+    port.close()
+    return None
+
+def probeArduino(device, timeout=4.0, cancel=None, query=ARDUINO_QUERY, replies=ARDUINO_REPLIES):
+    """Asks the safety light sketch for its mode until it answers"""
+    try:
+        port = serial.Serial(device, 9600, timeout=0.1)
+    except (serial.SerialException, OSError):
+        return None
+    deadline = time.time() + timeout
+    try:
+        # The board resets when the port is opened, so keep asking until the sketch is up
+        while time.time() < deadline and not (cancel and cancel.isSet()):
+            port.write(query)
+            reply = port.read(1)
+            if reply and reply in replies:
+                return port
+    except (serial.SerialException, OSError):
+        pass
+    port.close()
+    return None
+
+def probeOS5000(device, timeout=1.0, cancel=None, baud=19200):
+    """Listens for an OS5000 compass sentence, nothing is sent to the device"""
+    try:
+        port = serial.Serial(device, baud, timeout=0.1)
+    except (serial.SerialException, OSError):
+        return None
+    deadline = time.time() + timeout
+    try:
+        port.flushInput()
+        data = ''
+        while time.time() < deadline and not (cancel and cancel.isSet()):
+            data = data[-64:] + port.read(64)
+            if OS5000_SENTENCE.search(data):
+                return port
+    except (serial.SerialException, OSError):
+        pass
+    port.close()
+    return None
+
+# Read only probes first, then the ones that write from the least to the most intrusive
+PROBES = (('os5000', probeOS5000),
+          ('arduino', probeArduino),
+          ('ax2550', probeAX2550))
+
+###  Functions  ###
+
+def candidateDevices():
+    """Returns the tty devices that can hold a CATA peripheral"""
+    devices = sorted(glob.glob('/dev/ttyUSB*')) + sorted(glob.glob('/dev/ttyACM*'))
+    devices += [device for device in ('/dev/ttyS0', '/dev/ttyS1', '/dev/ttyS2', '/dev/ttyS3') if os.path.exists(device)]
+    return devices
+
+def busyDevices(devices):
+    """Returns the devices another process has open, as far as /proc shows them"""
+    wanted = dict((os.path.realpath(device), device) for device in devices)
+    busy = set()
+    own = str(os.getpid())
+    for fd_dir in glob.glob('/proc/[0-9]*/fd'):
+        if fd_dir.split('/')[2] == own:
+            continue
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue # gone, or somebody else's
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target in wanted:
+                busy.add(wanted[target])
+    return busy
+
+def stableName(device):
+    """Returns the /dev/serial/by-id link of a device, which survives re-enumeration, or None"""
+    real_device = os.path.realpath(device)
+    for link in glob.glob('/dev/serial/by-id/*'):
+        if os.path.realpath(link) == real_device:
+            return link
+    return None
+
+def identifyDevice(device, names=None, probe_args=None, cancel=None):
+    """Runs the handshakes on one device, returns (name, open port) or (None, None)"""
+    for name, probe in PROBES:
+        if names is not None and name not in names:
+            continue
+        if cancel and cancel.isSet():
+            break
+        port = probe(device, cancel=cancel, **((probe_args or {}).get(name, {})))
+        if port is not None:
+            return name, port
+    return None, None
+
+def discoverDevices(candidates=None, names=None, probe_args=None):
+    """Probes all the candidates concurrently, returns a {name: device} map
+
+    Each probe of PROBES runs in turn on the devices no earlier probe identified, and
+    a probe stops as soon as one device answered it.
+    """
+    return _discover(candidates, names, probe_args)[0]
+
+def _discover(candidates=None, names=None, probe_args=None, keep_open=None):
+    """Implements discoverDevices, also returns the still open port of keep_open if it was found"""
+    if candidates is None:
+        candidates = candidateDevices()
+    if names is None:
+        names = [name for name, probe in PROBES]
+    candidates = [device for device in candidates if os.path.exists(device)]
+    busy = busyDevices(candidates)
+    candidates = [device for device in candidates if device not in busy]
+    found = {}
+    kept = []
+    for name, probe in PROBES:
+        if name not in names:
+            continue
+        identified = set(found.values())
+        devices = [device for device in candidates if device not in identified]
+        port = _probeAll(probe, devices, (probe_args or {}).get(name, {}), found, name)
+        if port is None:
+            continue
+        if name == keep_open:
+            kept.append(port)
+        else:
+            port.close()
+    return found, (kept[0] if kept else None)
+
+def _probeAll(probe, devices, args, found, name):
+    """Runs one probe on the devices concurrently, records the first that answered in found, returns its open port"""
+    answered = []
+    found_lock = Lock()
+    done = Event()
+    def run(device):
+        port = probe(device, cancel=done, **args)
+        if port is None:
+            return
+        with found_lock:
+            if name not in found:
+                found[name] = device
+                answered.append(port)
+                done.set()
+                return
+        port.close()
+    threads = [Thread(target=run, args=(device,)) for device in devices]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return answered[0] if answered else None
+
+def loadCache(cache_path=DEFAULT_CACHE):
+    """Loads the cached device map"""
+    if not os.path.exists(cache_path):
+        return {}
+    cache_file = open(cache_path, 'r')
+    try:
+        return yaml.safe_load(cache_file) or {}
+    except yaml.YAMLError:
+        return {}
+    finally:
+        cache_file.close()
+
+def saveCache(cache, cache_path=DEFAULT_CACHE):
+    """Writes the device map cache"""
+    directory = os.path.dirname(cache_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = cache_path + '.tmp'
+    cache_file = open(temp_path, 'w')
+    try:
+        yaml.safe_dump(cache, cache_file, default_flow_style=False)
+    finally:
+        cache_file.close()
+    os.rename(temp_path, cache_path)
+
+def claimDevice(name, device, cache_path=DEFAULT_CACHE):
+    """Records a device configured by hand in the cache, so the other nodes never probe it"""
+    with CacheLock(cache_path):
+        cache = loadCache(cache_path)
+        if cache.get(name, {}).get('port') != device:
+            saveCache(updateCache(cache, {name: device}), cache_path)
+
+def cachedDevice(entry):
+    """Returns the current device of a cache entry, following its stable name if it has one"""
+    if entry.get('by_id') and os.path.exists(entry['by_id']):
+        return os.path.realpath(entry['by_id'])
+    return entry.get('port')
+
+def updateCache(cache, devices):
+    """Adds newly found devices to the cache dictionary"""
+    for name, device in devices.items():
+        cache[name] = {'port': device, 'by_id': stableName(device)}
+    return cache
+
+class CacheLock(object):
+    """File lock around the cache so only one process probes the devices at a time"""
+    def __init__(self, cache_path=DEFAULT_CACHE):
+        directory = os.path.dirname(cache_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock_file = open(cache_path + '.lock', 'a')
+    def __enter__(self):
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+
+def openDevice(name, preferred=None, candidates=None, cache_path=DEFAULT_CACHE, rescan=False, probe_args=None):
+    """Finds the device of the given peripheral and returns (device, open port)
+
+    The cached port is revalidated first, then the preferred one, and only if both fail
+    all the candidates are probed, with the handshake of this peripheral only. Ports
+    cached or claimed for the other peripherals and ports another process has open are
+    skipped because their nodes may already be using them. Returns (None, None) if the
+    peripheral was not found.
+    """
+    probe_args = {name: probe_args or {}}
+    with CacheLock(cache_path):
+        cache = {} if rescan else loadCache(cache_path)
+        quick = []
+        if name in cache:
+            quick.append(cachedDevice(cache[name]))
+        if preferred and preferred not in quick:
+            quick.append(preferred)
+        busy = busyDevices([device for device in quick if device])
+        for device in quick:
+            if device and os.path.exists(device) and device not in busy:
+                found_name, port = identifyDevice(device, [name], probe_args)
+                if port is not None:
+                    if cache.get(name, {}).get('port') != device:
+                        saveCache(updateCache(cache, {name: device}), cache_path)
+                    return device, port
+        # Cold start, probe everything that is not known to belong to somebody else
+        taken = set(cachedDevice(entry) for other, entry in cache.items() if other != name)
+        if candidates is None:
+            candidates = candidateDevices()
+        candidates = [device for device in candidates if device not in taken and device not in quick]
+        devices, port = _discover(candidates, [name], probe_args, keep_open=name)
+        saveCache(updateCache(cache, devices), cache_path)
+        return devices.get(name), port
+
+def findDevice(name, preferred=None, candidates=None, cache_path=DEFAULT_CACHE, rescan=False, probe_args=None):
+    """Like openDevice, but closes the port and only returns the device name (or None)"""
+    device, port = openDevice(name, preferred, candidates, cache_path, rescan, probe_args)
+    if port is not None:
+        port.close()
+    return device
@@ -0,0 +1,116 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+soakprobe.py - Runs a node with a probe that reports where its threads, objects and
+file descriptors come from, used by ax2550_soak_test.py
+
+Usage: soakprobe.py output_dir node_script [node arguments]
+
+The node runs unmodified in this process. Every thread it starts is tagged with the
+code location that started it, and on SIGUSR1 the probe writes output_dir/<pid>.json
+with:
+
+  threads: live threads counted by the location that started them
+  types: live objects tracked by the garbage collector counted by type
+  fds: open file descriptors counted by what they point to
+
+Comparing two snapshots shows what keeps growing and where it comes from.
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import gc
+import json
+import os
+import runpy
+import signal
+import sys
+import threading
+import time
+
+###  Variables  ###
+
+STACK_DEPTH = 4 # frames recorded for the location that started a thread
+
+_output_dir = None
+_thread_start = threading.Thread.start
+
+###  Functions  ###
+
+def _callerSite(frame):
+    """Formats the frames leading to frame, skipping the threading module"""
+    site = []
+    while frame is not None and len(site) < STACK_DEPTH:
+        code = frame.f_code
+        if not code.co_filename.endswith(('threading.py', 'soakprobe.py')):
+            site.append("%s:%d %s" % (os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return ' < '.join(site)
+
+def _taggedStart(self):
+    """Thread.start that remembers who started the thread"""
+    self._soak_site = _callerSite(sys._getframe(1))
+    return _thread_start(self)
+
+def _describeFd(fd):
+    """Returns what a file descriptor of this process points to, without the inode numbers"""
+    try:
+        target = os.readlink('/proc/self/fd/%s' % fd)
+    except OSError:
+        return 'closed'
+    if target.startswith(('socket:', 'pipe:')):
+        return target.split(':')[0]
+    return target
+
+def snapshot():
+    """Returns the threads, gc tracked types and fds of this process"""
+    threads = {}
+    for thread in threading.enumerate():
+        site = getattr(thread, '_soak_site', None) or thread.name
+        threads[site] = threads.get(site, 0) + 1
+    types = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        types[name] = types.get(name, 0) + 1
+    fds = {}
+    for fd in os.listdir('/proc/self/fd'):
+        target = _describeFd(fd)
+        fds[target] = fds.get(target, 0) + 1
+    return {'pid': os.getpid(), 'time': time.time(), 'threads': threads, 'types': types, 'fds': fds}
+
+def writeSnapshot(signum=None, frame=None):
+    """Signal handler writing snapshot() to output_dir/<pid>.json"""
+    path = os.path.join(_output_dir, '%d.json' % os.getpid())
+    temp = path + '.tmp'
+    f = open(temp, 'w')
+    try:
+        json.dump(snapshot(), f)
+    finally:
+        f.close()
+    os.rename(temp, path)
+
+def install(output_dir):
+    """Tags new threads and dumps a snapshot on SIGUSR1"""
+    global _output_dir
+    _output_dir = output_dir
+    threading.Thread.start = _taggedStart
+    signal.signal(signal.SIGUSR1, writeSnapshot)
+
+def diffCounts(before, after, limit=10):
+    """Returns the [(key, growth)] of the counts that grew the most between two snapshots"""
+    growth = [(key, count - before.get(key, 0)) for key, count in after.items()]
+    growth = [item for item in growth if item[1] > 0]
+    growth.sort(key=lambda item: -item[1])
+    return growth[:limit]
+
+###  If Main  ###
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit("Usage: soakprobe.py output_dir node_script [node arguments]")
+    install(sys.argv[1])
+    script = sys.argv[2]
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    runpy.run_path(script, run_name='__main__')
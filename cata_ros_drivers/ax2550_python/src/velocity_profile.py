@@ -0,0 +1,117 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+velocity_profile.py - Acceleration and jerk limited wheel velocity setpoints
+
+Every step moves the (left, right) setpoint towards the target along the straight
+line between them. Both wheels close the same fraction of their gap, so the ratio
+between the wheel speeds, and with it the turn radius, is kept while the robot speeds
+up or slows down. The common rate is the largest one that respects, on each wheel:
+
+  - the acceleration limit
+  - the jerk limit: the acceleration changes by at most max_jerk * dt per step, and
+    it is small enough to be brought back to zero by the time the wheel reaches its
+    target (a^2 / (2 * max_jerk) + a * dt / 2 <= gap)
+  - no overshoot of the target
+
+When the jerk limit leaves no common rate (for example the target reverses while the
+wheels are accelerating), each wheel is limited on its own for that step.
+
+The state is a NumPy array of shape batch_shape + (2,), so the same code steps the
+driver's single profile or replays recorded commands for many settings at once. Limits
+of zero or less are disabled. Units are whatever the targets use per second (and per
+second squared).
+"""
+
+###  Imports  ###
+
+# Standard Python Libraries
+import numpy
+
+###  Classes  ###
+
+class VelocityProfile(object):
+    """Acceleration and jerk limited setpoints for both wheels"""
+    def __init__(self, max_acceleration, max_jerk=0.0, batch_shape=()):
+        self.max_acceleration = self.__limit(max_acceleration)
+        self.max_jerk = self.__limit(max_jerk)
+        self.velocity = numpy.zeros(tuple(batch_shape) + (2,))
+        self.acceleration = numpy.zeros(tuple(batch_shape) + (2,))
+
+    def __limit(self, value):
+        """Limits broadcast against the wheels axis, disabled limits become infinite"""
+        value = numpy.asarray(value, numpy.float64)
+        value = numpy.where(value > 0, value, numpy.inf)
+        return value[..., numpy.newaxis] if value.ndim else value
+
+    def reset(self, velocity=0.0):
+        """Jumps to a velocity with no acceleration"""
+        self.velocity[...] = velocity
+        self.acceleration[...] = 0.0
+
+    def step(self, target, dt):
+        """Moves the setpoint towards target over dt seconds and returns it"""
+        target = numpy.asarray(target, numpy.float64)
+        velocity = self.velocity
+        previous = self.acceleration
+        if dt <= 0:
+            return velocity.copy()
+        gap = target - velocity
+        distance = numpy.abs(gap)
+        moving = distance > 0
+        jerk_step = self.max_jerk * dt
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # Largest acceleration each wheel may use towards its target
+            # (discrete braking distance a^2 / (2 max_jerk) + a dt / 2 within the gap)
+            half_step = 0.5 * jerk_step
+            braking = numpy.where(numpy.isinf(self.max_jerk), numpy.inf,
+                                  numpy.sqrt(half_step * half_step + 2.0 * self.max_jerk * distance) - half_step)
+            cap = numpy.minimum(self.max_acceleration, braking)
+            # Common rate at which both wheels close their gap
+            rate = numpy.where(moving, cap / distance, numpy.inf).min(axis=-1)
+            rate = numpy.minimum(rate, 1.0 / dt)
+            # Rates the jerk limit allows on each wheel
+            bound_a = (previous - jerk_step) / gap
+            bound_b = (previous + jerk_step) / gap
+            still_ok = numpy.abs(previous) <= jerk_step
+            low = numpy.where(moving, numpy.minimum(bound_a, bound_b), numpy.where(still_ok, -numpy.inf, numpy.inf))
+            high = numpy.where(moving, numpy.maximum(bound_a, bound_b), numpy.where(still_ok, numpy.inf, -numpy.inf))
+            low = numpy.where(numpy.isnan(low), -numpy.inf, low)
+            high = numpy.where(numpy.isnan(high), numpy.inf, high)
+        low = numpy.maximum(low.max(axis=-1), 0.0)
+        high = high.min(axis=-1)
+        common = low <= high
+        rate = numpy.minimum(numpy.maximum(rate, low), high)
+        together = numpy.where(common, rate, 0.0)[..., numpy.newaxis] * gap
+        # Fallback: each wheel on its own
+        alone = numpy.sign(gap) * numpy.minimum(cap, distance / dt)
+        alone = numpy.clip(alone, previous - jerk_step, previous + jerk_step)
+        acceleration = numpy.where(common[..., numpy.newaxis], together, alone)
+        new_velocity = velocity + acceleration * dt
+        # Never go past the target
+        overshoot = (target - new_velocity) * gap < 0
+        new_velocity = numpy.where(overshoot, target, new_velocity)
+        acceleration = numpy.where(overshoot, (target - velocity) / dt, acceleration)
+        self.velocity = new_velocity
+        self.acceleration = acceleration
+        return new_velocity.copy()
+
+# end class VelocityProfile
+
+###  Functions  ###
+
+def replay(targets, dt, max_acceleration, max_jerk=0.0):
+    """Runs recorded targets through profiles with one or more limit settings
+
+    targets is (N, 2), sampled every dt seconds. max_acceleration and max_jerk are
+    scalars or (B,) arrays of settings run side by side. Returns the (N, 2) setpoints,
+    or (N, B, 2) with several settings.
+    """
+    targets = numpy.asarray(targets, numpy.float64)
+    batch_shape = numpy.broadcast(numpy.asarray(max_acceleration), numpy.asarray(max_jerk)).shape
+    profile = VelocityProfile(max_acceleration, max_jerk, batch_shape)
+    setpoints = numpy.empty((len(targets),) + tuple(batch_shape) + (2,))
+    for i in xrange(len(targets)):
+        setpoints[i] = profile.step(targets[i], dt)
+    return setpoints
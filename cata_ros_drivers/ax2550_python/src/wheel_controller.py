@@ -0,0 +1,57 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+wheel_controller.py - Per wheel PI(D) velocity controller for ax2550_driver.py
+
+The setpoint, the measurement and the output are fractions of max_wheel_velocity. The
+setpoint itself is the feed-forward term: the driver turns the output into a speed
+code through the calibrated command table (motor_calibration.py), which already maps
+a fraction of max_wheel_velocity to the code that gives that speed. The PID terms
+only correct what the calibration misses (load, battery).
+
+Anti-windup: the integral is clamped to +/- integral_limit, and it is not integrated
+while the output is saturated and the error would push it further into saturation.
+The derivative acts on the measurement, low pass filtered, so setpoint steps do not
+kick the output.
+"""
+
+###  Classes  ###
+
+class WheelController(object):
+    """PI(D) with feed-forward and anti-windup for one wheel"""
+    def __init__(self, kp=0.5, ki=1.0, kd=0.0, integral_limit=0.5, output_limit=1.0, derivative_filter=0.5):
+        self.kp = kp
+        self.ki = ki # 1/s
+        self.kd = kd # s
+        self.integral_limit = integral_limit
+        self.output_limit = output_limit
+        self.derivative_filter = derivative_filter # weight of the previous derivative, 0 disables the filter
+        self.reset()
+
+    def reset(self):
+        """Forgets the integral and the previous measurement"""
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.previous_measurement = None
+        self.error = 0.0
+        self.output = 0.0
+
+    def update(self, setpoint, measurement, dt):
+        """Returns the output for a new measurement taken dt seconds after the previous one"""
+        error = setpoint - measurement
+        if self.previous_measurement is not None and dt > 0:
+            derivative = -(measurement - self.previous_measurement) / dt
+            self.derivative = self.derivative_filter * self.derivative + (1.0 - self.derivative_filter) * derivative
+        self.previous_measurement = measurement
+        unsaturated = setpoint + self.kp * error + self.integral + self.kd * self.derivative
+        # Conditional integration: no integration that would deepen the saturation
+        if dt > 0 and not ((unsaturated >= self.output_limit and error > 0) or
+                           (unsaturated <= -self.output_limit and error < 0)):
+            self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral + self.ki * error * dt))
+        output = setpoint + self.kp * error + self.integral + self.kd * self.derivative
+        self.error = error
+        self.output = max(-self.output_limit, min(self.output_limit, output))
+        return self.output
+
+# end class WheelController
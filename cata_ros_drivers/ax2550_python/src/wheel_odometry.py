@@ -0,0 +1,95 @@
+#!/usr/bin/env python -OO
+# encoding: utf-8
+
+"""
+wheel_odometry.py - Wheel odometry of the encoder samples, without ROS
+
+The pose update of ax2550_odom, kept apart from the node so ax2550_odom_replay.py runs
+recorded encoder streams through the very same arithmetic as fast as it can. All
+times are the stamps of the samples in seconds, never the clock, so a replay gives
+the same poses, bit for bit, whatever its speed.
+
+An encoder sample holds the counts of each wheel since the previous sample. The pose
+moves along the arc they drive (kinematics.py), the twist is the mean over the time
+since the previous sample, and the heading is fused with the compass when a
+heading_filter.HeadingFilter is given.
+"""
+
+###  Imports  ###
+
+# Peer Libraries
+from kinematics import normalizeAngle
+
+###  Classes  ###
+
+class WheelOdometry(object):
+    """Pose and twist integrated from encoder samples"""
+    def __init__(self, base_kinematics, compass_filter=None):
+        self.kinematics = base_kinematics
+        self.compass_filter = compass_filter # heading_filter.HeadingFilter, None to use the wheels alone
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, theta=0.0):
+        """Starts over at a pose"""
+        self.x = x
+        self.y = y
+        self.theta = normalizeAngle(theta)
+        self.linear_velocity = 0.0
+        self.angular_velocity = 0.0
+        self.stamp = None # seconds, stamp of the last sample
+        if self.compass_filter is not None:
+            self.compass_filter.reset(self.theta)
+
+    def update(self, stamp, left_counts, right_counts):
+        """Integrates one encoder sample taken at stamp, returns the new (x, y, theta)"""
+        left, right = self.kinematics.countsToDistance(left_counts, right_counts)
+        self.__twist(stamp, left, right)
+        x, y, new_theta = self.kinematics.integrate(self.x, self.y, self.theta, left, right)
+        self.x = x
+        self.y = y
+        self.theta = self.__fuse(stamp, self.theta, new_theta)
+        self.stamp = stamp
+        return self.x, self.y, self.theta
+
+    def updateBatch(self, stamps, left_counts, right_counts):
+        """Integrates a batch of encoder samples at once
+
+        Returns the (N,) x, y and theta arrays of the wheel poses after each sample, the
+        last pose is fused with the compass like update() does. The twist is the mean
+        over the whole batch.
+        """
+        left, right = self.kinematics.countsToDistanceBatch(left_counts, right_counts)
+        stamp = float(stamps[-1])
+        self.__twist(stamp, left.sum(), right.sum())
+        xs, ys, thetas = self.kinematics.integrateBatch(left, right, self.x, self.y, self.theta)
+        self.x = float(xs[-1])
+        self.y = float(ys[-1])
+        self.theta = self.__fuse(stamp, self.theta, float(thetas[-1]))
+        self.stamp = stamp
+        return xs, ys, thetas
+
+    def compass(self, stamp, compass_heading):
+        """Corrects the heading with a compass reading that arrived at stamp
+
+        Returns True if the reading was used, False if it was gated out as an outlier.
+        """
+        accepted = self.compass_filter.update(stamp, compass_heading)
+        self.theta = self.compass_filter.heading()
+        return accepted
+
+    def __twist(self, stamp, left, right):
+        """Mean twist over the wheel distances driven since the last sample"""
+        time_delta = 0.0 if self.stamp is None else stamp - self.stamp
+        # vy is always 0 for a differential drive
+        if time_delta > 0:
+            self.linear_velocity, self.angular_velocity = self.kinematics.wheelsToTwist(left / time_delta, right / time_delta)
+        else:
+            self.linear_velocity, self.angular_velocity = 0.0, 0.0
+
+    def __fuse(self, stamp, old_theta, new_theta):
+        """Heading after a wheel update, fused with the compass if enabled, in (-pi, pi]"""
+        if self.compass_filter is None:
+            return normalizeAngle(new_theta)
+        return self.compass_filter.predict(stamp, new_theta - old_theta)
+
+# end class WheelOdometry
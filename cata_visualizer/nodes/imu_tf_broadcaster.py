@@ -3,6 +3,10 @@
 """
 imu_tf_broadcaster.py - Simple transform broadcaster for an IMU message onto an arbitrary reference frame (e.g. world)
 Created by Carlos Jaramillo on 2012-06-15.
+
+With ~max_rate > 0 only the latest orientation of each frame is kept and they are
+sent from a timer at that rate, so a fast IMU does not flood /tf. With ~batch the
+frames of one timer tick go out together in a single tfMessage.
 """
 __author__ = "Carlos Jaramillo"
 __copyright__ = "Copyright (c) GPL v3 Carlos Jaramillo"
@@ -16,8 +20,13 @@ import rospy
 
 # ROS messages imports
 import tf
+from tf.msg import tfMessage
+from geometry_msgs.msg import TransformStamped
 from sensor_msgs.msg import Imu
 
+# Python Libraries
+from threading import Lock
+
 ###  Classes  ###
 class ImuTFer(object):
     """This class broadcast a simple, arbitrary transform for an IMU message in reference to some frame target"""
@@ -32,21 +41,66 @@ class ImuTFer(object):
         self.reference_frame_name = rospy.get_param('~reference_frame', '/world')
         self.z_offset = rospy.get_param('~z_offset', 1.0)
         
+        self.max_rate = rospy.get_param('~max_rate', 0.0) # Hz, 0 sends every IMU message right away
+        self.batch = rospy.get_param('~batch', False) # True sends all the frames in one tfMessage
+
+        # Created once, the publisher behind it keeps its connections
+        self.broadcaster = tf.TransformBroadcaster()
+        self.tf_pub = rospy.Publisher('/tf', tfMessage)
+
+        # Latest orientation of each IMU frame, waiting for the next timer tick
+        self.pending_lock = Lock()
+        self.pending = {}
+
         # Subscribe to the imu topic
-        rospy.Subscriber(self.topic_name, Imu, self.handle_imu_orientation)
+        if self.max_rate > 0:
+            # Only the latest orientation is sent anyway, older messages need not queue up
+            rospy.Subscriber(self.topic_name, Imu, self.handle_imu_orientation, queue_size=1)
+            rospy.Timer(rospy.Duration(1.0 / self.max_rate), self.send_pending)
+        else:
+            rospy.Subscriber(self.topic_name, Imu, self.handle_imu_orientation)
         
         rospy.spin()
         
     def handle_imu_orientation(self, msg):
         """Callback for the subscriber"""
         orientation_as_tuple = (msg.orientation.x, msg.orientation.y, msg.orientation.z, msg.orientation.w)
-        br = tf.TransformBroadcaster()
-        br.sendTransform((0, 0, self.z_offset),
+        if self.max_rate > 0:
+            # Coalesce, only the latest sample of each frame is sent
+            with self.pending_lock:
+                self.pending[msg.header.frame_id] = orientation_as_tuple
+            return
+        self.broadcaster.sendTransform((0, 0, self.z_offset),
                      orientation_as_tuple,
                      rospy.Time.now(),
                      msg.header.frame_id,
                      self.reference_frame_name)
 
+    def send_pending(self, event):
+        """Timer callback that sends the latest orientation of each frame"""
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = {}
+        if not pending:
+            return
+        now = rospy.Time.now()
+        if not self.batch:
+            for frame_id, orientation_as_tuple in pending.items():
+                self.broadcaster.sendTransform((0, 0, self.z_offset), orientation_as_tuple, now,
+                                               frame_id, self.reference_frame_name)
+            return
+        transforms = []
+        for frame_id, orientation_as_tuple in pending.items():
+            t = TransformStamped()
+            t.header.stamp = now
+            t.header.frame_id = self.reference_frame_name
+            t.child_frame_id = frame_id
+            t.transform.translation.z = self.z_offset
+            (t.transform.rotation.x, t.transform.rotation.y,
+             t.transform.rotation.z, t.transform.rotation.w) = orientation_as_tuple
+            transforms.append(t)
+        self.tf_pub.publish(tfMessage(transforms))
+
 # end class AX2550    
 
 ###  If Main  ###
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+cmvision_blob_tracker.py - Gives the cmvision blobs a stable ID across frames
+
+Subscribes to the cmvision 'blobs' topic and publishes the confirmed tracks with their
+smoothed position and velocity (pixels, pixels per second) on 'blob_tracks'.
+"""
+
+###  Imports  ###
+
+# ROS imports
+import roslib
+roslib.load_manifest('cmvision')
+import rospy
+
+# ROS messages imports
+from cmvision.msg import BlobTrack, BlobTracks
+from cmvision.lazy_blobs import LazyBlobs
+from cmvision.blob_tracking import BlobTracker, packColors
+
+###  Classes  ###
+class BlobTrackerNode(object):
+    """Runs a BlobTracker on every Blobs message"""
+    def __init__(self):
+        """Function called after object instantiation"""
+
+        # Initialize ROS Node
+        rospy.init_node('cmvision_blob_tracker')
+
+        # Get parameters
+        self.tracker = BlobTracker(gate_distance=rospy.get_param('~gate_distance', 50.0),
+                                   max_misses=rospy.get_param('~max_misses', 5),
+                                   min_hits=rospy.get_param('~min_hits', 2),
+                                   position_gain=rospy.get_param('~position_gain', 0.6),
+                                   velocity_gain=rospy.get_param('~velocity_gain', 0.2))
+
+        self.tracks_pub = rospy.Publisher('blob_tracks', BlobTracks)
+        # LazyBlobs hands the blobs over as arrays without building a Blob per blob
+        rospy.Subscriber('blobs', LazyBlobs, self.handle_blobs, queue_size=1)
+
+        rospy.spin()
+
+    def handle_blobs(self, msg):
+        """Callback for the subscriber"""
+        blobs = msg.array()
+        tracker = self.tracker
+        indices = tracker.update(msg.header.stamp.to_sec(),
+                                 packColors(blobs['red'], blobs['green'], blobs['blue']),
+                                 msg.centroids(), blobs['area'])
+        tracks = BlobTracks()
+        tracks.header = msg.header
+        ids = tracker.ids[indices].tolist()
+        colors = tracker.colors[indices].tolist()
+        positions = tracker.positions[indices].tolist()
+        velocities = tracker.velocities[indices].tolist()
+        areas = tracker.areas[indices].tolist()
+        ages = tracker.ages[indices].tolist()
+        for i in xrange(len(ids)):
+            color = colors[i]
+            tracks.tracks.append(BlobTrack(ids[i], color >> 16, (color >> 8) & 0xFF, color & 0xFF,
+                                           positions[i][0], positions[i][1],
+                                           velocities[i][0], velocities[i][1],
+                                           areas[i], ages[i]))
+        self.tracks_pub.publish(tracks)
+
+# end class BlobTrackerNode
+
+###  If Main  ###
+if __name__ == '__main__':
+    BlobTrackerNode()
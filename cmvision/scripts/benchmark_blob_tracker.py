@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+benchmark_blob_tracker.py - Runs the blob tracker on synthetic Blobs streams and reports
+the time per frame and how often a blob changed ID, for several blob counts.
+
+Each stream has blobs of two colors moving at constant velocity with centroid noise,
+shuffled every frame, with a few blobs missing from each frame.
+
+Usage: benchmark_blob_tracker.py [blob_count ...]
+"""
+
+import roslib; roslib.load_manifest('cmvision')
+
+import sys
+import time
+from cStringIO import StringIO
+
+import numpy
+from cmvision.lazy_blobs import LazyBlobs
+from cmvision.blob_array import BLOB_DTYPE, NumpyBlobs
+from cmvision.blob_tracking import BlobTracker, packColors
+
+FRAMES = 300
+RATE = 30.0 # Hz
+
+def syntheticStream(count, frames=FRAMES, seed=0):
+    """Yields (serialized Blobs, true identity of each blob) for every frame"""
+    random = numpy.random.RandomState(seed)
+    positions = random.uniform(0, 640, (count, 2))
+    velocities = random.uniform(-60, 60, (count, 2)) # pixels per second
+    red = numpy.where(numpy.arange(count) % 2, 255, 0)
+    green = 255 - red
+    for frame in xrange(frames):
+        visible = numpy.flatnonzero(random.uniform(size=count) > 0.02)
+        visible = visible[random.permutation(len(visible))]
+        centroids = positions[visible] + random.normal(0, 1.0, (len(visible), 2))
+        blobs = numpy.zeros(len(visible), BLOB_DTYPE)
+        blobs['red'] = red[visible]
+        blobs['green'] = green[visible]
+        blobs['area'] = 100
+        blobs['x'] = numpy.clip(centroids[:, 0], 0, None)
+        blobs['y'] = numpy.clip(centroids[:, 1], 0, None)
+        msg = NumpyBlobs(image_width=640, image_height=480, blob_count=len(visible), blobs=blobs)
+        msg.header.stamp.secs = frame // int(RATE)
+        msg.header.stamp.nsecs = int((frame % int(RATE)) / RATE * 1e9)
+        buff = StringIO()
+        msg.serialize(buff)
+        yield buff.getvalue(), visible
+        positions += velocities / RATE
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 100, 300, 1000]
+    print "%8s %14s %14s %12s" % ("blobs", "per frame", "max rate", "id switches")
+    for count in counts:
+        stream = list(syntheticStream(count))
+        tracker = BlobTracker(gate_distance=20.0)
+        owner = {} # track id -> true identity
+        switches = 0
+        elapsed = 0.0
+        for data, truth in stream:
+            start = time.time()
+            msg = LazyBlobs().deserialize(data)
+            blobs = msg.array()
+            tracker.update(msg.header.stamp.to_sec(), packColors(blobs['red'], blobs['green'], blobs['blue']),
+                           msg.centroids(), blobs['area'])
+            elapsed += time.time() - start
+            # A blob keeps its position in the frame, so the freshly matched tracks can be checked
+            fresh = numpy.flatnonzero(tracker.misses == 0)
+            centroids = msg.centroids()
+            positions = tracker.positions[fresh]
+            nearest = truth[numpy.hypot(positions[:, 0, None] - centroids[None, :, 0],
+                                        positions[:, 1, None] - centroids[None, :, 1]).argmin(axis=1)]
+            for track_id, nearest in zip(tracker.ids[fresh].tolist(), nearest.tolist()):
+                if owner.setdefault(track_id, nearest) != nearest:
+                    owner[track_id] = nearest
+                    switches += 1
+        per_frame = elapsed / len(stream)
+        print "%8d %12.2fms %12.0fHz %12d" % (count, per_frame * 1e3, 1.0 / per_frame, switches)
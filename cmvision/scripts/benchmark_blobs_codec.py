@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+benchmark_blobs_codec.py - Compares the per-blob struct codec of the generated
+cmvision/Blobs with the NumPy codec of cmvision.blob_array.NumpyBlobs across blob
+counts, and checks that both produce the same bytes.
+
+Usage: benchmark_blobs_codec.py [blob_count ...]
+"""
+
+import roslib; roslib.load_manifest('cmvision')
+
+import sys
+import timeit
+from cStringIO import StringIO
+
+from cmvision.msg import Blob, Blobs
+from cmvision.blob_array import NumpyBlobs
+
+def makeBlobs(count):
+    """Returns a Blobs message with count blobs"""
+    msg = Blobs(image_width=640, image_height=480, blob_count=count)
+    msg.header.frame_id = 'stereo_optical_frame'
+    for i in xrange(count):
+        msg.blobs.append(Blob(red=255, green=i % 256, blue=0, area=i, x=i % 640, y=i % 480,
+                              left=i % 640, right=i % 640 + 5, top=i % 480, bottom=i % 480 + 5))
+    return msg
+
+def serialized(msg):
+    """Returns the wire bytes of msg"""
+    buff = StringIO()
+    msg.serialize(buff)
+    return buff.getvalue()
+
+def best(statement, repeat=5):
+    """Best time in seconds of one run of statement"""
+    timer = timeit.Timer(statement)
+    number = 10
+    return min(timer.repeat(repeat, number)) / number
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [0, 10, 100, 500, 1000, 5000]
+    print "%8s %14s %14s %14s %14s" % ("blobs", "decode struct", "decode numpy", "encode struct", "encode numpy")
+    for count in counts:
+        msg = makeBlobs(count)
+        data = serialized(msg)
+        # Wire compatibility in both directions
+        numpy_msg = NumpyBlobs().deserialize(data)
+        assert serialized(numpy_msg) == data, "numpy codec is not wire compatible"
+        assert Blobs().deserialize(serialized(numpy_msg)).blobs == msg.blobs, "numpy codec is not wire compatible"
+        assert all(numpy_msg.blobs[i].area == msg.blobs[i].area for i in xrange(count))
+
+        decode_struct = best(lambda: Blobs().deserialize(data))
+        decode_numpy = best(lambda: NumpyBlobs().deserialize(data))
+        encode_struct = best(lambda: serialized(msg))
+        encode_numpy = best(lambda: serialized(numpy_msg))
+        print "%8d %12.1fus %12.1fus %12.1fus %12.1fus" % (count, decode_struct * 1e6, decode_numpy * 1e6,
+                                                           encode_struct * 1e6, encode_numpy * 1e6)
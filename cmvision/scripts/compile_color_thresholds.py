@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+compile_color_thresholds.py - Fits cmvision YUV threshold boxes from labeled sample images
+and writes them as a colors.txt file
+
+The samples directory has one sub directory per color, named like the color in the
+colors file. Every pixel of an image in it belongs to that color, unless there is a
+<image>.mask.png next to it, in which case only its non zero pixels are used:
+
+  samples/Red/flag1.png
+  samples/Red/frame0042.png
+  samples/Red/frame0042.mask.png
+  samples/Green/...
+
+Usage: compile_color_thresholds.py [options] samples_dir output_colors.txt
+"""
+
+import roslib; roslib.load_manifest('cmvision')
+
+from optparse import OptionParser
+import glob
+import os
+import sys
+
+import numpy
+from cmvision.color_thresholds import ColorClass, fitThreshold, loadImage, loadMask, readColorsFile, rgbToYuv, writeColorsFile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm')
+
+def colorSamples(directory):
+    """Returns the (N, 3) YUV and RGB pixels of all the samples in a color directory"""
+    yuv_samples = []
+    rgb_samples = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        stem, extension = os.path.splitext(path)
+        if extension.lower() not in IMAGE_EXTENSIONS or stem.endswith('.mask'):
+            continue
+        rgb = loadImage(path)
+        yuv = rgbToYuv(rgb)
+        mask_path = stem + '.mask.png'
+        if os.path.exists(mask_path):
+            mask = loadMask(mask_path)
+            yuv_samples.append(yuv[mask])
+            rgb_samples.append(rgb[mask])
+        else:
+            yuv_samples.append(yuv.reshape(-1, 3))
+            rgb_samples.append(rgb.reshape(-1, 3))
+    if not yuv_samples:
+        return numpy.zeros((0, 3), numpy.uint8), numpy.zeros((0, 3), numpy.uint8)
+    return numpy.concatenate(yuv_samples), numpy.concatenate(rgb_samples)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] samples_dir output_colors.txt")
+    parser.add_option('--coverage', type='float', default=0.98, help="fraction of the samples kept in the box [%default]")
+    parser.add_option('--margin', type='int', default=2, help="levels added on each side of the box [%default]")
+    parser.add_option('--template', help="existing colors file to take the display colors, merge and expected values from")
+    parser.add_option('--merge', type='float', default=0.0, help="merge density for new colors [%default]")
+    parser.add_option('--expected', type='int', default=10, help="expected number of blobs for new colors [%default]")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected a samples directory and an output file")
+    samples_dir, output = args
+
+    template = {}
+    if options.template:
+        template = dict((color.name, color) for color in readColorsFile(options.template))
+
+    colors = []
+    for directory in sorted(glob.glob(os.path.join(samples_dir, '*'))):
+        if not os.path.isdir(directory):
+            continue
+        name = os.path.basename(directory)
+        yuv, rgb = colorSamples(directory)
+        if len(yuv) == 0:
+            print >> sys.stderr, "No samples for %s, skipping it" % name
+            continue
+        threshold = fitThreshold(yuv, options.coverage, options.margin)
+        if name in template:
+            base = template[name]
+            color = ColorClass(name, base.color, base.merge, base.expected, threshold)
+        else:
+            mean = rgb.mean(axis=0).astype(int)
+            color = ColorClass(name, mean, options.merge, options.expected, threshold)
+        colors.append(color)
+        print "%-10s %8d samples  (%3d:%3d,%3d:%3d,%3d:%3d)" % ((name, len(yuv)) + threshold)
+    if not colors:
+        sys.exit("No colors found in %s" % samples_dir)
+    writeColorsFile(output, colors)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+evaluate_color_thresholds.py - Scores a cmvision colors file against a folder of frames
+
+Frames are processed in parallel with a process pool. A frame <name>.png can have a
+ground truth mask <name>.<ColorName>.png per color, in which case the pixel precision,
+recall and F1 of that color are reported. Colors without any mask only get the
+fraction of pixels they select.
+
+Usage: evaluate_color_thresholds.py [options] colors.txt frames_dir
+"""
+
+import roslib; roslib.load_manifest('cmvision')
+
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+import glob
+import os
+import sys
+
+from cmvision.color_thresholds import classify, loadImage, loadMask, readColorsFile, rgbToYuv
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm')
+
+colors = None # Set in every worker by the pool initializer
+
+def initWorker(colors_file):
+    """Loads the thresholds once per worker process"""
+    global colors
+    colors = readColorsFile(colors_file)
+
+def scoreFrame(path):
+    """Returns {color name: (selected, true positives, false positives, false negatives, has mask)} for one frame"""
+    yuv = rgbToYuv(loadImage(path))
+    stem = os.path.splitext(path)[0]
+    scores = {}
+    for color in colors:
+        selected = classify(yuv, color.threshold)
+        mask_path = '%s.%s.png' % (stem, color.name)
+        if os.path.exists(mask_path):
+            truth = loadMask(mask_path)
+            scores[color.name] = (int(selected.sum()), int((selected & truth).sum()),
+                                  int((selected & ~truth).sum()), int((~selected & truth).sum()), True)
+        else:
+            scores[color.name] = (int(selected.sum()), 0, 0, 0, False)
+    return yuv.shape[0] * yuv.shape[1], scores
+
+def frames(directory):
+    """Returns the frames of a directory, leaving out the masks"""
+    result = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        stem, extension = os.path.splitext(path)
+        if extension.lower() in IMAGE_EXTENSIONS and '.' not in os.path.basename(stem):
+            result.append(path)
+    return result
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] colors.txt frames_dir")
+    parser.add_option('-j', '--jobs', type='int', default=cpu_count(), help="worker processes [%default]")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected a colors file and a frames directory")
+    colors_file, frames_dir = args
+
+    paths = frames(frames_dir)
+    if not paths:
+        sys.exit("No frames found in %s" % frames_dir)
+    names = [color.name for color in readColorsFile(colors_file)]
+    totals = dict((name, [0, 0, 0, 0, 0]) for name in names) # selected, tp, fp, fn, frames with a mask
+    pixels = 0
+    pool = Pool(options.jobs, initWorker, (colors_file,))
+    try:
+        for frame_pixels, scores in pool.imap_unordered(scoreFrame, paths, chunksize=4):
+            pixels += frame_pixels
+            for name, (selected, tp, fp, fn, has_mask) in scores.items():
+                total = totals[name]
+                total[0] += selected
+                if has_mask:
+                    total[1] += tp
+                    total[2] += fp
+                    total[3] += fn
+                    total[4] += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    print "%d frames, %d pixels" % (len(paths), pixels)
+    print "%-10s %10s %10s %10s %10s %8s" % ("color", "selected", "precision", "recall", "F1", "masks")
+    for name in names:
+        selected, tp, fp, fn, masks = totals[name]
+        if masks:
+            precision = tp / float(tp + fp) if tp + fp else 0.0
+            recall = tp / float(tp + fn) if tp + fn else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            print "%-10s %9.3f%% %10.3f %10.3f %10.3f %8d" % (name, 100.0 * selected / pixels, precision, recall, f1, masks)
+        else:
+            print "%-10s %9.3f%% %10s %10s %10s %8d" % (name, 100.0 * selected / pixels, "-", "-", "-", 0)
@@ -0,0 +1,102 @@
+"""
+blob_array.py - NumPy representation of cmvision/Blob arrays
+
+A Blob is ten little endian uint32 (40 bytes), so the blobs region of a serialized
+Blobs message can be viewed directly as a structured array with BLOB_DTYPE. The
+arrays returned by blobsFromBuffer are numpy.recarray views, so blobs[i].x works
+like it does on a list of cmvision.msg.Blob. NumpyBlobs is a cmvision/Blobs that
+serializes and deserializes its blobs with them.
+"""
+
+import struct
+
+import numpy
+import roslib.message
+
+from cmvision.msg import Blobs
+
+BLOB_FIELDS = ('red', 'green', 'blue', 'area', 'x', 'y', 'left', 'right', 'top', 'bottom')
+BLOB_DTYPE = numpy.dtype([(name, '<u4') for name in BLOB_FIELDS])
+BLOB_SIZE = BLOB_DTYPE.itemsize # 40 bytes
+
+_struct_I = roslib.message.struct_I
+_struct_3I = struct.Struct("<3I")
+
+def blobsFromBuffer(buff, offset, count):
+    """Returns a read only record array viewing count blobs of buff starting at offset, no copy is made"""
+    if len(buff) < offset + count * BLOB_SIZE:
+        raise ValueError("buffer too short for %d blobs" % count)
+    return numpy.frombuffer(buff, BLOB_DTYPE, count, offset).view(numpy.recarray)
+
+def blobsToArray(blobs):
+    """Converts a list of cmvision.msg.Blob, a BLOB_DTYPE array or a (N, 10) integer array to a BLOB_DTYPE array"""
+    if isinstance(blobs, numpy.ndarray):
+        if blobs.dtype.fields is None:
+            # Plain integer array, one row per blob in .msg order
+            return numpy.ascontiguousarray(blobs, '<u4').reshape(-1, len(BLOB_FIELDS)).view(BLOB_DTYPE).reshape(-1)
+        return numpy.ascontiguousarray(blobs, BLOB_DTYPE)
+    return numpy.array([(b.red, b.green, b.blue, b.area, b.x, b.y, b.left, b.right, b.top, b.bottom)
+                        for b in blobs], BLOB_DTYPE)
+
+def blobsToBytes(blobs):
+    """Returns the wire representation of the blobs array (without its length prefix)"""
+    return blobsToArray(blobs).tobytes()
+
+def serializeBlobs(msg, buff):
+    """Writes a Blobs message whose blobs are a list of Blob or any array blobsToArray takes"""
+    try:
+        buff.write(_struct_3I.pack(msg.header.seq, msg.header.stamp.secs, msg.header.stamp.nsecs))
+        frame_id = msg.header.frame_id
+        buff.write(struct.pack('<I%ss' % len(frame_id), len(frame_id), frame_id))
+        buff.write(_struct_3I.pack(msg.image_width, msg.image_height, msg.blob_count))
+        buff.write(_struct_I.pack(len(msg.blobs)))
+        buff.write(blobsToBytes(msg.blobs))
+    except struct.error, se: msg._check_types(se)
+    except TypeError, te: msg._check_types(te)
+
+def deserializeBlobs(msg, str):
+    """Fills a Blobs message from str, its blobs become a zero-copy record array"""
+    try:
+        end = 0
+        start = end
+        end += 12
+        (msg.header.seq, msg.header.stamp.secs, msg.header.stamp.nsecs,) = _struct_3I.unpack(str[start:end])
+        start = end
+        end += 4
+        (length,) = _struct_I.unpack(str[start:end])
+        start = end
+        end += length
+        msg.header.frame_id = str[start:end]
+        start = end
+        end += 12
+        (msg.image_width, msg.image_height, msg.blob_count,) = _struct_3I.unpack(str[start:end])
+        start = end
+        end += 4
+        (length,) = _struct_I.unpack(str[start:end])
+        msg.blobs = blobsFromBuffer(str, end, length)
+        return msg
+    except (struct.error, ValueError), e:
+        raise roslib.message.DeserializationError(e) #most likely buffer underfill
+
+class NumpyBlobs(Blobs):
+    """cmvision/Blobs whose blobs are a BLOB_DTYPE record array, like rospy.numpy_msg(Blobs)
+
+    It has the same type and md5sum as cmvision/Blobs, so it is subscribed or
+    published in place of it:
+
+      rospy.Subscriber('blobs', NumpyBlobs, callback)
+
+    The generated cmvision.msg.Blobs is left as genmsg writes it, the codec lives here.
+    """
+
+    def serialize(self, buff):
+        serializeBlobs(self, buff)
+
+    def deserialize(self, str):
+        return deserializeBlobs(self, str)
+
+    def serialize_numpy(self, buff, numpy):
+        serializeBlobs(self, buff)
+
+    def deserialize_numpy(self, str, numpy):
+        return deserializeBlobs(self, str)
@@ -0,0 +1,147 @@
+"""
+blob_tracking.py - Multi-frame tracker for cmvision blobs
+
+Tracks live in parallel NumPy arrays (one row per track). Each frame, the tracks are
+predicted with a constant velocity model, then matched to the blobs of the same color
+with a gated centroid distance cost matrix. Matching takes the mutual nearest
+track/blob pairs of the whole matrix at once and repeats on what is left, so there is
+no Python loop over blobs. Matched tracks are smoothed with an alpha-beta filter,
+unmatched ones coast until they miss too many frames, and unmatched blobs start new
+tracks with new IDs.
+"""
+
+import numpy
+
+def packColors(red, green, blue):
+    """Packs color channels into one uint32 per blob so they can be compared at once"""
+    return (numpy.asarray(red, numpy.uint32) << 16) | (numpy.asarray(green, numpy.uint32) << 8) | numpy.asarray(blue, numpy.uint32)
+
+def associate(predicted, centroids, gate_distance):
+    """Matches predicted track positions to blob centroids (both (N, 2) arrays)
+
+    Returns (track_indices, blob_indices) of the matched pairs. Pairs further apart
+    than gate_distance are never matched.
+    """
+    n, m = len(predicted), len(centroids)
+    if n == 0 or m == 0:
+        return numpy.zeros(0, numpy.intp), numpy.zeros(0, numpy.intp)
+    cost = numpy.hypot(predicted[:, 0, None] - centroids[None, :, 0],
+                       predicted[:, 1, None] - centroids[None, :, 1])
+    cost[cost > gate_distance] = numpy.inf
+    rows = numpy.arange(n)
+    tracks = []
+    blobs = []
+    while True:
+        best_blob = cost.argmin(axis=1)
+        best_cost = cost[rows, best_blob]
+        best_track = cost.argmin(axis=0)
+        # The smallest finite entry is always mutual, so every pass makes progress
+        mutual = (best_track[best_blob] == rows) & numpy.isfinite(best_cost)
+        if not mutual.any():
+            break
+        t = rows[mutual]
+        b = best_blob[mutual]
+        tracks.append(t)
+        blobs.append(b)
+        cost[t, :] = numpy.inf
+        cost[:, b] = numpy.inf
+    if not tracks:
+        return numpy.zeros(0, numpy.intp), numpy.zeros(0, numpy.intp)
+    return numpy.concatenate(tracks), numpy.concatenate(blobs)
+
+class BlobTracker(object):
+    """Gives blobs a stable ID across frames"""
+
+    def __init__(self, gate_distance=50.0, max_misses=5, min_hits=2, position_gain=0.6, velocity_gain=0.2):
+        self.gate_distance = gate_distance # pixels
+        self.max_misses = max_misses # frames a track can coast before it is dropped
+        self.min_hits = min_hits # frames a track has to be seen before it is reported
+        self.position_gain = position_gain # alpha
+        self.velocity_gain = velocity_gain # beta
+        self.next_id = 0
+        self.last_stamp = None
+        self.ids = numpy.zeros(0, numpy.int64)
+        self.colors = numpy.zeros(0, numpy.uint32)
+        self.positions = numpy.zeros((0, 2))
+        self.velocities = numpy.zeros((0, 2))
+        self.areas = numpy.zeros(0, numpy.uint32)
+        self.hits = numpy.zeros(0, numpy.int32)
+        self.misses = numpy.zeros(0, numpy.int32)
+        self.ages = numpy.zeros(0, numpy.int32) # frames since the track was started
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, stamp, colors, centroids, areas):
+        """Updates the tracks with one frame of blobs
+
+        stamp is in seconds, colors are packed with packColors, centroids is (N, 2) and
+        areas is (N,). Returns the indices of the tracks to report (see confirmed()).
+        """
+        colors = numpy.asarray(colors, numpy.uint32)
+        centroids = numpy.asarray(centroids, numpy.float64).reshape(-1, 2)
+        areas = numpy.asarray(areas, numpy.uint32)
+        dt = 0.0 if self.last_stamp is None else max(0.0, stamp - self.last_stamp)
+        self.last_stamp = stamp
+
+        predicted = self.positions + self.velocities * dt
+        matched_tracks = []
+        matched_blobs = []
+        for color in numpy.intersect1d(self.colors, colors):
+            track_rows = numpy.flatnonzero(self.colors == color)
+            blob_rows = numpy.flatnonzero(colors == color)
+            t, b = associate(predicted[track_rows], centroids[blob_rows], self.gate_distance)
+            matched_tracks.append(track_rows[t])
+            matched_blobs.append(blob_rows[b])
+        if matched_tracks:
+            matched_tracks = numpy.concatenate(matched_tracks)
+            matched_blobs = numpy.concatenate(matched_blobs)
+        else:
+            matched_tracks = numpy.zeros(0, numpy.intp)
+            matched_blobs = numpy.zeros(0, numpy.intp)
+
+        # Alpha-beta update of the matched tracks, the others coast on their prediction
+        residual = centroids[matched_blobs] - predicted[matched_tracks]
+        self.positions = predicted
+        self.positions[matched_tracks] += self.position_gain * residual
+        if dt > 0.0:
+            self.velocities[matched_tracks] += (self.velocity_gain / dt) * residual
+        self.areas[matched_tracks] = areas[matched_blobs]
+        self.hits[matched_tracks] += 1
+        seen = numpy.zeros(len(self.ids), bool)
+        seen[matched_tracks] = True
+        self.misses[seen] = 0
+        self.misses[~seen] += 1
+        self.ages += 1
+
+        # Drop the tracks that were lost for too long
+        keep = self.misses <= self.max_misses
+        if not keep.all():
+            self.ids = self.ids[keep]
+            self.colors = self.colors[keep]
+            self.positions = self.positions[keep]
+            self.velocities = self.velocities[keep]
+            self.areas = self.areas[keep]
+            self.hits = self.hits[keep]
+            self.misses = self.misses[keep]
+            self.ages = self.ages[keep]
+
+        # Start new tracks with the blobs nobody claimed
+        new = numpy.ones(len(colors), bool)
+        new[matched_blobs] = False
+        count = int(new.sum())
+        if count:
+            self.ids = numpy.concatenate((self.ids, numpy.arange(self.next_id, self.next_id + count)))
+            self.next_id += count
+            self.colors = numpy.concatenate((self.colors, colors[new]))
+            self.positions = numpy.concatenate((self.positions, centroids[new]))
+            self.velocities = numpy.concatenate((self.velocities, numpy.zeros((count, 2))))
+            self.areas = numpy.concatenate((self.areas, areas[new]))
+            self.hits = numpy.concatenate((self.hits, numpy.ones(count, numpy.int32)))
+            self.misses = numpy.concatenate((self.misses, numpy.zeros(count, numpy.int32)))
+            self.ages = numpy.concatenate((self.ages, numpy.ones(count, numpy.int32)))
+        return self.confirmed()
+
+    def confirmed(self):
+        """Indices of the tracks seen in this frame and at least min_hits times"""
+        return numpy.flatnonzero((self.misses == 0) & (self.hits >= self.min_hits))
@@ -0,0 +1,117 @@
+"""
+color_thresholds.py - Reads, writes, fits and applies cmvision color threshold files
+
+The YUV conversion matches rgb2uyvy() in conversions.c (integer RGB2YUV coefficients,
+u and v averaged over horizontal pixel pairs), so a threshold box fitted here selects
+the same pixels in the cmvision node.
+"""
+
+import re
+
+import numpy
+
+COLOR_LINE = re.compile(r'\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)\s+([-+.\deE]+)\s+(\d+)\s+(\S+)')
+THRESHOLD_LINE = re.compile(r'\(\s*(\d+)\s*:\s*(\d+)\s*,\s*(\d+)\s*:\s*(\d+)\s*,\s*(\d+)\s*:\s*(\d+)\s*\)')
+
+class ColorClass(object):
+    """One entry of a colors.txt file"""
+    def __init__(self, name, color=(255, 255, 255), merge=0.0, expected=10, threshold=(0, 255, 0, 255, 0, 255)):
+        self.name = name
+        self.color = tuple(color) # display color (red, green, blue)
+        self.merge = merge
+        self.expected = expected
+        self.threshold = tuple(threshold) # (y_low, y_high, u_low, u_high, v_low, v_high)
+
+    def __repr__(self):
+        return "ColorClass(%r, %r, %r, %r, %r)" % (self.name, self.color, self.merge, self.expected, self.threshold)
+
+def readColorsFile(path):
+    """Parses a colors.txt file the same way CMVision::loadOptions does"""
+    colors = []
+    thresholds = []
+    state = None
+    for line in open(path):
+        line = line.strip()
+        if line.lower().startswith('[colors]'):
+            state = 'colors'
+        elif line.lower().startswith('[thresholds]'):
+            state = 'thresholds'
+        elif state == 'colors' and COLOR_LINE.match(line):
+            r, g, b, merge, expected, name = COLOR_LINE.match(line).groups()
+            colors.append(ColorClass(name, (int(r), int(g), int(b)), float(merge), int(expected)))
+        elif state == 'thresholds' and THRESHOLD_LINE.match(line):
+            thresholds.append(tuple(int(value) for value in THRESHOLD_LINE.match(line).groups()))
+    # Thresholds are matched to colors by position, extra ones belong to no color
+    for color, threshold in zip(colors, thresholds):
+        color.threshold = threshold
+    return colors
+
+def writeColorsFile(path, colors):
+    """Writes a colors.txt file in the CMVision::saveOptions format"""
+    out = open(path, 'w')
+    try:
+        out.write("[Colors]\n")
+        for c in colors:
+            out.write("(%3d,%3d,%3d) %6.4f %d %s\n" % (c.color[0], c.color[1], c.color[2], c.merge, c.expected, c.name))
+        out.write("\n[Thresholds]\n")
+        for c in colors:
+            out.write("(%3d:%3d,%3d:%3d,%3d:%3d)\n" % c.threshold)
+    finally:
+        out.close()
+
+def rgbToYuv(image):
+    """Converts an (H, W, 3) RGB uint8 image to an (H, W, 3) uint8 YUV image like rgb2uyvy()"""
+    rgb = numpy.asarray(image, numpy.int32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = (306 * r + 601 * g + 117 * b) >> 10
+    u = ((-172 * r - 340 * g + 512 * b) >> 10) + 128
+    v = ((512 * r - 429 * g - 83 * b) >> 10) + 128
+    y, u, v = [numpy.clip(channel, 0, 255) for channel in (y, u, v)]
+    # u and v are shared by each horizontal pair of pixels
+    pairs = (u.shape[1] // 2) * 2
+    for channel in (u, v):
+        mean = (channel[:, 0:pairs:2] + channel[:, 1:pairs:2]) >> 1
+        channel[:, 0:pairs:2] = mean
+        channel[:, 1:pairs:2] = mean
+    return numpy.dstack((y, u, v)).astype(numpy.uint8)
+
+def fitThreshold(yuv_pixels, coverage=0.98, margin=2):
+    """Fits a threshold box around (N, 3) YUV samples
+
+    Each channel is histogrammed and the box keeps the central coverage fraction of the
+    samples, widened by margin levels on each side. Returns
+    (y_low, y_high, u_low, u_high, v_low, v_high).
+    """
+    yuv_pixels = numpy.asarray(yuv_pixels, numpy.uint8).reshape(-1, 3)
+    if len(yuv_pixels) == 0:
+        raise ValueError("no samples to fit a threshold to")
+    tail = (1.0 - coverage) / 2.0 * len(yuv_pixels)
+    threshold = []
+    for channel in range(3):
+        cumulative = numpy.cumsum(numpy.bincount(yuv_pixels[:, channel], minlength=256))
+        low = int(numpy.searchsorted(cumulative, tail, side='right'))
+        high = int(numpy.searchsorted(cumulative, len(yuv_pixels) - tail, side='left'))
+        threshold.extend((max(0, low - margin), min(255, max(low, high) + margin)))
+    return tuple(threshold)
+
+def classify(yuv, threshold):
+    """Returns the boolean mask of the pixels of yuv inside a threshold box"""
+    y_low, y_high, u_low, u_high, v_low, v_high = threshold
+    y, u, v = yuv[..., 0], yuv[..., 1], yuv[..., 2]
+    return (y >= y_low) & (y <= y_high) & (u >= u_low) & (u <= u_high) & (v >= v_low) & (v <= v_high)
+
+def loadImage(path):
+    """Loads an image file as an (H, W, 3) RGB uint8 array"""
+    import cv2
+    image = cv2.imread(path, 1) # BGR
+    if image is None:
+        raise IOError("Could not read image %s" % path)
+    return image[:, :, ::-1]
+
+def loadMask(path):
+    """Loads a mask image as a boolean array (any non zero pixel is set)"""
+    import cv2
+    mask = cv2.imread(path, 0)
+    if mask is None:
+        raise IOError("Could not read mask %s" % path)
+    return mask > 0
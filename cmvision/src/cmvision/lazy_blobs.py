@@ -0,0 +1,174 @@
+"""
+lazy_blobs.py - cmvision/Blobs variant that only decodes the blobs that are used
+
+LazyBlobs.deserialize parses the header, the image size and the blob count right away
+and keeps the serialized buffer. msg.blobs is then a BlobSequence that decodes a Blob
+when it is indexed or iterated, and the vectorized accessors (areas, centroids, ...)
+read the fields straight out of the buffer with NumPy. It has the same type and md5sum
+as cmvision/Blobs, so it can be used anywhere a Blobs is subscribed:
+
+  rospy.Subscriber('blobs', LazyBlobs, callback)
+"""
+
+import struct
+
+import roslib.message
+from cmvision.msg import Blob, Blobs
+
+_struct_I = roslib.message.struct_I
+_struct_3I = struct.Struct("<3I")
+_struct_10I = struct.Struct("<10I")
+_BLOB_SIZE = _struct_10I.size
+
+# The 'blobs' slot of Blobs, LazyBlobs puts a property in front of it
+_blobs_slot = Blobs.__dict__['blobs']
+
+class BlobSequence(object):
+    """Read only sequence of blobs decoded from a serialized buffer on access"""
+    __slots__ = ('_buff', '_offset', '_count')
+
+    def __init__(self, buff, offset, count):
+        self._buff = buff
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("blob index out of range")
+        return Blob(*_struct_10I.unpack_from(self._buff, self._offset + index * _BLOB_SIZE))
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield Blob(*_struct_10I.unpack_from(self._buff, self._offset + i * _BLOB_SIZE))
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def raw(self):
+        """Returns the serialized blobs region"""
+        return self._buff[self._offset:self._offset + self._count * _BLOB_SIZE]
+
+    def array(self):
+        """Returns a zero-copy cmvision.blob_array record array of all the blobs"""
+        from cmvision import blob_array
+        return blob_array.blobsFromBuffer(self._buff, self._offset, self._count)
+
+class LazyBlobs(Blobs):
+    """cmvision/Blobs that defers decoding the blobs until they are used"""
+
+    def _get_blobs(self):
+        blobs = _blobs_slot.__get__(self, Blobs)
+        if blobs is None:
+            # Not decoded yet, hand out a view over the buffer
+            blobs = BlobSequence(self._buff, self._blobs_offset, self._blobs_length)
+        return blobs
+
+    def _set_blobs(self, blobs):
+        self._buff = None
+        _blobs_slot.__set__(self, blobs)
+
+    blobs = property(_get_blobs, _set_blobs)
+
+    def isLazy(self):
+        """True while the blobs are still the ones from the serialized buffer"""
+        return getattr(self, '_buff', None) is not None
+
+    def deserialize(self, str):
+        """
+        unpack the fixed part of the serialized message in str and keep the blobs for later
+        @param str: byte array of serialized message
+        @type  str: str
+        """
+        try:
+            end = 0
+            start = end
+            end += 12
+            (self.header.seq, self.header.stamp.secs, self.header.stamp.nsecs,) = _struct_3I.unpack(str[start:end])
+            start = end
+            end += 4
+            (length,) = _struct_I.unpack(str[start:end])
+            start = end
+            end += length
+            self.header.frame_id = str[start:end]
+            start = end
+            end += 12
+            (self.image_width, self.image_height, self.blob_count,) = _struct_3I.unpack(str[start:end])
+            start = end
+            end += 4
+            (length,) = _struct_I.unpack(str[start:end])
+        except struct.error, e:
+            raise roslib.message.DeserializationError(e) #most likely buffer underfill
+        if len(str) < end + length * _BLOB_SIZE:
+            raise roslib.message.DeserializationError("buffer underfill in the blobs region")
+        _blobs_slot.__set__(self, None)
+        self._buff = str
+        self._blobs_offset = end
+        self._blobs_length = length
+        return self
+
+    def deserialize_numpy(self, str, numpy):
+        """Same as deserialize, the blobs are already available as arrays through array()"""
+        return self.deserialize(str)
+
+    def serialize(self, buff):
+        """Copies the blobs region as is when it was not replaced"""
+        if not self.isLazy():
+            return Blobs.serialize(self, buff)
+        try:
+            buff.write(_struct_3I.pack(self.header.seq, self.header.stamp.secs, self.header.stamp.nsecs))
+            frame_id = self.header.frame_id
+            buff.write(struct.pack('<I%ss' % len(frame_id), len(frame_id), frame_id))
+            buff.write(_struct_3I.pack(self.image_width, self.image_height, self.blob_count))
+            buff.write(_struct_I.pack(self._blobs_length))
+            buff.write(self._buff[self._blobs_offset:self._blobs_offset + self._blobs_length * _BLOB_SIZE])
+        except struct.error, se: self._check_types(se)
+        except TypeError, te: self._check_types(te)
+
+    def serialize_numpy(self, buff, numpy):
+        """Same as serialize, replaced blobs may also be a cmvision.blob_array array"""
+        if not self.isLazy():
+            from cmvision import blob_array
+            return blob_array.serializeBlobs(self, buff)
+        return self.serialize(buff)
+
+    def array(self):
+        """Returns all the blobs as a cmvision.blob_array record array"""
+        if self.isLazy():
+            return self.blobs.array()
+        from cmvision import blob_array
+        return blob_array.blobsToArray(self.blobs)
+
+    def areas(self):
+        """Returns the area of every blob as a NumPy array"""
+        return self.array()['area']
+
+    def centroids(self):
+        """Returns an (N, 2) float NumPy array with the x, y centroid of every blob"""
+        import numpy
+        blobs = self.array()
+        return numpy.column_stack((blobs['x'], blobs['y'])).astype(numpy.float64)
+
+    def colors(self):
+        """Returns an (N, 3) NumPy array with the red, green, blue color of every blob"""
+        import numpy
+        blobs = self.array()
+        return numpy.column_stack((blobs['red'], blobs['green'], blobs['blue']))
+
+    def largest(self):
+        """Returns the blob with the largest area, or None if there are no blobs"""
+        if len(self.blobs) == 0:
+            return None
+        return self.blobs[int(self.areas().argmax())]